@@ -61,6 +61,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     "corsheaders.middleware.CorsMiddleware",
+    'galv.middleware.RequestDecompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -138,6 +139,11 @@ USE_TZ = True
 
 DATA_UPLOAD_MAX_MEMORY_SIZE = 100000000
 
+# Stage data chunks uploaded by Harvesters for `manage.py ingest_worker` to write,
+# rather than writing them while the Harvester waits
+INGEST_QUEUE = os.environ.get('DJANGO_INGEST_QUEUE', "FALSE").upper()[0] != "F"
+INGEST_WORKERS = int(os.environ.get('DJANGO_INGEST_WORKERS', 2))
+
 
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/4.1/howto/static-files/
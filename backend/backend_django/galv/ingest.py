@@ -0,0 +1,338 @@
+# SPDX-License-Identifier: BSD-2-Clause
+# Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
+# of Oxford, and the 'Galv' Developers. All rights reserved.
+
+"""
+Bulk loading of timeseries chunks with PostgreSQL's COPY ... FROM STDIN.
+
+Values are written in COPY's text format, so they are parsed straight into
+the chunk tables without being built into an SQL statement first.
+
+Chunks sent in an UploadSession can instead be staged, and written later
+by `manage.py ingest_worker`, so that the request that sent them returns quickly.
+"""
+
+import io
+import math
+import numpy
+from django.db import connection, transaction, IntegrityError
+from django.db.models import Count, F, Min, Sum
+from django.db.models.functions import Length
+
+from .models import DataColumn, Dataset, FileState, HarvestError, ObservedFile, StagedChunk, UploadSession, \
+    get_timeseries_handler_by_type
+from .parsers import ColumnarParser, encode_columnar
+
+# Characters that must be escaped in COPY text format fields
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def _float_element(v) -> str:
+    if v is None:
+        return 'NULL'
+    v = float(v)
+    if math.isfinite(v):
+        return repr(v)
+    if math.isnan(v):
+        return 'NaN'
+    return 'Infinity' if v > 0 else '-Infinity'
+
+
+def _int_element(v) -> str:
+    return 'NULL' if v is None else str(int(v))
+
+
+def _str_element(v) -> str:
+    if v is None:
+        return 'NULL'
+    # Quoted so that strings such as "NULL" and "" are not mistaken for other values
+    return '"' + str(v).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+ELEMENT_FORMATTERS = {
+    'float': _float_element,
+    'int': _int_element,
+    'str': _str_element,
+}
+
+
+def array_literal(values: list, data_type: str) -> str:
+    """
+    The values as a PostgreSQL array literal, escaped for COPY's text format
+    """
+    literal = '{' + ','.join(map(ELEMENT_FORMATTERS[data_type], values)) + '}'
+    return literal.translate(COPY_ESCAPES) if data_type == 'str' else literal
+
+
+class LineReader:
+    """
+    A file-like object that reads lines from an iterator,
+    so that COPY data are produced as they are sent rather than all at once
+    """
+    def __init__(self, lines):
+        self.lines = iter(lines)
+        self.buffer = ''
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self.buffer) < size:
+            try:
+                self.buffer += next(self.lines)
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def next_chunk_positions(handler, columns: list[DataColumn]) -> dict:
+    """
+    The chunk_index and first_sample of the next chunk of each column,
+    found from the columns' last chunks in a single query
+    """
+    positions = {column.id: (0, 0) for column in columns}
+    last_chunks = handler.objects.filter(column__in=columns)\
+        .order_by('column_id', '-chunk_index')\
+        .distinct('column_id')\
+        .values('column_id', 'chunk_index', 'first_sample', 'values__len')
+    for chunk in last_chunks:
+        positions[chunk['column_id']] = (
+            chunk['chunk_index'] + 1,
+            chunk['first_sample'] + (chunk['values__len'] or 0)
+        )
+    return positions
+
+
+def copy_chunks(columns_values: list[tuple[DataColumn, list]]):
+    """
+    Append each list of values to its column as a new chunk.
+    All the chunks are written in one transaction, with one COPY for each timeseries table.
+    """
+    by_handler = {}
+    for column, values in columns_values:
+        if len(values):
+            handler = get_timeseries_handler_by_type(column.data_type)
+            by_handler.setdefault(handler, []).append((column, values))
+    with transaction.atomic():
+        for handler, handler_columns in by_handler.items():
+            # Lock the columns so concurrent uploads can't claim the same chunk positions
+            list(DataColumn.objects.select_for_update().filter(id__in=[c.id for c, _ in handler_columns]))
+            positions = next_chunk_positions(handler, [c for c, _ in handler_columns])
+
+            def lines():
+                for column, values in handler_columns:
+                    chunk_index, first_sample = positions[column.id]
+                    # A column may be sent more than once in the same upload
+                    positions[column.id] = (chunk_index + 1, first_sample + len(values))
+                    yield f"{column.id}\t{chunk_index}\t{first_sample}\t{array_literal(values, column.data_type)}\n"
+
+            meta = handler._meta
+            fields = ', '.join(
+                connection.ops.quote_name(meta.get_field(name).column)
+                for name in ['column', 'chunk_index', 'first_sample', 'values']
+            )
+            with connection.cursor() as cursor:
+                cursor.copy_expert(
+                    f"COPY {connection.ops.quote_name(meta.db_table)} ({fields}) FROM STDIN",
+                    LineReader(lines())
+                )
+
+
+def update_row_counts(dataset: Dataset, core_metadata: dict):
+    """
+    Save the row counts in core_metadata to the Dataset; some parsers only count rows as they read the data
+    """
+    dataset.json_data = {
+        **(dataset.json_data or {}),
+        **{k: v for k, v in core_metadata.items() if k in ['num_rows', 'first_sample_no', 'last_sample_no']}
+    }
+    dataset.save()
+
+
+def session_column(session: UploadSession, column_data: dict) -> DataColumn:
+    """
+    The Column a chunk sent in an UploadSession names by id.
+    Only the Column's id and data_type are filled in, so no query is made.
+    Raises ValueError if the Column was not declared in the session.
+    """
+    data_type = session.columns.get(str(column_data.get('column')))
+    if data_type is None:
+        raise ValueError(f"Column {column_data.get('column')} is not part of the upload session")
+    return DataColumn(id=int(column_data['column']), data_type=data_type)
+
+
+class OutOfSequenceError(ValueError):
+    """
+    A chunk arrived before the chunks numbered before it were written
+    """
+    pass
+
+
+def chunk_sequence(content: dict) -> int:
+    """
+    The sequence number of a chunk sent in an UploadSession
+    """
+    try:
+        return int(content['sequence'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Chunks sent in an upload session must include their sequence number")
+
+
+def check_samples(session: UploadSession, content: dict, columns_values: list[tuple[DataColumn, list]]):
+    """
+    Check that each Column's values cover the chunk's samples, and that they follow on from
+    the samples already written to the Column during the session, and record the samples as written.
+    Samples are counted from the start of the session; content['samples'] is [start, stop).
+    """
+    try:
+        start, stop = (int(s) for s in content['samples'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Chunks sent in an upload session must give their samples as [start, stop]")
+    for column, values in columns_values:
+        if len(values) != stop - start:
+            raise ValueError(f"Column {column.id} has {len(values)} values for samples {start} to {stop}")
+        written = session.column_samples.get(str(column.id), 0)
+        if written != start:
+            raise ValueError(f"Column {column.id} has {written} samples written, but the chunk starts at {start}")
+        session.column_samples[str(column.id)] = stop
+
+
+def write_session_chunk(session: UploadSession, content: dict) -> bool:
+    """
+    Write the data, and any row counts, of a chunk sent in an UploadSession.
+    Returns False, writing nothing, if the chunk has been written already.
+    Raises OutOfSequenceError if chunks numbered before it have not been written.
+    """
+    sequence = chunk_sequence(content)
+    with transaction.atomic():
+        # Lock the session so a chunk sent twice at once is only written once
+        session = UploadSession.objects.select_for_update(no_key=True).select_related('dataset').get(id=session.id)
+        if sequence < session.next_sequence:
+            return False
+        if sequence > session.next_sequence:
+            raise OutOfSequenceError(f"Chunk {sequence} was sent before chunk {session.next_sequence}")
+        columns_values = []
+        for column_data in content.get('data', []):
+            values = column_data['values']
+            if isinstance(values, numpy.ndarray):
+                # Sent in the columnar format
+                values = values.tolist()
+            columns_values.append((session_column(session, column_data), values))
+        check_samples(session, content, columns_values)
+        copy_chunks(columns_values)
+        session.next_sequence += 1
+        session.save(update_fields=['next_sequence', 'column_samples'])
+        if 'core_metadata' in content:
+            update_row_counts(session.dataset, content['core_metadata'])
+    return True
+
+
+def stage_chunk(session: UploadSession, content: dict) -> bool:
+    """
+    Keep a chunk sent in an UploadSession to be written by an ingest worker.
+    The chunk's columns are checked straight away, so a chunk that can't be written is refused.
+    Returns False, staging nothing, if the chunk has been staged or written already.
+    """
+    sequence = chunk_sequence(content)
+    if sequence < session.next_sequence:
+        return False
+    for column_data in content.get('data', []):
+        session_column(session, column_data)
+    try:
+        with transaction.atomic():
+            StagedChunk.objects.create(
+                session=session,
+                sequence=sequence,
+                body=encode_columnar({'content': content})
+            )
+    except IntegrityError:
+        if StagedChunk.objects.filter(session=session, sequence=sequence).exists():
+            return False
+        raise
+    return True
+
+
+def first_missing_chunk(session: UploadSession) -> int:
+    """
+    The sequence number of the first chunk in the session that has been neither written nor staged
+    """
+    missing = session.next_sequence
+    for sequence in session.pending_chunks().order_by('sequence').values_list('sequence', flat=True):
+        if sequence != missing:
+            break
+        missing += 1
+    return missing
+
+
+def end_upload(session: UploadSession):
+    """
+    Mark the session's upload as over, discarding staged chunks that can never be written
+    because a chunk numbered before them never arrived
+    """
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update(no_key=True).get(id=session.id)
+        session.staged_chunks.filter(sequence__gt=first_missing_chunk(session)).delete()
+        session.completed = True
+        session.save(update_fields=['completed'])
+
+
+def take_staged_chunk() -> StagedChunk | None:
+    """
+    Lock a staged chunk that is next in its upload session's sequence and that no other worker is writing.
+    Only the next chunk of each session can be taken, so each session's chunks are written in order.
+    """
+    return StagedChunk.objects.select_for_update(skip_locked=True, of=('self',))\
+        .select_related('session', 'session__file')\
+        .filter(sequence=F('session__next_sequence'))\
+        .order_by('id')\
+        .first()
+
+
+def ingest_staged_chunk() -> bool:
+    """
+    Write the next staged chunk, returning False if there was none to write.
+    If the chunk can't be written, the import fails and the rest of its session's chunks are discarded.
+    Once the last chunk of a completed session is written, the import is complete.
+    """
+    with transaction.atomic():
+        chunk = take_staged_chunk()
+        if chunk is None:
+            return False
+        session = chunk.session
+        file = session.file
+        error = None
+        try:
+            with transaction.atomic():
+                content = ColumnarParser().parse(io.BytesIO(bytes(chunk.body)))['content']
+                write_session_chunk(session, content)
+        except Exception as e:
+            error = e
+        chunk.delete()
+        # Lock the session so the Harvester's report that the upload is complete can't be missed
+        session = UploadSession.objects.select_for_update(no_key=True).filter(id=session.id).first()
+        if session is None:
+            return True
+        if error is not None:
+            ObservedFile.objects.filter(id=file.id).update(state=FileState.IMPORT_FAILED)
+            HarvestError.objects.create(
+                harvester_id=file.harvester_id,
+                file=file,
+                error=f"Error saving data. {type(error)}: {error.args[0] if error.args else error}"
+            )
+            session.delete()
+        elif session.completed and not session.pending_chunks().exists():
+            ObservedFile.objects.filter(id=file.id, state=FileState.IMPORTING).update(state=FileState.IMPORTED)
+            session.delete()
+    return True
+
+
+def queue_depth() -> dict:
+    """
+    Number and size of the chunks waiting to be written, the sessions they belong to, and when the oldest arrived
+    """
+    return StagedChunk.objects.aggregate(
+        chunks=Count('id'),
+        bytes=Sum(Length('body')),
+        sessions=Count('session', distinct=True),
+        oldest=Min('created')
+    )
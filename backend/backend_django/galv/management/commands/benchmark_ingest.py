@@ -0,0 +1,91 @@
+# SPDX-License-Identifier: BSD-2-Clause
+# Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
+# of Oxford, and the 'Galv' Developers. All rights reserved.
+
+import time
+import uuid
+import numpy
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from galv.ingest import copy_chunks
+from galv.models import Harvester, ObservedFile, Dataset, DataUnit, DataColumnType, DataColumn, \
+    append_timeseries_values
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare how quickly timeseries chunks are stored with COPY and with the ORM's save(). "
+        "Everything written is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunks', type=int, default=20, help="Chunks uploaded for each column")
+        parser.add_argument('--rows', type=int, default=10_000, help="Rows in each chunk")
+        parser.add_argument('--float-columns', type=int, default=6)
+        parser.add_argument('--int-columns', type=int, default=2)
+        parser.add_argument('--str-columns', type=int, default=1)
+
+    def make_columns(self, dataset: Dataset, data_type: str, count: int) -> list[DataColumn]:
+        unit, _ = DataUnit.objects.get_or_create(symbol='benchmark')
+        column_type, _ = DataColumnType.objects.get_or_create(name='benchmark', unit=unit)
+        return [
+            DataColumn.objects.create(dataset=dataset, type=column_type, data_type=data_type, name=f"{data_type}_{i}")
+            for i in range(count)
+        ]
+
+    def make_values(self, data_type: str, start: int, rows: int) -> list:
+        if data_type == 'float':
+            return numpy.random.default_rng(start).normal(size=rows).tolist()
+        if data_type == 'int':
+            return list(range(start, start + rows))
+        return [('C', 'D', 'R')[i % 3] for i in range(start, start + rows)]
+
+    def run(self, name: str, store, options) -> float:
+        """
+        Upload options['chunks'] chunks of every column to a new dataset with store(columns_values),
+        returning the total time taken
+        """
+        harvester = Harvester.objects.create(name=f"benchmark_ingest {uuid.uuid4()}")
+        file = ObservedFile.objects.create(harvester=harvester, path=f"/benchmark/{name}")
+        dataset = Dataset.objects.create(file=file, date=timezone.now(), purpose='benchmark')
+        columns = [
+            *self.make_columns(dataset, 'float', options['float_columns']),
+            *self.make_columns(dataset, 'int', options['int_columns']),
+            *self.make_columns(dataset, 'str', options['str_columns']),
+        ]
+        seconds = 0.0
+        for chunk in range(options['chunks']):
+            start = chunk * options['rows']
+            columns_values = [(c, self.make_values(c.data_type, start, options['rows'])) for c in columns]
+            chunk_start = time.perf_counter()
+            store(columns_values)
+            seconds += time.perf_counter() - chunk_start
+        return seconds
+
+    def handle(self, *args, **options):
+        def save(columns_values):
+            with transaction.atomic():
+                for column, values in columns_values:
+                    append_timeseries_values(column, values)
+
+        rows = options['chunks'] * options['rows']
+        columns = options['float_columns'] + options['int_columns'] + options['str_columns']
+        self.stdout.write(f"Storing {options['chunks']} chunks of {options['rows']} rows in {columns} columns")
+        try:
+            with transaction.atomic():
+                for name, store in [('save', save), ('copy', copy_chunks)]:
+                    seconds = self.run(name, store, options)
+                    self.stdout.write((
+                        f"{name:>5}: {seconds:8.3f}s total, {seconds / options['chunks'] * 1000:8.1f}ms per chunk, "
+                        f"{rows / seconds:12.0f} rows/s, {rows * columns / seconds:12.0f} values/s"
+                    ))
+                raise Rollback
+        except Rollback:
+            pass
+        self.stdout.write(self.style.SUCCESS('Complete.'))
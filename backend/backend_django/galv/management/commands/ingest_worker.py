@@ -0,0 +1,85 @@
+# SPDX-License-Identifier: BSD-2-Clause
+# Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
+# of Oxford, and the 'Galv' Developers. All rights reserved.
+
+import multiprocessing
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+from django.utils import timezone
+
+from galv.ingest import ingest_staged_chunk, queue_depth
+
+# Longest wait, in seconds, before trying again after errors
+MAX_ERROR_BACKOFF = 60
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the data chunks Harvesters have staged when DJANGO_INGEST_QUEUE is set. "
+        "Several workers may run at once; each upload's chunks are always written in order."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=settings.INGEST_WORKERS,
+            help="Number of worker processes (default DJANGO_INGEST_WORKERS)"
+        )
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds to wait when there is no work")
+        parser.add_argument('--once', action='store_true', help="Exit once no chunks are waiting")
+        parser.add_argument('--status', action='store_true', help="Report the number of chunks waiting and exit")
+
+    def work(self, poll_interval: float, once: bool):
+        backoff = poll_interval
+        while True:
+            try:
+                worked = ingest_staged_chunk()
+            except Exception as e:
+                # e.g. the database connection was lost; the chunk stays staged for another try
+                self.stderr.write(f"Error writing staged chunk, retrying in {backoff:.0f}s. {type(e)}: {e}")
+                close_old_connections()
+                time.sleep(backoff)
+                backoff = min(backoff * 2, MAX_ERROR_BACKOFF)
+                continue
+            backoff = poll_interval
+            if not worked:
+                if once:
+                    return
+                time.sleep(poll_interval)
+
+    def handle(self, *args, **options):
+        if options['status']:
+            depth = queue_depth()
+            age = (timezone.now() - depth['oldest']).total_seconds() if depth['oldest'] else 0
+            self.stdout.write((
+                f"{depth['chunks']} chunks ({(depth['bytes'] or 0) / 1e6:.1f} MB) "
+                f"waiting in {depth['sessions']} uploads; oldest {age:.0f}s"
+            ))
+            return
+        workers = max(options['workers'], 1)
+        self.stdout.write(f"Starting {workers} ingest workers")
+        if workers == 1:
+            self.work(options['poll_interval'], options['once'])
+            return
+        # Each process must open its own database connection
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+
+        def start():
+            process = context.Process(target=self.work, args=(options['poll_interval'], options['once']))
+            process.start()
+            return process
+
+        processes = [start() for _ in range(workers)]
+        if options['once']:
+            for process in processes:
+                process.join()
+            return
+        # Workers that die are replaced, so staged chunks don't pile up unnoticed
+        while True:
+            time.sleep(options['poll_interval'])
+            for i, process in enumerate(processes):
+                if not process.is_alive():
+                    self.stderr.write(f"Ingest worker exited with code {process.exitcode}; restarting it")
+                    processes[i] = start()
@@ -0,0 +1,71 @@
+# SPDX-License-Identifier: BSD-2-Clause
+# Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
+# of Oxford, and the 'Galv' Developers. All rights reserved.
+
+import io
+import zlib
+
+from django.conf import settings
+from django.http import JsonResponse
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class RequestBodyTooLarge(ValueError):
+    pass
+
+
+def decompress(body: bytes, encoding: str, max_size: int) -> bytes:
+    """
+    Decompress a request body, refusing to inflate it beyond max_size bytes.
+    """
+    if encoding == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        out = decompressor.decompress(body, max_size + 1)
+        if len(out) > max_size or decompressor.unconsumed_tail:
+            raise RequestBodyTooLarge
+        return out
+    if encoding == 'zstd':
+        reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(body))
+        out = reader.read(max_size + 1)
+        if len(out) > max_size:
+            raise RequestBodyTooLarge
+        return out
+    raise ValueError(f"Unsupported Content-Encoding {encoding}")
+
+
+class RequestDecompressionMiddleware:
+    """
+    Transparently decompress request bodies sent with a Content-Encoding header.
+
+    Harvesters compress the data they upload because it is mostly numbers as text.
+    """
+    supported_encodings = ['gzip', 'zstd'] if zstandard is not None else ['gzip']
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        encoding = request.META.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+        if encoding and encoding != 'identity':
+            if encoding not in self.supported_encodings:
+                return JsonResponse({'error': f"Unsupported Content-Encoding {encoding}"}, status=415)
+            max_size = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+            try:
+                body = decompress(request.body, encoding, max_size)
+            except RequestBodyTooLarge:
+                return JsonResponse({'error': f"Decompressed request body exceeds {max_size} bytes"}, status=413)
+            except (zlib.error, EOFError, ValueError) as e:
+                return JsonResponse({'error': f"Unable to decompress request body: {e}"}, status=400)
+            except Exception as e:
+                if zstandard is not None and isinstance(e, zstandard.ZstdError):
+                    return JsonResponse({'error': f"Unable to decompress request body: {e}"}, status=400)
+                raise
+            request._body = body
+            request._stream = io.BytesIO(body)
+            request.META['CONTENT_LENGTH'] = str(len(body))
+            del request.META['HTTP_CONTENT_ENCODING']
+        return self.get_response(request)
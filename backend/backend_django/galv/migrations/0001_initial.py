@@ -0,0 +1,238 @@
+# Generated by Django 4.1.4 on 2026-10-17 01:25
+
+from django.conf import settings
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Cell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('display_name', models.TextField(help_text='Human-friendly identifier', null=True, unique=True)),
+                ('uid', models.TextField(help_text='Serial number or similar. Should be globally unique', unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CellFamily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.TextField(help_text='Human-friendly identifier', unique=True)),
+                ('form_factor', models.TextField(help_text='Physical shape of the cells')),
+                ('link_to_datasheet', models.TextField(help_text='Link to a detailed datasheet for these cells')),
+                ('anode_chemistry', models.TextField(help_text="Chemistry of the cells' anode")),
+                ('cathode_chemistry', models.TextField(help_text="Chemistry of the cells' cathode")),
+                ('nominal_capacity', models.FloatField(help_text='Nominal capacity of the cells (in amp hours)')),
+                ('nominal_cell_weight', models.FloatField(help_text='Nominal weight of the cells (in kilograms)')),
+                ('manufacturer', models.TextField(help_text="Name of the cells' manufacturer")),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DataColumn',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('official_sample_counter', models.BooleanField(default=False)),
+                ('data_type', models.TextField(help_text='Type of the data in this column')),
+                ('name', models.TextField(help_text='Column title e.g. in .tsv file headers')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Dataset',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.TextField(help_text='Human-friendly identifier', null=True)),
+                ('date', models.DateTimeField(help_text='Date and time of experiment. Time will be midnight if not specified in raw data')),
+                ('type', models.TextField(help_text='Format of the raw data', null=True)),
+                ('purpose', models.TextField(help_text='Type of the experiment')),
+                ('json_data', models.JSONField(help_text='Arbitrary additional metadata', null=True)),
+                ('cell', models.ForeignKey(help_text='Cell that generated this Dataset', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='datasets', to='galv.cell')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DataUnit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.TextField(help_text='Common name')),
+                ('symbol', models.TextField(help_text='Symbol')),
+                ('description', models.TextField(help_text='What the Unit signifies, and how it is used')),
+                ('is_default', models.BooleanField(default=False, help_text='Whether the Unit is included in the initial list of Units')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Harvester',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.TextField(help_text='Human-friendly Harvester identifier', unique=True)),
+                ('api_key', models.TextField(help_text='API access token for the Harvester', null=True)),
+                ('last_check_in', models.DateTimeField(help_text='Date and time of last Harvester contact', null=True)),
+                ('sleep_time', models.IntegerField(default=10, help_text='Seconds to sleep between Harvester cycles')),
+                ('admin_group', models.ForeignKey(help_text='Users authorised to make changes to the Harvester', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='editable_harvesters', to='auth.group')),
+                ('user_group', models.ForeignKey(help_text='Users authorised to create Paths on the Harvester', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='readable_harvesters', to='auth.group')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='KnoxAuthToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('knox_token_key', models.TextField(help_text='KnoxToken reference ([token_key]_[user_id]')),
+                ('name', models.TextField(help_text='Convenient human-friendly name')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='VouchFor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('new_user', models.ForeignKey(help_text='User needing approval', on_delete=django.db.models.deletion.DO_NOTHING, related_name='vouched_for', to=settings.AUTH_USER_MODEL)),
+                ('vouching_user', models.ForeignKey(help_text='User doing approving', on_delete=django.db.models.deletion.DO_NOTHING, related_name='vouched_by', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TimeseriesRangeLabel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('label', models.TextField(help_text='Human-friendly identifier')),
+                ('range_start', models.PositiveBigIntegerField(help_text='Row (sample number) at which the range starts')),
+                ('range_end', models.PositiveBigIntegerField(help_text='Row (sample number) at which the range ends')),
+                ('info', models.TextField(help_text='Additional information')),
+                ('dataset', models.ForeignKey(help_text='Dataset to which the Range applies', on_delete=django.db.models.deletion.CASCADE, related_name='range_labels', to='galv.dataset')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TimeseriesDataStr',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('values', django.contrib.postgres.fields.ArrayField(base_field=models.TextField(null=True), help_text='Row values (str) for Column', null=True, size=None)),
+                ('column', models.OneToOneField(help_text='Column whose data are listed', on_delete=django.db.models.deletion.CASCADE, to='galv.datacolumn')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TimeseriesDataInt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('values', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(null=True), help_text='Row values (integers) for Column', null=True, size=None)),
+                ('column', models.OneToOneField(help_text='Column whose data are listed', on_delete=django.db.models.deletion.CASCADE, to='galv.datacolumn')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TimeseriesDataFloat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('values', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(null=True), help_text='Row values (floats) for Column', null=True, size=None)),
+                ('column', models.OneToOneField(help_text='Column whose data are listed', on_delete=django.db.models.deletion.CASCADE, to='galv.datacolumn')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ObservedFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.TextField(help_text='Absolute file path')),
+                ('last_observed_size', models.PositiveBigIntegerField(default=0, help_text='Size of the file as last reported by Harvester')),
+                ('last_observed_time', models.DateTimeField(help_text='Date and time of last Harvester report on file', null=True)),
+                ('state', models.TextField(choices=[('RETRY IMPORT', 'Retry Import'), ('IMPORT FAILED', 'Import Failed'), ('UNSTABLE', 'Unstable'), ('GROWING', 'Growing'), ('STABLE', 'Stable'), ('IMPORTING', 'Importing'), ('IMPORTED', 'Imported')], default='UNSTABLE', help_text='File status; autogenerated but can be manually set to RETRY IMPORT')),
+                ('harvester', models.ForeignKey(help_text='Harvester that harvested the File', on_delete=django.db.models.deletion.CASCADE, to='galv.harvester')),
+            ],
+            options={
+                'unique_together': {('path', 'harvester')},
+            },
+        ),
+        migrations.CreateModel(
+            name='HarvestError',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('error', models.TextField(help_text='Text of the error report')),
+                ('timestamp', models.DateTimeField(auto_now=True, help_text='Date and time error was logged in the database', null=True)),
+                ('file', models.ForeignKey(help_text='File where error originated', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='errors', to='galv.observedfile')),
+                ('harvester', models.ForeignKey(help_text='Harvester which reported the error', on_delete=django.db.models.deletion.CASCADE, related_name='paths', to='galv.harvester')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Equipment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.TextField(help_text='Specific identifier', unique=True)),
+                ('type', models.TextField(help_text='Generic name')),
+                ('datasets', models.ManyToManyField(help_text='Datasets the Equipment is used in', related_name='equipment', to='galv.dataset')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='dataset',
+            name='file',
+            field=models.ForeignKey(help_text='File storing raw data', on_delete=django.db.models.deletion.DO_NOTHING, related_name='datasets', to='galv.observedfile'),
+        ),
+        migrations.CreateModel(
+            name='DataColumnType',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.TextField(help_text='Human-friendly identifier')),
+                ('description', models.TextField(help_text='Origins and purpose')),
+                ('is_default', models.BooleanField(default=False, help_text='Whether the Column is included in the initial list of known Column Types')),
+                ('unit', models.ForeignKey(help_text='Unit used for measuring the values in this column', null=True, on_delete=django.db.models.deletion.SET_NULL, to='galv.dataunit')),
+            ],
+            options={
+                'unique_together': {('unit', 'name')},
+            },
+        ),
+        migrations.AddField(
+            model_name='datacolumn',
+            name='dataset',
+            field=models.ForeignKey(help_text='Dataset in which this Column appears', on_delete=django.db.models.deletion.CASCADE, related_name='columns', to='galv.dataset'),
+        ),
+        migrations.AddField(
+            model_name='datacolumn',
+            name='type',
+            field=models.ForeignKey(help_text='Column Type which this Column instantiates', on_delete=django.db.models.deletion.CASCADE, to='galv.datacolumntype'),
+        ),
+        migrations.AddField(
+            model_name='cell',
+            name='family',
+            field=models.ForeignKey(help_text='Family to which this cell belongs', on_delete=django.db.models.deletion.DO_NOTHING, related_name='cells', to='galv.cellfamily'),
+        ),
+        migrations.CreateModel(
+            name='MonitoredPath',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.TextField(help_text='Directory location on Harvester')),
+                ('regex', models.TextField(help_text="\n    Python.re regular expression to filter files by, \n    applied to full file name starting from this Path's directory", null=True)),
+                ('stable_time', models.PositiveSmallIntegerField(default=60, help_text='Number of seconds files must remain stable to be processed')),
+                ('active', models.BooleanField(default=True)),
+                ('admin_group', models.ForeignKey(help_text='Users authorised to remove and edit this Path. Harvester admins are also authorised', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='editable_paths', to='auth.group')),
+                ('harvester', models.ForeignKey(help_text='Harvester with access to this directory', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='monitored_paths', to='galv.harvester')),
+                ('user_group', models.ForeignKey(help_text='Users authorised to view this Path and child Datasets', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='readable_paths', to='auth.group')),
+            ],
+            options={
+                'unique_together': {('harvester', 'path', 'regex')},
+            },
+        ),
+        migrations.CreateModel(
+            name='HarvesterEnvVar',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.TextField(help_text='Name of the variable')),
+                ('value', models.TextField(help_text='Variable value')),
+                ('deleted', models.BooleanField(default=False, help_text='Whether this variable was deleted')),
+                ('harvester', models.ForeignKey(help_text='Harvester whose environment this describes', on_delete=django.db.models.deletion.CASCADE, related_name='environment_variables', to='galv.harvester')),
+            ],
+            options={
+                'unique_together': {('harvester', 'key')},
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='dataset',
+            unique_together={('file', 'date')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='datacolumn',
+            unique_together={('dataset', 'name')},
+        ),
+    ]
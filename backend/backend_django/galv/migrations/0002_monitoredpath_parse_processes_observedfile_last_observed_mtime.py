@@ -0,0 +1,23 @@
+# Generated by Django 4.1.4 on 2026-10-17 01:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('galv', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='monitoredpath',
+            name='parse_processes',
+            field=models.PositiveSmallIntegerField(help_text="Number of processes used to parse large files; if not set, the Harvester's default is used", null=True),
+        ),
+        migrations.AddField(
+            model_name='observedfile',
+            name='last_observed_mtime',
+            field=models.FloatField(help_text='Modification timestamp of the file as last reported by Harvester', null=True),
+        ),
+    ]
@@ -0,0 +1,109 @@
+# Generated by Django 4.1.4 on 2026-10-17 01:25
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+# TimeseriesData* tables and the TimeseriesChunk* tables their data move to
+TABLES = [
+    ('galv_timeseriesdatafloat', 'galv_timeserieschunkfloat'),
+    ('galv_timeseriesdataint', 'galv_timeserieschunkint'),
+    ('galv_timeseriesdatastr', 'galv_timeserieschunkstr'),
+]
+
+
+def copy_to_chunks(apps, schema_editor):
+    """
+    Copy each TimeseriesData* array into a chunk.
+    Columns only ever had one array, which becomes chunk 0 starting at sample 0;
+    any further arrays follow on in the order they were created.
+    """
+    for old, new in TABLES:
+        schema_editor.execute(f"""
+            INSERT INTO {new} (column_id, chunk_index, first_sample, "values")
+            SELECT
+                column_id,
+                row_number() OVER w - 1,
+                coalesce(sum(cardinality("values")) OVER (w ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING), 0),
+                "values"
+            FROM {old}
+            WHERE "values" IS NOT NULL
+            WINDOW w AS (PARTITION BY column_id ORDER BY id)
+        """)
+
+
+def copy_from_chunks(apps, schema_editor):
+    """
+    Join each Column's chunks back into a single TimeseriesData* array
+    """
+    for old, new in TABLES:
+        schema_editor.execute(f"""
+            INSERT INTO {old} (column_id, "values")
+            SELECT c.column_id, ARRAY(
+                SELECT v
+                FROM {new} AS chunk, unnest(chunk."values") WITH ORDINALITY AS u(v, i)
+                WHERE chunk.column_id = c.column_id
+                ORDER BY chunk.chunk_index, u.i
+            )
+            FROM (SELECT DISTINCT column_id FROM {new}) AS c
+        """)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('galv', '0002_monitoredpath_parse_processes_observedfile_last_observed_mtime'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimeseriesChunkFloat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chunk_index', models.PositiveIntegerField(help_text="Position of this chunk among the Column's chunks")),
+                ('first_sample', models.PositiveBigIntegerField(help_text="Index in the Column's data of the first value in this chunk")),
+                ('values', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(null=True), help_text='Row values (floats) for Column', size=None)),
+                ('column', models.ForeignKey(help_text='Column whose data are listed', on_delete=django.db.models.deletion.CASCADE, to='galv.datacolumn')),
+            ],
+            options={
+                'unique_together': {('column', 'chunk_index')},
+            },
+        ),
+        migrations.CreateModel(
+            name='TimeseriesChunkInt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chunk_index', models.PositiveIntegerField(help_text="Position of this chunk among the Column's chunks")),
+                ('first_sample', models.PositiveBigIntegerField(help_text="Index in the Column's data of the first value in this chunk")),
+                ('values', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(null=True), help_text='Row values (integers) for Column', size=None)),
+                ('column', models.ForeignKey(help_text='Column whose data are listed', on_delete=django.db.models.deletion.CASCADE, to='galv.datacolumn')),
+            ],
+            options={
+                'unique_together': {('column', 'chunk_index')},
+            },
+        ),
+        migrations.CreateModel(
+            name='TimeseriesChunkStr',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chunk_index', models.PositiveIntegerField(help_text="Position of this chunk among the Column's chunks")),
+                ('first_sample', models.PositiveBigIntegerField(help_text="Index in the Column's data of the first value in this chunk")),
+                ('values', django.contrib.postgres.fields.ArrayField(base_field=models.TextField(null=True), help_text='Row values (str) for Column', size=None)),
+                ('column', models.ForeignKey(help_text='Column whose data are listed', on_delete=django.db.models.deletion.CASCADE, to='galv.datacolumn')),
+            ],
+            options={
+                'unique_together': {('column', 'chunk_index')},
+            },
+        ),
+        # The data are copied before the old tables are removed
+        migrations.RunPython(copy_to_chunks, copy_from_chunks),
+        migrations.DeleteModel(
+            name='TimeseriesDataFloat',
+        ),
+        migrations.DeleteModel(
+            name='TimeseriesDataInt',
+        ),
+        migrations.DeleteModel(
+            name='TimeseriesDataStr',
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.1.4 on 2026-10-17 01:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('galv', '0003_timeseries_chunks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.TextField(help_text='Secret the Harvester sends with each chunk of data', unique=True)),
+                ('columns', models.JSONField(default=dict, help_text='Data type of each Column the session may write to, by Column id')),
+                ('completed', models.BooleanField(default=False, help_text='Whether the Harvester has finished uploading; the import is complete once no chunks are staged')),
+                ('next_sequence', models.PositiveIntegerField(default=0, help_text='Sequence number of the next chunk to write; chunks numbered below it have been written')),
+                ('column_samples', models.JSONField(default=dict, help_text='Number of samples written to each Column during the session, by Column id')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('dataset', models.ForeignKey(help_text='Dataset the data are imported into', on_delete=django.db.models.deletion.CASCADE, to='galv.dataset')),
+                ('file', models.ForeignKey(help_text='File being imported', on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to='galv.observedfile')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StagedChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence', models.PositiveIntegerField(help_text='Position of the chunk among those sent in the session')),
+                ('body', models.BinaryField(help_text='Chunk content in the columnar format')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('session', models.ForeignKey(help_text='Upload session the chunk was sent in', on_delete=django.db.models.deletion.CASCADE, related_name='staged_chunks', to='galv.uploadsession')),
+            ],
+            options={
+                'unique_together': {('session', 'sequence')},
+            },
+        ),
+    ]
@@ -8,6 +8,7 @@ from django.db import models
 from django.contrib.auth.models import User, Group
 from knox.models import AuthToken
 import random
+import secrets
 
 
 class FileState(models.TextChoices):
@@ -105,6 +106,10 @@ class MonitoredPath(models.Model):
         help_text="Number of seconds files must remain stable to be processed"
     )
     active = models.BooleanField(default=True, null=False)
+    parse_processes = models.PositiveSmallIntegerField(
+        null=True,
+        help_text="Number of processes used to parse large files; if not set, the Harvester's default is used"
+    )
     admin_group = models.ForeignKey(
         to=Group,
         on_delete=models.CASCADE,
@@ -143,6 +148,10 @@ class ObservedFile(models.Model):
         null=True,
         help_text="Date and time of last Harvester report on file"
     )
+    last_observed_mtime = models.FloatField(
+        null=True,
+        help_text="Modification timestamp of the file as last reported by Harvester"
+    )
     state = models.TextField(
         choices=FileState.choices,
         default=FileState.UNSTABLE,
@@ -356,67 +365,223 @@ class DataColumn(models.Model):
         unique_together = [['dataset', 'name']]
 
 # Timeseries data comes in different types, so we need to store them separately.
+# A Column's data are stored as chunks that are only ever inserted, never updated,
+# so appending data costs the same however much data the Column already has.
 # These helper functions reduce redundancy in the code that creates the models.
 
 
 def _timeseries_column_field():
-    return models.OneToOneField(
+    return models.ForeignKey(
         to=DataColumn,
         on_delete=models.CASCADE,
         help_text="Column whose data are listed"
     )
 
 
+def _timeseries_chunk_index_field():
+    return models.PositiveIntegerField(help_text="Position of this chunk among the Column's chunks")
+
+
+def _timeseries_first_sample_field():
+    return models.PositiveBigIntegerField(help_text="Index in the Column's data of the first value in this chunk")
+
+
 def _timeseries_str(self):
     if not self.values:
-        return f"{self.column_id}: []"
+        return f"{self.column_id}[{self.chunk_index}]: []"
+    values = [str(v) for v in self.values[:5]]
     if len(self.values) > 5:
-        return f"{self.column_id}: [{','.join(self.values[:5])}...]"
-    return f"{self.column_id}: [{','.join(self.values)}]"
+        return f"{self.column_id}[{self.chunk_index}]: [{','.join(values)}...]"
+    return f"{self.column_id}[{self.chunk_index}]: [{','.join(values)}]"
 
 
 def _timeseries_repr(self):
     return str(self)
 
 
-class TimeseriesDataFloat(models.Model):
+class TimeseriesChunkFloat(models.Model):
     column = _timeseries_column_field()
-    values = ArrayField(models.FloatField(null=True), null=True, help_text="Row values (floats) for Column")
+    chunk_index = _timeseries_chunk_index_field()
+    first_sample = _timeseries_first_sample_field()
+    values = ArrayField(models.FloatField(null=True), help_text="Row values (floats) for Column")
     __str__ = _timeseries_str
     __repr__ = _timeseries_repr
 
+    class Meta:
+        unique_together = [['column', 'chunk_index']]
+
 
-class TimeseriesDataInt(models.Model):
+class TimeseriesChunkInt(models.Model):
     column = _timeseries_column_field()
-    values = ArrayField(models.IntegerField(null=True), null=True, help_text="Row values (integers) for Column")
+    chunk_index = _timeseries_chunk_index_field()
+    first_sample = _timeseries_first_sample_field()
+    values = ArrayField(models.IntegerField(null=True), help_text="Row values (integers) for Column")
     __str__ = _timeseries_str
     __repr__ = _timeseries_repr
 
+    class Meta:
+        unique_together = [['column', 'chunk_index']]
+
 
-class TimeseriesDataStr(models.Model):
+class TimeseriesChunkStr(models.Model):
     column = _timeseries_column_field()
-    values = ArrayField(models.TextField(null=True), null=True, help_text="Row values (str) for Column")
+    chunk_index = _timeseries_chunk_index_field()
+    first_sample = _timeseries_first_sample_field()
+    values = ArrayField(models.TextField(null=True), help_text="Row values (str) for Column")
     __str__ = _timeseries_str
     __repr__ = _timeseries_repr
 
+    class Meta:
+        unique_together = [['column', 'chunk_index']]
+
+
+TIMESERIES_CHUNK_MODELS = [TimeseriesChunkFloat, TimeseriesChunkInt, TimeseriesChunkStr]
+
 
 class UnsupportedTimeseriesDataTypeError(TypeError):
     pass
 
 
-def get_timeseries_handler_by_type(data_type: str) -> Type[TimeseriesDataFloat | TimeseriesDataStr | TimeseriesDataInt]:
+def get_timeseries_handler_by_type(data_type: str) -> Type[TimeseriesChunkFloat | TimeseriesChunkStr | TimeseriesChunkInt]:
     """
-    Returns the appropriate TimeseriesData model for the given data type.
+    Returns the appropriate TimeseriesChunk model for the given data type.
     """
     if data_type == "float":
-        return TimeseriesDataFloat
+        return TimeseriesChunkFloat
     if data_type == "str":
-        return TimeseriesDataStr
+        return TimeseriesChunkStr
     if data_type == "int":
-        return TimeseriesDataInt
+        return TimeseriesChunkInt
     raise UnsupportedTimeseriesDataTypeError
 
 
+def append_timeseries_values(column: DataColumn, values: list):
+    """
+    Add values to the end of the Column's data as a new chunk.
+    Only the Column's last chunk is read, and only its position and length.
+    """
+    if not len(values):
+        return None
+    handler = get_timeseries_handler_by_type(column.data_type)
+    last = handler.objects.filter(column=column)\
+        .order_by('-chunk_index')\
+        .values('chunk_index', 'first_sample', 'values__len')\
+        .first()
+    if last is None:
+        chunk_index, first_sample = 0, 0
+    else:
+        chunk_index = last['chunk_index'] + 1
+        first_sample = last['first_sample'] + (last['values__len'] or 0)
+    return handler.objects.create(column=column, chunk_index=chunk_index, first_sample=first_sample, values=values)
+
+
+def get_timeseries_values(column: DataColumn, start: int = 0, stop: int = None):
+    """
+    Yield lists of the Column's values from index start up to (not including) stop, a chunk at a time.
+    Only the chunks holding those values are read.
+    """
+    handler = get_timeseries_handler_by_type(column.data_type)
+    chunks = handler.objects.filter(column=column)
+    if start > 0:
+        first_chunk = chunks.filter(first_sample__lte=start)\
+            .order_by('-chunk_index')\
+            .values_list('chunk_index', flat=True)\
+            .first()
+        if first_chunk is not None:
+            chunks = chunks.filter(chunk_index__gte=first_chunk)
+    if stop is not None:
+        chunks = chunks.filter(first_sample__lt=stop)
+    for first_sample, values in chunks.order_by('chunk_index').values_list('first_sample', 'values').iterator():
+        lo = max(start - first_sample, 0)
+        hi = len(values) if stop is None else min(stop - first_sample, len(values))
+        if hi > lo:
+            yield values[lo:hi]
+
+
+def get_last_timeseries_value(column: DataColumn):
+    """
+    The last value in the Column's data, or None if it has none
+    """
+    handler = get_timeseries_handler_by_type(column.data_type)
+    values = handler.objects.filter(column=column)\
+        .order_by('-chunk_index')\
+        .values_list('values', flat=True)\
+        .first()
+    return values[-1] if values else None
+
+
+class UploadSession(models.Model):
+    """
+    An import in progress. The Dataset and Columns are resolved once, when they are declared,
+    so that each chunk of data only needs to name its Columns by id.
+    """
+    token = models.TextField(unique=True, help_text="Secret the Harvester sends with each chunk of data")
+    file = models.ForeignKey(
+        to=ObservedFile,
+        related_name='upload_sessions',
+        on_delete=models.CASCADE,
+        help_text="File being imported"
+    )
+    dataset = models.ForeignKey(
+        to=Dataset,
+        on_delete=models.CASCADE,
+        help_text="Dataset the data are imported into"
+    )
+    columns = models.JSONField(
+        default=dict,
+        help_text="Data type of each Column the session may write to, by Column id"
+    )
+    completed = models.BooleanField(
+        default=False,
+        help_text="Whether the Harvester has finished uploading; the import is complete once no chunks are staged"
+    )
+    next_sequence = models.PositiveIntegerField(
+        default=0,
+        help_text="Sequence number of the next chunk to write; chunks numbered below it have been written"
+    )
+    column_samples = models.JSONField(
+        default=dict,
+        help_text="Number of samples written to each Column during the session, by Column id"
+    )
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Upload of {self.file} [{self.created}]"
+
+    def pending_chunks(self):
+        """
+        Staged chunks that have not been written yet
+        """
+        return self.staged_chunks.filter(sequence__gte=self.next_sequence)
+
+    def save(self, *args, **kwargs):
+        if not self.token:
+            self.token = secrets.token_urlsafe(32)
+        super(UploadSession, self).save(*args, **kwargs)
+
+
+class StagedChunk(models.Model):
+    """
+    A chunk of data received in an UploadSession that has not yet been written to its Columns.
+    Chunks are written by `manage.py ingest_worker` in sequence order, whatever order they arrived in.
+    """
+    session = models.ForeignKey(
+        to=UploadSession,
+        related_name='staged_chunks',
+        on_delete=models.CASCADE,
+        help_text="Upload session the chunk was sent in"
+    )
+    sequence = models.PositiveIntegerField(help_text="Position of the chunk among those sent in the session")
+    body = models.BinaryField(help_text="Chunk content in the columnar format")
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Chunk {self.sequence} of {self.session}"
+
+    class Meta:
+        unique_together = [['session', 'sequence']]
+
+
 class TimeseriesRangeLabel(models.Model):
     dataset = models.ForeignKey(
         to=Dataset,
@@ -0,0 +1,88 @@
+# SPDX-License-Identifier: BSD-2-Clause
+# Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
+# of Oxford, and the 'Galv' Developers. All rights reserved.
+
+import json
+import struct
+
+import numpy as np
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+HEADER_LENGTH = struct.Struct('<I')
+
+# Buffer dtypes Harvesters may send
+ALLOWED_DTYPES = ['<f8', '<i8']
+
+
+class ColumnarParser(BaseParser):
+    """
+    Parse Harvester reports sent in the binary columnar format.
+
+    The body is a 4-byte little-endian header length, a JSON header holding the report,
+    and the packed column arrays.
+    Columns in the header's content['data'] that have a 'buffer' description
+    {dtype, count, offset} get their 'values' as a read-only numpy array over the body,
+    so numeric data are never converted to Python objects while parsing.
+    """
+    media_type = 'application/vnd.galv.columnar'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        body = stream.read() if stream is not None else b''
+        if len(body) < HEADER_LENGTH.size:
+            raise ParseError('Columnar body is too short to contain a header')
+        header_length, = HEADER_LENGTH.unpack_from(body)
+        buffers_start = HEADER_LENGTH.size + header_length
+        if buffers_start > len(body):
+            raise ParseError('Columnar header length exceeds body length')
+        try:
+            report = json.loads(body[HEADER_LENGTH.size:buffers_start].decode('utf-8'))
+        except ValueError as e:
+            raise ParseError(f'Columnar header is not valid JSON - {e}')
+        if not isinstance(report, dict):
+            raise ParseError('Columnar header must be a JSON object')
+        content = report.get('content')
+        if not isinstance(content, dict) or not isinstance(content.get('data', []), list):
+            return report
+        buffers = memoryview(body)[buffers_start:]
+        for column in content.get('data', []):
+            if not isinstance(column, dict) or 'buffer' not in column:
+                continue
+            buffer = column.pop('buffer')
+            try:
+                dtype = np.dtype(buffer['dtype'])
+                count = int(buffer['count'])
+                offset = int(buffer['offset'])
+            except (KeyError, TypeError, ValueError):
+                raise ParseError(f'Invalid columnar buffer description {buffer}')
+            if dtype.str not in ALLOWED_DTYPES:
+                raise ParseError(f'Unsupported columnar buffer dtype {dtype.str}')
+            if count < 0 or offset < 0 or offset + count * dtype.itemsize > len(buffers):
+                raise ParseError(f'Columnar buffer {buffer} exceeds body length')
+            column['values'] = np.frombuffer(buffers, dtype=dtype, count=count, offset=offset)
+        return report
+
+
+def encode_columnar(report: dict) -> bytes:
+    """
+    Encode a report in the format ColumnarParser reads.
+    Columns in content['data'] whose values are numpy arrays are packed as buffers;
+    other values are kept in the header.
+    """
+    content = report.get('content') or {}
+    columns = []
+    buffers = []
+    offset = 0
+    for column in content.get('data', []):
+        values = column.get('values')
+        if not isinstance(values, np.ndarray) or values.dtype.str not in ALLOWED_DTYPES:
+            columns.append(column)
+            continue
+        columns.append({
+            **{k: v for k, v in column.items() if k != 'values'},
+            'buffer': {'dtype': values.dtype.str, 'count': len(values), 'offset': offset}
+        })
+        buffers.append(values.tobytes())
+        offset += values.nbytes
+    header = json.dumps({**report, 'content': {**content, 'data': columns}}).encode('utf-8')
+    return b''.join([HEADER_LENGTH.pack(len(header)), header, *buffers])
@@ -16,6 +16,7 @@ from .models import Harvester, \
     HarvestError, \
     MonitoredPath, \
     ObservedFile, \
+    FileState, \
     Cell, \
     CellFamily, \
     Dataset, \
@@ -24,7 +25,8 @@ from .models import Harvester, \
     DataColumnType, \
     DataColumn, \
     TimeseriesRangeLabel, \
-    KnoxAuthToken
+    KnoxAuthToken, \
+    get_last_timeseries_value
 from .utils import get_monitored_paths
 from django.utils import timezone
 from django.contrib.auth.models import User, Group
@@ -268,6 +270,16 @@ class MonitoredPathSerializer(serializers.HyperlinkedModelSerializer):
         except (TypeError, ValueError, AssertionError):
             raise ValidationError(f"stable_time value '{value}' is not a positive integer")
 
+    def validate_parse_processes(self, value):
+        if value is None:
+            return value
+        try:
+            v = int(value)
+            assert v > 0
+            return v
+        except (TypeError, ValueError, AssertionError):
+            raise ValidationError(f"parse_processes value '{value}' is not a positive integer")
+
     def validate_regex(self, value):
         try:
             re.compile(value)
@@ -293,7 +305,7 @@ class MonitoredPathSerializer(serializers.HyperlinkedModelSerializer):
 
     class Meta:
         model = MonitoredPath
-        fields = ['url', 'id', 'path', 'regex', 'stable_time', 'active', 'harvester', 'user_sets']
+        fields = ['url', 'id', 'path', 'regex', 'stable_time', 'parse_processes', 'active', 'harvester', 'user_sets']
         read_only_fields = ['url', 'id', 'harvester', 'user_sets']
         extra_kwargs = augment_extra_kwargs()
 
@@ -309,6 +321,7 @@ class MonitoredPathCreateSerializer(MonitoredPathSerializer):
                 path=validated_data['path'],
                 harvester=validated_data['harvester'],
                 stable_time=stable_time,
+                parse_processes=validated_data.get('parse_processes'),
                 regex=regex
             )
         except (TypeError, ValueError):
@@ -334,10 +347,11 @@ class MonitoredPathCreateSerializer(MonitoredPathSerializer):
 
     class Meta:
         model = MonitoredPath
-        fields = ['path', 'regex', 'stable_time', 'harvester']
+        fields = ['path', 'regex', 'stable_time', 'parse_processes', 'harvester']
         extra_metadata = {
             'regex': {'required': False},
             'stable_time': {'required': False},
+            'parse_processes': {'required': False},
         }
 
 
@@ -356,7 +370,9 @@ class ObservedFileSerializer(serializers.HyperlinkedModelSerializer):
             for c in columns:
                 column_data.append({'name': c.name, 'id': c.id})
                 if c.official_sample_counter:
-                    last_record = c.values[:-1] if len(c.values) > 0 else 0
+                    last_value = get_last_timeseries_value(c)
+                    if last_value is not None:
+                        last_record = last_value
             return {
                 'columns': column_data,
                 'last_record_number': last_record
@@ -589,6 +605,7 @@ class HarvesterConfigSerializer(HarvesterSerializer):
     standard_columns = serializers.SerializerMethodField(help_text="Column Types recognised by the initial database")
     max_upload_bytes = serializers.SerializerMethodField(help_text="Maximum upload size (bytes)")
     deleted_environment_variables = serializers.SerializerMethodField(help_text="Envvars to unset")
+    pending_reimports = serializers.SerializerMethodField(help_text="Paths of files waiting to be imported again")
     monitored_paths = MonitoredPathSerializer(many=True, read_only=True, help_text="Directories to harvest")
 
     @extend_schema_field(DataUnitSerializer(many=True))
@@ -613,12 +630,18 @@ class HarvesterConfigSerializer(HarvesterSerializer):
     def get_deleted_environment_variables(self, instance):
         return [v.key for v in instance.environment_variables.all() if v.deleted]
 
+    @extend_schema_field(serializers.ListField(child=serializers.CharField()))
+    def get_pending_reimports(self, instance):
+        return list(
+            ObservedFile.objects.filter(harvester=instance, state=FileState.RETRY_IMPORT).values_list('path', flat=True)
+        )
+
     class Meta:
         model = Harvester
         fields = [
             'url', 'id', 'api_key', 'name', 'sleep_time', 'monitored_paths',
             'standard_units', 'standard_columns', 'max_upload_bytes',
-            'environment_variables', 'deleted_environment_variables'
+            'environment_variables', 'deleted_environment_variables', 'pending_reimports'
         ]
         read_only_fields = fields
         extra_kwargs = augment_extra_kwargs({
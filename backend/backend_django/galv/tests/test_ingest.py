@@ -0,0 +1,157 @@
+# SPDX-License-Identifier: BSD-2-Clause
+# Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
+# of Oxford, and the 'Galv' Developers. All rights reserved.
+
+import math
+import unittest
+import io
+import numpy
+from unittest.mock import patch
+from django.core.management import call_command
+from django.db import OperationalError
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+
+from .utils import GalvTestCase
+from .factories import DatasetFactory, HarvesterFactory, MonitoredPathFactory
+from galv.ingest import copy_chunks, ingest_staged_chunk, queue_depth
+from galv.parsers import ColumnarParser, encode_columnar
+from galv.models import DataUnit, DataColumnType, DataColumn, TimeseriesChunkStr, ObservedFile, FileState, \
+    StagedChunk, UploadSession, get_timeseries_values
+
+
+class IngestTests(GalvTestCase):
+    def test_copy_chunks(self):
+        dataset = DatasetFactory.create()
+        unit = DataUnit.objects.create(symbol='u')
+        column_type = DataColumnType.objects.create(name='t', unit=unit)
+
+        def column(data_type):
+            return DataColumn.objects.create(dataset=dataset, type=column_type, data_type=data_type, name=data_type)
+
+        def values(c):
+            return [v for chunk in get_timeseries_values(c) for v in chunk]
+
+        floats, ints, strs = column('float'), column('int'), column('str')
+        awkward = ['a', '', 'NULL', None, 'tab\there', 'new\nline', 'back\\slash', 'quote"d', '{braces}', 'comma,']
+        copy_chunks([(floats, [0.5, None, float('inf'), -1e300]), (ints, [1, 2, None]), (strs, awkward)])
+        copy_chunks([(floats, [float('nan')]), (ints, [3]), (strs, [])])
+        self.assertListEqual(values(floats)[:4], [0.5, None, float('inf'), -1e300])
+        self.assertTrue(math.isnan(values(floats)[4]))
+        self.assertListEqual(values(ints), [1, 2, None, 3])
+        self.assertListEqual(values(strs), awkward)
+        # Empty chunks are not stored
+        self.assertEqual(TimeseriesChunkStr.objects.filter(column=strs).count(), 1)
+        # A column sent twice in one upload gets a chunk for each
+        copy_chunks([(ints, [4]), (ints, [5, 6])])
+        self.assertListEqual(values(ints), [1, 2, None, 3, 4, 5, 6])
+
+    def test_encode_columnar(self):
+        data = [{'column': 1, 'values': numpy.arange(3)}, {'column': 2, 'values': ['a', None]}]
+        report = ColumnarParser().parse(io.BytesIO(encode_columnar({'content': {'data': data}})))
+        self.assertListEqual(report['content']['data'][0]['values'].tolist(), [0, 1, 2])
+        self.assertListEqual(report['content']['data'][1]['values'], ['a', None])
+
+    @override_settings(INGEST_QUEUE=True)
+    def test_staged_chunks(self):
+        harvester = HarvesterFactory.create(name='Test Staging')
+        path = MonitoredPathFactory.create(harvester=harvester)
+        file = ObservedFile.objects.create(harvester=harvester, path='/staged/file.ext')
+        url = reverse('harvester-report', args=(harvester.id,))
+        headers = {'HTTP_AUTHORIZATION': f"Harvester {harvester.api_key}", 'format': 'json'}
+
+        def report(content):
+            body = {'status': 'success', 'monitored_path_id': path.id, 'path': file.path, 'content': content}
+            return self.client.post(url, body, **headers)
+
+        response = report({
+            'task': 'import', 'status': 'begin', 'test_date': 1024.0, 'core_metadata': {}, 'extra_metadata': {},
+            'columns': [{'key': 'v', 'column_name': 'v', 'unit_symbol': 'vu', 'data_type': 'float'}]
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        token = response.json()['upload_session']['token']
+        column_id = response.json()['upload_session']['columns']['v']
+        # Chunks are written in sequence, whatever order they arrive in, and chunks sent twice are ignored
+        for sequence, samples, values in [(1, [2, 3], [3.0]), (0, [0, 2], [1.0, 2.0]), (1, [2, 3], [3.0])]:
+            response = report({
+                'task': 'import', 'status': 'in_progress', 'upload_session': token,
+                'sequence': sequence, 'samples': samples,
+                'data': [{'column': column_id, 'values': values}]
+            })
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertTrue(response.json()['duplicate'])
+        # Nothing is written until a worker takes the chunks
+        self.assertEqual(queue_depth()['chunks'], 2)
+        self.assertEqual(response.json()['queued_chunks'], 2)
+        response = report({'task': 'import', 'status': 'complete'})
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(ObservedFile.objects.get(id=file.id).state, FileState.IMPORTING)
+        # Another import can't begin while data are waiting to be written
+        response = report({'task': 'import', 'status': 'begin', 'test_date': 1024.0, 'core_metadata': {}, 'extra_metadata': {}})
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        # Reports that the file is unchanged don't mark it ready to import again while its data are queued
+        ObservedFile.objects.filter(id=file.id).update(
+            last_observed_size=10,
+            last_observed_time=timezone.now() - timezone.timedelta(days=1)
+        )
+        response = report({'task': 'file_sizes', 'files': [{'path': file.path, 'size': 10}]})
+        self.assertDictEqual(response.json(), {'files': [], 'settled': []})
+        self.assertEqual(ObservedFile.objects.get(id=file.id).state, FileState.IMPORTING)
+
+        while ingest_staged_chunk():
+            pass
+        column = DataColumn.objects.get(id=column_id)
+        self.assertListEqual([v for chunk in get_timeseries_values(column) for v in chunk], [1.0, 2.0, 3.0])
+        self.assertEqual(ObservedFile.objects.get(id=file.id).state, FileState.IMPORTED)
+        self.assertFalse(UploadSession.objects.filter(file=file).exists())
+
+        # A chunk that can't be written fails the import and discards the rest of the upload
+        response = report({
+            'task': 'import', 'status': 'begin', 'test_date': 1024.0, 'core_metadata': {}, 'extra_metadata': {},
+            'columns': [{'key': 'v', 'column_name': 'v', 'unit_symbol': 'vu', 'data_type': 'float'}]
+        })
+        token = response.json()['upload_session']['token']
+        for sequence, values in enumerate([['not a number'], [4.0]]):
+            report({
+                'task': 'import', 'status': 'in_progress', 'upload_session': token,
+                'sequence': sequence, 'samples': [sequence, sequence + 1],
+                'data': [{'column': column_id, 'values': values}]
+            })
+        self.assertTrue(ingest_staged_chunk())
+        self.assertFalse(StagedChunk.objects.exists())
+        self.assertEqual(ObservedFile.objects.get(id=file.id).state, FileState.IMPORT_FAILED)
+
+        # Chunks staged after one that never arrived are discarded when the upload fails
+        response = report({
+            'task': 'import', 'status': 'begin', 'test_date': 1024.0, 'core_metadata': {}, 'extra_metadata': {},
+            'columns': [{'key': 'v', 'column_name': 'v', 'unit_symbol': 'vu', 'data_type': 'float'}]
+        })
+        token = response.json()['upload_session']['token']
+        for sequence in [0, 2]:
+            report({
+                'task': 'import', 'status': 'in_progress', 'upload_session': token,
+                'sequence': sequence, 'samples': [sequence, sequence + 1],
+                'data': [{'column': column_id, 'values': [5.0]}]
+            })
+        report({'task': 'import', 'status': 'failed'})
+        self.assertListEqual(list(StagedChunk.objects.values_list('sequence', flat=True)), [0])
+        while ingest_staged_chunk():
+            pass
+        self.assertFalse(UploadSession.objects.filter(file=file).exists())
+
+    @patch('galv.management.commands.ingest_worker.time.sleep')
+    @patch('galv.management.commands.ingest_worker.ingest_staged_chunk')
+    def test_worker_survives_errors(self, mock_ingest, mock_sleep):
+        mock_ingest.side_effect = [OperationalError('connection lost'), True, False]
+        stderr = io.StringIO()
+        call_command('ingest_worker', workers=1, once=True, poll_interval=0.5, stdout=io.StringIO(), stderr=stderr)
+        # The worker backs off and carries on writing chunks after the error
+        self.assertEqual(mock_ingest.call_count, 3)
+        self.assertIn('connection lost', stderr.getvalue())
+        mock_sleep.assert_called_once_with(0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+# SPDX-License-Identifier: BSD-2-Clause
+# Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
+# of Oxford, and the 'Galv' Developers. All rights reserved.
+
+import unittest
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+BEFORE_CHUNKS = ('galv', '0002_monitoredpath_parse_processes_observedfile_last_observed_mtime')
+CHUNKS = ('galv', '0003_timeseries_chunks')
+
+
+class TimeseriesChunksMigrationTests(TransactionTestCase):
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([target])
+        return executor.loader.project_state([target]).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_data_copied_to_chunks(self):
+        apps = self.migrate(BEFORE_CHUNKS)
+        harvester = apps.get_model('galv', 'Harvester').objects.create(name='Test Migration')
+        file = apps.get_model('galv', 'ObservedFile').objects.create(harvester=harvester, path='/a/file.ext')
+        dataset = apps.get_model('galv', 'Dataset').objects.create(file=file, date=timezone.now(), purpose='test')
+        column_type = apps.get_model('galv', 'DataColumnType').objects.create(name='t', description='test')
+
+        def column(name, data_type):
+            return apps.get_model('galv', 'DataColumn').objects.create(
+                dataset=dataset, type=column_type, data_type=data_type, name=name
+            ).id
+
+        columns = {'float': column('f', 'float'), 'int': column('i', 'int'), 'str': column('s', 'str')}
+        apps.get_model('galv', 'TimeseriesDataFloat').objects.create(column_id=columns['float'], values=[0.5, None])
+        apps.get_model('galv', 'TimeseriesDataInt').objects.create(column_id=columns['int'], values=[1, 2, 3])
+        apps.get_model('galv', 'TimeseriesDataStr').objects.create(column_id=columns['str'], values=['a'])
+
+        apps = self.migrate(CHUNKS)
+        for data_type, model, values in [
+            ('float', 'TimeseriesChunkFloat', [0.5, None]),
+            ('int', 'TimeseriesChunkInt', [1, 2, 3]),
+            ('str', 'TimeseriesChunkStr', ['a'])
+        ]:
+            chunks = list(apps.get_model('galv', model).objects.filter(column_id=columns[data_type]))
+            self.assertEqual(len(chunks), 1)
+            self.assertEqual(chunks[0].chunk_index, 0)
+            self.assertEqual(chunks[0].first_sample, 0)
+            self.assertListEqual(chunks[0].values, values)
+
+        # Reversing the migration puts the data back
+        apps = self.migrate(BEFORE_CHUNKS)
+        self.assertListEqual(
+            apps.get_model('galv', 'TimeseriesDataInt').objects.get(column_id=columns['int']).values,
+            [1, 2, 3]
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -37,6 +37,52 @@ class DatasetTests(APITestCase):
         self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
         print("OK")
 
+    def test_column_values(self):
+        file = self.dataset.file
+        url = reverse('harvester-report', args=(self.harvester.id,))
+        headers = {'HTTP_AUTHORIZATION': f"Harvester {self.harvester.api_key}", 'format': 'json'}
+
+        def report(content):
+            body = {'status': 'success', 'monitored_path_id': self.monitored_path.id, 'path': file.path, 'content': content}
+            response = self.client.post(url, body, **headers)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        print("Test data uploaded with COPY are served by the column views")
+        report({'task': 'import', 'status': 'begin', 'test_date': 1024.0, 'core_metadata': {}, 'extra_metadata': {}})
+        # Values that COPY's text format must escape, and nulls, are sent in two chunks
+        chunks = [
+            {'i': [1, 2, 3], 'f': [0.5, None, 1e300], 's': ['a\tb', 'c\\d', None]},
+            {'i': [4, 5], 'f': [-2.5, 3.0], 's': ['e', "f'g"]}
+        ]
+        for chunk in chunks:
+            report({
+                'task': 'import', 'status': 'in_progress', 'test_date': 1024.0,
+                'data': [
+                    {'column_name': name, 'unit_symbol': 'u', 'data_type': data_type, 'values': chunk[name]}
+                    for name, data_type in [('i', 'int'), ('f', 'float'), ('s', 'str')]
+                ]
+            })
+        report({'task': 'import', 'status': 'complete'})
+
+        self.client.force_login(self.admin_user)
+        dataset = file.datasets.exclude(id=self.dataset.id).get()
+        column_urls = self.client.get(reverse('dataset-detail', args=(dataset.id,))).json()['columns']
+        columns = {c['name']: c for c in [self.client.get(u).json() for u in column_urls]}
+        self.assertSetEqual(set(columns.keys()), {'i', 'f', 's'})
+
+        def values(name, **query):
+            response = self.client.get(columns[name]['values'], query)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return b''.join(response.streaming_content).decode('utf-8').split('\n')[:-1]
+
+        self.assertListEqual(values('i'), ['1', '2', '3', '4', '5'])
+        self.assertListEqual(values('f'), ['0.5', 'None', '1e+300', '-2.5', '3.0'])
+        self.assertListEqual(values('s'), ['a\tb', 'c\\d', 'None', 'e', "f'g"])
+        # Ranges and steps run across chunk boundaries
+        self.assertListEqual(values('i', min=2, max=3), ['3', '4', '5'])
+        self.assertListEqual(values('i', mod=2), ['1', '3', '5'])
+        print("OK")
+
 
 if __name__ == '__main__':
     unittest.main()
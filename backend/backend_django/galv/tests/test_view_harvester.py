@@ -2,9 +2,14 @@
 # Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
 # of Oxford, and the 'Galv' Developers. All rights reserved.
 
+import gzip
+import json
+import struct
 import unittest
+import numpy
 from django.urls import reverse
 from rest_framework import status
+from django.utils import timezone
 import logging
 
 from .utils import GalvTestCase
@@ -19,7 +24,8 @@ from galv.models import Harvester, \
     Dataset, \
     FileState, \
     DataColumn, \
-    TimeseriesDataInt
+    TimeseriesChunkInt, \
+    get_timeseries_values
 
 logger = logging.getLogger(__file__)
 logger.setLevel(logging.INFO)
@@ -77,6 +83,12 @@ class HarvesterTests(GalvTestCase):
             paths.remove(p['path'])
         self.assertEqual(len(paths), 0, "Not all monitored_paths reported in config")
         print("OK")
+        print("Test config lists files waiting to be imported again")
+        ObservedFile.objects.create(harvester=harvester, path='/a/retry.ext', state=FileState.RETRY_IMPORT)
+        ObservedFile.objects.create(harvester=harvester, path='/a/done.ext', state=FileState.IMPORTED)
+        ObservedFile.objects.create(harvester=other, path='/a/other.ext', state=FileState.RETRY_IMPORT)
+        self.assertListEqual(self.client.get(url, **headers).json()['pending_reimports'], ['/a/retry.ext'])
+        print("OK")
         print("Test config rejection with other harvester key")
         headers = {'HTTP_AUTHORIZATION': f"Harvester {other.api_key}"}
         self.assertEqual(self.client.get(url, **headers).status_code, status.HTTP_401_UNAUTHORIZED)
@@ -254,6 +266,65 @@ class HarvesterTests(GalvTestCase):
         f = ObservedFile.objects.get(path='/a/new/file.ext', harvester_id=harvester.id)
         self.assertEqual(f.state, FileState.GROWING)
         print("OK")
+        print("Test task file_sizes")
+        ObservedFile.objects.create(
+            harvester=harvester,
+            path='/a/stable/file.ext',
+            last_observed_size=2048,
+            last_observed_time=timezone.now() - timezone.timedelta(seconds=paths[0].stable_time + 1)
+        )
+        ObservedFile.objects.create(
+            harvester=harvester,
+            path='/a/done/file.ext',
+            last_observed_size=4096,
+            last_observed_time=timezone.now() - timezone.timedelta(seconds=paths[0].stable_time + 1),
+            state=FileState.IMPORTED
+        )
+        batch = {
+            'status': 'success',
+            'monitored_path_id': paths[0].id,
+            'path': '/a',
+            'content': {'task': 'file_sizes', 'files': [
+                {'path': '/a/stable/file.ext', 'size': 2048, 'mtime': 1024.0},
+                {'path': '/a/done/file.ext', 'size': 4096, 'mtime': 1024.0},
+                {'path': '/a/batch/file.ext', 'size': 1024, 'mtime': 1024.0},
+            ]}
+        }
+        response = self.client.post(url, batch, **headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertListEqual(response.json()['files'], [{'path': '/a/stable/file.ext', 'state': FileState.STABLE}])
+        self.assertListEqual(response.json()['settled'], [{'path': '/a/done/file.ext', 'state': FileState.IMPORTED}])
+        self.assertEqual(
+            ObservedFile.objects.get(path='/a/batch/file.ext', harvester_id=harvester.id).state,
+            FileState.GROWING
+        )
+        self.assertEqual(
+            ObservedFile.objects.get(path='/a/stable/file.ext', harvester_id=harvester.id).last_observed_mtime,
+            1024.0
+        )
+        print("OK")
+        print("Test gzip-encoded report")
+        batch['content']['files'] = [{'path': '/a/gzip/file.ext', 'size': 1024, 'mtime': 1024.0}]
+        response = self.client.post(
+            url,
+            gzip.compress(json.dumps(batch).encode('utf-8')),
+            content_type='application/json',
+            HTTP_CONTENT_ENCODING='gzip',
+            HTTP_AUTHORIZATION=headers['HTTP_AUTHORIZATION']
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(ObservedFile.objects.filter(path='/a/gzip/file.ext', harvester_id=harvester.id).exists())
+        print("OK")
+        print("Test rejection of corrupt gzip-encoded report")
+        response = self.client.post(
+            url,
+            b'not gzip',
+            content_type='application/json',
+            HTTP_CONTENT_ENCODING='gzip',
+            HTTP_AUTHORIZATION=headers['HTTP_AUTHORIZATION']
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        print("OK")
         print("Test task import begin")
         body['content'] = {
             'task': 'import',
@@ -291,8 +362,159 @@ class HarvesterTests(GalvTestCase):
         # cols = DataColumn.objects.filter(dataset__id=d.id)
         # self.assertEqual(cols.count(), 4)
         # for c in cols:
-        #     self.assertEqual(TimeseriesDataInt.objects.filter(column_id=c.id).count(), 5)
+        #     self.assertEqual(TimeseriesChunkInt.objects.filter(column_id=c.id).count(), 5)
         # print("OK")
+        print("Test task import in_progress with columnar data")
+        floats = numpy.linspace(0, 1, 5, dtype='<f8')
+        ints = numpy.arange(5, dtype='<i8')
+        header = json.dumps({
+            **body,
+            'content': {
+                'task': 'import',
+                'status': 'in_progress',
+                'test_date': 1024.0,
+                'data': [
+                    {'column_name': 'cx', 'unit_symbol': 'cxu', 'data_type': 'float',
+                     'buffer': {'dtype': '<f8', 'count': 5, 'offset': 0}},
+                    {'column_name': 'cy', 'unit_symbol': 'cyu', 'data_type': 'int',
+                     'buffer': {'dtype': '<i8', 'count': 5, 'offset': floats.nbytes}},
+                    {'column_name': 'cz', 'unit_symbol': 'czu', 'data_type': 'str',
+                     'values': ['a', 'b', 'c', 'd', 'e']}
+                ]
+            }
+        }).encode('utf-8')
+        columnar_body = struct.pack('<I', len(header)) + header + floats.tobytes() + ints.tobytes()
+        response = self.client.post(
+            url,
+            columnar_body,
+            content_type='application/vnd.galv.columnar',
+            HTTP_AUTHORIZATION=headers['HTTP_AUTHORIZATION']
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        def column_values(name):
+            column = DataColumn.objects.get(dataset=d, name=name)
+            return [v for values in get_timeseries_values(column) for v in values]
+
+        self.assertListEqual(column_values('cx'), floats.tolist())
+        self.assertListEqual(column_values('cy'), ints.tolist())
+        self.assertListEqual(column_values('cz'), ['a', 'b', 'c', 'd', 'e'])
+        print("OK")
+        print("Test data are appended as new chunks")
+        response = self.client.post(
+            url,
+            columnar_body,
+            content_type='application/vnd.galv.columnar',
+            HTTP_AUTHORIZATION=headers['HTTP_AUTHORIZATION']
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        column = DataColumn.objects.get(dataset=d, name='cy')
+        chunks = TimeseriesChunkInt.objects.filter(column=column).order_by('chunk_index')
+        self.assertListEqual([(c.chunk_index, c.first_sample) for c in chunks], [(0, 0), (1, 5)])
+        self.assertListEqual(column_values('cy'), [*ints.tolist(), *ints.tolist()])
+        self.assertListEqual(list(get_timeseries_values(column, 3, 7)), [[3, 4], [0, 1]])
+        print("OK")
+        print("Test rejection of columnar data with out of range buffer")
+        response = self.client.post(
+            url,
+            struct.pack('<I', len(header)) + header + floats.tobytes(),
+            content_type='application/vnd.galv.columnar',
+            HTTP_AUTHORIZATION=headers['HTTP_AUTHORIZATION']
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        print("OK")
+        print("Test task import in_progress with row counts")
+        body['content'] = {
+            'task': 'import',
+            'status': 'in_progress',
+            'test_date': 1024.0,
+            'data': [],
+            'core_metadata': {'num_rows': 5, 'first_sample_no': 1, 'last_sample_no': 5}
+        }
+        response = self.client.post(url, body, **headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        d.refresh_from_db()
+        self.assertEqual(d.json_data['num_rows'], 5)
+        self.assertEqual(d.json_data['last_sample_no'], 5)
+        print("OK")
+        print("Test upload_info for a file that is imported again")
+        body['content'] = {
+            'task': 'import',
+            'status': 'in_progress',
+            'test_date': 1024.0,
+            'data': [
+                {'column_name': 'rec', 'unit_symbol': 'recu', 'data_type': 'int',
+                 'official_sample_counter': True, 'values': [1, 2, 3, 4, 5]}
+            ]
+        }
+        response = self.client.post(url, body, **headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        body['content'] = {
+            'task': 'import',
+            'status': 'begin',
+            'test_date': 1024.0,
+            'core_metadata': {'Machine Type': 'Test machine', 'Dataset Name': 'Test dataset'},
+            'extra_metadata': {}
+        }
+        response = self.client.post(url, body, **headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        upload_info = response.json()['upload_info']
+        self.assertEqual(upload_info['last_record_number'], 5)
+        self.assertIn('rec', [c['name'] for c in upload_info['columns']])
+        print("OK")
+        print("Test task import in_progress in an upload session")
+        token = response.json()['upload_session']['token']
+        body['content'] = {
+            'task': 'import',
+            'status': 'columns',
+            'upload_session': token,
+            'columns': [
+                {'key': 'rec', 'column_name': 'rec', 'unit_symbol': 'recu', 'data_type': 'int',
+                 'official_sample_counter': True},
+                {'key': 'sx', 'column_name': 'sx', 'unit_symbol': 'sxu', 'data_type': 'float'}
+            ]
+        }
+        response = self.client.post(url, body, **headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        column_ids = response.json()['upload_session']['columns']
+        self.assertEqual(column_ids['rec'], DataColumn.objects.get(dataset=d, name='rec').id)
+        body['content'] = {
+            'task': 'import',
+            'status': 'in_progress',
+            'upload_session': token,
+            'sequence': 0,
+            'samples': [0, 2],
+            'data': [
+                {'column': column_ids['rec'], 'values': [6, 7]},
+                {'column': column_ids['sx'], 'values': [0.5, 1.5]}
+            ]
+        }
+        response = self.client.post(url, body, **headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertListEqual(column_values('rec'), [1, 2, 3, 4, 5, 6, 7])
+        self.assertListEqual(column_values('sx'), [0.5, 1.5])
+        print("OK")
+        print("Test resent and out of order chunks in an upload session")
+        response = self.client.post(url, body, **headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.json()['duplicate'])
+        self.assertListEqual(column_values('rec'), [1, 2, 3, 4, 5, 6, 7])
+        body['content']['sequence'] = 2
+        response = self.client.post(url, body, **headers)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        body['content']['sequence'] = 1
+        body['content']['data'] = [{'column': column_ids['rec'], 'values': [8]}]
+        response = self.client.post(url, body, **headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        print("OK")
+        print("Test rejection of columns outside the upload session")
+        body['content']['samples'] = [2, 3]
+        body['content']['data'] = [{'column': DataColumn.objects.get(dataset=d, name='cx').id, 'values': [1.0]}]
+        response = self.client.post(url, body, **headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        body['content']['upload_session'] = 'not a token'
+        response = self.client.post(url, body, **headers)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        print("OK")
         print("Test task import complete")
         body['content'] = {
             'task': 'import',
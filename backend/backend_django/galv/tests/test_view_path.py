@@ -101,6 +101,14 @@ class MonitoredPathTests(APITestCase):
             body.get('regex')
         )
         print("OK")
+        print("Test update parse_processes")
+        self.assertEqual(self.client.patch(url, {'parse_processes': 4}).status_code, status.HTTP_200_OK)
+        self.assertEqual(MonitoredPath.objects.get(id=path.id).parse_processes, 4)
+        self.assertEqual(
+            self.client.patch(url, {'parse_processes': 0}).status_code,
+            status.HTTP_400_BAD_REQUEST
+        )
+        print("OK")
 
 
 if __name__ == '__main__':
@@ -7,7 +7,9 @@ import re
 
 import knox.auth
 import os
-from django.db.models import Q
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.db.models import F, Q
 
 from .serializers import HarvesterSerializer, \
     HarvesterCreateSerializer, \
@@ -38,16 +40,20 @@ from .models import Harvester, \
     Equipment, \
     DataUnit, \
     DataColumnType, \
-    TimeseriesDataFloat, \
-    TimeseriesDataInt, \
-    TimeseriesDataStr, \
     DataColumn, \
     UnsupportedTimeseriesDataTypeError, \
     get_timeseries_handler_by_type, \
+    get_timeseries_values, \
+    TIMESERIES_CHUNK_MODELS, \
     TimeseriesRangeLabel, \
+    UploadSession, \
+    StagedChunk, \
     FileState, \
     VouchFor, \
     KnoxAuthToken
+from .parsers import ColumnarParser
+from .ingest import OutOfSequenceError, copy_chunks, end_upload, first_missing_chunk, stage_chunk, \
+    write_session_chunk, update_row_counts
 from .permissions import HarvesterAccess, ReadOnlyIfInUse, MonitoredPathAccess
 from .utils import get_files_from_path
 from django.contrib.auth.models import User, Group
@@ -58,6 +64,7 @@ from django.http import StreamingHttpResponse
 from rest_framework import viewsets, serializers, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from knox.views import LoginView as KnoxLoginView
 from knox.views import LogoutView as KnoxLogoutView
 from knox.views import LogoutAllView as KnoxLogoutAllView
@@ -67,6 +74,7 @@ from drf_spectacular.utils import extend_schema, extend_schema_view, inline_seri
 import json
 import time
 import logging
+import numpy
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.StreamHandler())
@@ -97,6 +105,90 @@ def deserialize_datetime(serialized_value: str | float) -> timezone.datetime:
     raise TypeError
 
 
+def observe_file(file: ObservedFile, size: int, stable_time: int, mtime: float = None):
+    """
+    Update an ObservedFile's state from a Harvester's report of its size
+    and, optionally, its modification time. The file is not saved.
+    """
+    if size < file.last_observed_size:
+        file.state = FileState.UNSTABLE
+    elif size > file.last_observed_size:
+        file.state = FileState.GROWING
+
+    modified = mtime is not None and file.last_observed_mtime is not None and mtime != file.last_observed_mtime
+    if modified and size == file.last_observed_size:
+        file.state = FileState.UNSTABLE
+    if mtime is not None:
+        file.last_observed_mtime = mtime
+
+    if size != file.last_observed_size or modified or file.last_observed_time is None:
+        file.last_observed_size = size
+        file.last_observed_time = timezone.now()
+    else:
+        # Recent changes
+        if file.last_observed_time + timezone.timedelta(seconds=stable_time) > timezone.now():
+            file.state = FileState.UNSTABLE
+        # Stable file -- already imported, or waiting for an ingest worker to finish importing it?
+        elif file.state not in [FileState.IMPORTED, FileState.IMPORT_FAILED] and not (
+                file.state == FileState.IMPORTING and file.upload_sessions.filter(completed=True).exists()
+        ):
+            file.state = FileState.STABLE
+
+
+def get_or_create_column(dataset: Dataset, column_data: dict) -> DataColumn:
+    """
+    Find or create the Dataset's Column described by a Harvester,
+    either by a standard Column Type's column_id or by column_name and unit_id/unit_symbol
+    """
+    data_type = column_data.get('data_type')
+    try:
+        column_type = DataColumnType.objects.get(id=column_data['column_id'])
+        column, _ = DataColumn.objects.get_or_create(
+            name=column_type.name,
+            data_type=data_type,
+            type=column_type,
+            dataset=dataset,
+            official_sample_counter=column_data.get('official_sample_counter', False)
+        )
+    except KeyError:
+        if 'unit_id' in column_data:
+            unit = DataUnit.objects.get(id=column_data['unit_id'])
+        else:
+            unit, _ = DataUnit.objects.get_or_create(symbol=column_data['unit_symbol'])
+        try:
+            column_type = DataColumnType.objects.get(unit=unit)
+        except DataColumnType.DoesNotExist:
+            column_type = DataColumnType.objects.create(
+                name=column_data['column_name'],
+                unit=unit
+            )
+        column, _ = DataColumn.objects.get_or_create(
+            name=column_data['column_name'],
+            data_type=data_type,
+            type=column_type,
+            dataset=dataset,
+            official_sample_counter=column_data.get('official_sample_counter', False)
+        )
+    return column
+
+
+def pin_columns(session: UploadSession, declarations: list) -> dict:
+    """
+    Resolve the Columns declared by a Harvester and allow the UploadSession to write to them.
+    Each declaration describes a Column as for get_or_create_column, and has a 'key' chosen by the Harvester.
+    Returns the id of each declared Column by key.
+    """
+    column_ids = {}
+    for declaration in declarations:
+        column = get_or_create_column(session.dataset, declaration)
+        get_timeseries_handler_by_type(column.data_type)
+        session.columns[str(column.id)] = column.data_type
+        column_ids[declaration['key']] = column.id
+    if column_ids:
+        session.save()
+    return column_ids
+
+
 @extend_schema(
     summary="Log in to retrieve an API Token for use elsewhere in the API.",
     description="""
@@ -361,8 +453,11 @@ and information about standard Columns and Units.
         description="""
 The harvester programs use the report endpoint for all information they send to the API
 (except initial self-registration).
-Reports will be file size reports, file parsing reports, or error reports.
+Reports will be file size reports (for a single file, or in bulk for a whole directory),
+file parsing reports, or error reports.
 File parsing reports may contain metadata or data to store.
+Data may be sent as JSON or, more compactly, in the binary columnar format
+(Content-Type application/vnd.galv.columnar; see galv.parsers.ColumnarParser).
         """,
         request=inline_serializer('HarvesterReportSerializer', {
             # TODO
@@ -426,7 +521,7 @@ class HarvesterViewSet(viewsets.ModelViewSet):
             context={'request': request}
         ).data)
 
-    @action(detail=True, methods=['POST'])
+    @action(detail=True, methods=['POST'], parser_classes=[*api_settings.DEFAULT_PARSER_CLASSES, ColumnarParser])
     def report(self, request, pk: int = None):
         """
         Process a Harvester's report on its activity.
@@ -493,33 +588,81 @@ class HarvesterViewSet(viewsets.ModelViewSet):
                 if content.get('size') is None:
                     return error_response('file_size task requires content to include size field')
 
-                size = content['size']
-                if size < file.last_observed_size:
-                    file.state = FileState.UNSTABLE
-                elif size > file.last_observed_size:
-                    file.state = FileState.GROWING
-
-                if size != file.last_observed_size:
-                    file.last_observed_size = size
-                    file.last_observed_time = timezone.now()
-                else:
-                    # Recent changes
-                    if file.last_observed_time + timezone.timedelta(seconds=monitored_path.stable_time) > timezone.now():
-                        file.state = FileState.UNSTABLE
-                    # Stable file -- already imported?
-                    elif file.state not in [FileState.IMPORTED, FileState.IMPORT_FAILED]:
-                        file.state = FileState.STABLE
-
+                observe_file(file, content['size'], monitored_path.stable_time, content.get('mtime'))
                 file.save()
                 return Response(ObservedFileSerializer(file, context={'request': self.request}).data)
+            elif content['task'] == 'file_sizes':
+                # Harvester is reporting the sizes of all the files in a directory
+                # Update our database records in bulk and return the files that need importing
+                files = content.get('files')
+                if not isinstance(files, list):
+                    return error_response('file_sizes task requires content to include files list')
+                try:
+                    sizes = {f['path']: (f['size'], f.get('mtime')) for f in files}
+                except (KeyError, TypeError):
+                    return error_response('file_sizes task requires each file to include path and size fields')
+                with transaction.atomic():
+                    ObservedFile.objects.bulk_create(
+                        [ObservedFile(harvester=harvester, path=p) for p in sizes.keys()],
+                        ignore_conflicts=True
+                    )
+                    observed_files = list(ObservedFile.objects.select_for_update().filter(
+                        harvester=harvester,
+                        path__in=sizes.keys()
+                    ))
+                    for file in observed_files:
+                        size, mtime = sizes[file.path]
+                        observe_file(file, size, monitored_path.stable_time, mtime)
+                    ObservedFile.objects.bulk_update(
+                        observed_files,
+                        ['state', 'last_observed_size', 'last_observed_time', 'last_observed_mtime']
+                    )
+                return Response({
+                    'files': [
+                        {'path': f.path, 'state': f.state}
+                        for f in observed_files
+                        if f.state in [FileState.STABLE, FileState.RETRY_IMPORT]
+                    ],
+                    'settled': [
+                        {'path': f.path, 'state': f.state}
+                        for f in observed_files
+                        if f.state in [FileState.IMPORTED, FileState.IMPORT_FAILED]
+                    ]
+                })
             elif content['task'] == 'import':
                 try:
                     file = ObservedFile.objects.get(harvester=harvester, path=path)
                 except ObservedFile.DoesNotExist:
                     return error_response("ObservedFile does not exist")
+                if content['status'] == 'columns':
+                    # Declare Columns for an upload session to write to
+                    try:
+                        session = UploadSession.objects.select_related('dataset').get(
+                            token=content.get('upload_session'),
+                            file=file
+                        )
+                    except UploadSession.DoesNotExist:
+                        return error_response('Upload session not found', 404)
+                    try:
+                        column_ids = pin_columns(session, content.get('columns', []))
+                    except UnsupportedTimeseriesDataTypeError as e:
+                        return error_response(f'Unsupported variable type: {e}')
+                    except (KeyError, TypeError, DataUnit.DoesNotExist, DataColumnType.DoesNotExist) as e:
+                        return error_response(f'Invalid column declaration: {e}')
+                    return Response({'upload_session': {'token': session.token, 'columns': column_ids}})
+                upload_session = None
+                duplicate = False
                 if content['status'] in ['begin', 'in_progress', 'complete']:
                     try:
                         if content['status'] == 'begin':
+                            if StagedChunk.objects.filter(
+                                    session__file=file,
+                                    sequence__gte=F('session__next_sequence')
+                            ).exists():
+                                return error_response(
+                                    'Data from an earlier upload of this file are still being written',
+                                    409
+                                )
                             file.state = FileState.IMPORTING
                             date = deserialize_datetime(content['test_date'])
                             # process metadata under 'begin'
@@ -544,69 +687,85 @@ class HarvesterViewSet(viewsets.ModelViewSet):
                                 file=file,
                                 date=date
                             )
+                            # Data are uploaded in a session that pins the Dataset and Columns,
+                            # replacing any session left by an earlier import of the file
+                            UploadSession.objects.filter(file=file).delete()
+                            upload_session = UploadSession.objects.create(file=file, dataset=dataset)
+                            column_ids = pin_columns(upload_session, content.get('columns', []))
                         elif content['status'] == 'complete':
+                            with transaction.atomic():
+                                session = UploadSession.objects.select_for_update(no_key=True).filter(file=file).first()
+                                if session is not None and session.pending_chunks().exists():
+                                    missing = first_missing_chunk(session)
+                                    if session.pending_chunks().filter(sequence__gt=missing).exists():
+                                        return error_response(f'Chunk {missing} was never received', 409)
+                                    # The ingest worker completes the import once the staged chunks are written
+                                    session.completed = True
+                                    session.save()
+                                    return Response(
+                                        ObservedFileSerializer(file, context={'request': self.request}).data,
+                                        status=202
+                                    )
                             if file.state == FileState.IMPORTING:
                                 file.state = FileState.IMPORTED
+                        elif 'upload_session' in content:
+                            # Columns were resolved when they were declared, so only their ids are sent
+                            try:
+                                session = UploadSession.objects.get(token=content['upload_session'], file=file)
+                            except UploadSession.DoesNotExist:
+                                return error_response('Upload session not found', 404)
+                            try:
+                                # Chunks are numbered, so a chunk sent again is acknowledged but not written twice
+                                if settings.INGEST_QUEUE:
+                                    duplicate = not stage_chunk(session, content)
+                                    return Response(
+                                        {'queued_chunks': session.pending_chunks().count(), 'duplicate': duplicate},
+                                        status=202
+                                    )
+                                duplicate = not write_session_chunk(session, content)
+                            except OutOfSequenceError as e:
+                                return error_response(str(e), 409)
+                            except ValueError as e:
+                                return error_response(str(e))
+                            except IntegrityError:
+                                # The session ended while the chunk was being staged
+                                return error_response('Upload session not found', 404)
+                            except Exception as e:
+                                return error_response(f"Error saving data. {type(e)}: {e.args[0] if e.args else e}")
                         else:
                             time_start = time.time()
                             date = deserialize_datetime(content['test_date'])
                             dataset = Dataset.objects.get(file=file, date=date)
+                            columns_values = []
                             for column_data in content['data']:
                                 time_col_start = time.time()
                                 logger.warning(f"Column {column_data.get('column_name', column_data.get('column_id'))}")
-                                try:
-                                    data_type = column_data.get('data_type')
-                                except KeyError:
-                                    return error_response(f"Could not find sample data for column {column_data}")
-                                try:
-                                    column_type = DataColumnType.objects.get(id=column_data['column_id'])
-                                    column, _ = DataColumn.objects.get_or_create(
-                                        name=column_type.name,
-                                        data_type=data_type,
-                                        type=column_type,
-                                        dataset=dataset,
-                                        official_sample_counter=column_data.get('official_sample_counter', False)
-                                    )
-                                except KeyError:
-                                    if 'unit_id' in column_data:
-                                        unit = DataUnit.objects.get(id=column_data['unit_id'])
-                                    else:
-                                        unit, _ = DataUnit.objects.get_or_create(symbol=column_data['unit_symbol'])
-                                    try:
-                                        column_type = DataColumnType.objects.get(unit=unit)
-                                    except DataColumnType.DoesNotExist:
-                                        column_type = DataColumnType.objects.create(
-                                            name=column_data['column_name'],
-                                            unit=unit
-                                        )
-                                    column, _ = DataColumn.objects.get_or_create(
-                                        name=column_data['column_name'],
-                                        data_type=data_type,
-                                        type=column_type,
-                                        dataset=dataset,
-                                        official_sample_counter=column_data.get('official_sample_counter', False)
-                                    )
+                                column = get_or_create_column(dataset, column_data)
 
-                                time_ts_prep = time.time()
-                                # get timeseries handler
+                                # check the data type has a timeseries handler
                                 try:
-                                    handler = get_timeseries_handler_by_type(column.data_type)
+                                    get_timeseries_handler_by_type(column.data_type)
                                 except UnsupportedTimeseriesDataTypeError:
                                     return error_response(
                                         f'Unsupported variable type {column.data_type} in column {column.name}'
                                     )
-                                try:
-                                    # insert values
-                                    timeseries, _ = handler.objects.get_or_create(column=column)
-                                    data = timeseries.values if timeseries.values is not None else []
-                                    data = [*data, *column_data["values"]]
-                                    timeseries.values = data
-                                    timeseries.save()
-                                except Exception as e:
-                                    return error_response(f"Error saving column {column_data['column_name']}. {type(e)}: {e.args[0]}")
-                                checkpoint('created timeseries data', time_ts_prep)
+                                values = column_data["values"]
+                                if isinstance(values, numpy.ndarray):
+                                    # Sent in the columnar format
+                                    values = values.tolist()
+                                columns_values.append((column, values))
                                 checkpoint('column complete', time_col_start)
 
+                            time_ts_prep = time.time()
+                            try:
+                                # insert values as new chunks, leaving the data already stored untouched
+                                copy_chunks(columns_values)
+                            except Exception as e:
+                                return error_response(f"Error saving data. {type(e)}: {e.args[0] if e.args else e}")
+                            checkpoint('created timeseries data', time_ts_prep)
+
+                            if 'core_metadata' in content:
+                                update_row_counts(dataset, content['core_metadata'])
                             checkpoint('complete', time_start)
                     except BaseException as e:
                         file.state = FileState.IMPORT_FAILED
@@ -615,13 +774,25 @@ class HarvesterViewSet(viewsets.ModelViewSet):
                         return error_response(f"Error importing data: {e.args}")
                 if content['status'] == 'failed':
                     file.state = FileState.IMPORT_FAILED
+                    # Data already staged are still written, as they would have been had they not been staged
+                    # Chunks after one that never arrived can't be written, so they are discarded
+                    for session in UploadSession.objects.filter(file=file):
+                        end_upload(session)
+                    UploadSession.objects.filter(file=file, staged_chunks__isnull=True).delete()
+                if content['status'] == 'complete':
+                    UploadSession.objects.filter(file=file).delete()
 
                 file.save()
 
-                return Response(ObservedFileSerializer(file, context={
+                data = ObservedFileSerializer(file, context={
                     'request': self.request,
                     'with_upload_info': content['status'] == 'begin'
-                }).data)
+                }).data
+                if upload_session is not None:
+                    data['upload_session'] = {'token': upload_session.token, 'columns': column_ids}
+                if duplicate:
+                    data['duplicate'] = True
+                return Response(data)
             else:
                 return error_response('Unrecognised task')
         else:
@@ -796,9 +967,10 @@ class ObservedFileViewSet(viewsets.ModelViewSet):
             self.check_object_permissions(self.request, file)
         except ObservedFile.DoesNotExist:
             return error_response('Requested file not found')
-        TimeseriesDataFloat.objects.filter(column__dataset__file=file).delete()
-        TimeseriesDataInt.objects.filter(column__dataset__file=file).delete()
-        TimeseriesDataStr.objects.filter(column__dataset__file=file).delete()
+        for handler in TIMESERIES_CHUNK_MODELS:
+            handler.objects.filter(column__dataset__file=file).delete()
+        # An import already under way can no longer upload data
+        UploadSession.objects.filter(file=file).delete()
         file.state = FileState.RETRY_IMPORT
         file.save()
         return Response(self.get_serializer(file, context={'request': request}).data)
@@ -1188,24 +1360,32 @@ class DataColumnViewSet(viewsets.ReadOnlyModelViewSet):
         """
         column = get_object_or_404(DataColumn, id=pk)
         self.check_object_permissions(self.request, column)
-        handlers = [TimeseriesDataFloat, TimeseriesDataInt, TimeseriesDataStr]
-        for handler in handlers:
-            if handler.objects.filter(column=column).exists():
-                values = handler.objects.get(column=column).values
-                # Handle querystring parameters
-                if 'min' in request.query_params:
-                    values = values[int(request.query_params['min']):]
-                if 'max' in request.query_params:
-                    values = values[:int(request.query_params['max'])]
-                if 'mod' in request.query_params:
-                    values = values[::int(request.query_params['mod'])]
-
-                def stream():
-                    for v in values:
-                        yield v
-                        yield '\n'.encode('utf-8')
-                return StreamingHttpResponse(stream())
-        return error_response('No data found for this column.', 404)
+        try:
+            handler = get_timeseries_handler_by_type(column.data_type)
+        except UnsupportedTimeseriesDataTypeError:
+            return error_response('No data found for this column.', 404)
+        if not handler.objects.filter(column=column).exists():
+            return error_response('No data found for this column.', 404)
+        # Handle querystring parameters
+        try:
+            start = int(request.query_params.get('min', 0))
+            length = int(request.query_params['max']) if 'max' in request.query_params else None
+            step = int(request.query_params.get('mod', 1))
+        except ValueError:
+            return error_response('min, max, and mod must be integers')
+        if start < 0 or (length is not None and length < 0) or step < 1:
+            return error_response('min and max must not be negative, and mod must be positive')
+        stop = start + length if length is not None else None
+
+        def stream():
+            # Chunks are read one at a time, so the whole column is never held in memory
+            offset = 0
+            for values in get_timeseries_values(column, start, stop):
+                for v in values[(-offset) % step::step]:
+                    yield v
+                    yield '\n'.encode('utf-8')
+                offset += len(values)
+        return StreamingHttpResponse(stream())
 
 
 @extend_schema_view(
@@ -27,7 +27,8 @@ done
 >&2 echo "Postgres ready - initialising"
 >&2 echo "DJANGO_TEST=${DJANGO_TEST}"
 >&2 echo "DJANGO_SETTINGS=${DJANGO_SETTINGS}"
-python manage.py makemigrations
+# Migrations are checked in; fail rather than start with models that have no migration
+python manage.py makemigrations --check --dry-run
 python manage.py migrate
 python manage.py init_db
 python manage.py create_superuser
@@ -45,6 +46,20 @@ if [ -z "${DJANGO_TEST}" ]; then
   else
     WORKERS_PER_CPU=${GUNICORN_WORKERS_PER_CPU:-2}
     WORKERS=$(expr $WORKERS_PER_CPU \* $(grep -c ^processor /proc/cpuinfo))
+    case "${DJANGO_INGEST_QUEUE}" in
+      [Ff]*|"") ;;
+      *)
+        >&2 echo "Launching ingest workers"
+        # Restart the workers if they exit, so staged chunks are always written
+        (
+          while true; do
+            python manage.py ingest_worker || true
+            >&2 echo "Ingest workers exited - restarting"
+            sleep 5
+          done
+        ) &
+        ;;
+    esac
     >&2 echo "Launching production server with gunicorn ($WORKERS workers [${WORKERS_PER_CPU} per CPU])"
     gunicorn config.wsgi \
       --env DJANGO_SETTINGS_MODULE=config.settings \
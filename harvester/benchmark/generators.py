@@ -0,0 +1,268 @@
+# SPDX-License-Identifier: BSD-2-Clause
+# Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
+# of Oxford, and the 'Galv' Developers. All rights reserved.
+
+import os
+import numpy as np
+from galvani import BioLogic
+from harvester.parse.ivium_input_file import IDF_HEADER
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+try:
+    import xlwt
+except ImportError:
+    xlwt = None
+
+# Number of rows generated and written at a time
+CHUNK_ROWS = 100_000
+# Rows in each step of the synthetic cycling protocol, and steps in each cycle
+STEP_ROWS = 1000
+CYCLE_STEPS = 4
+# Most rows a sheet can hold, leaving space for the metadata and header rows
+XLS_SHEET_ROWS = 65_534
+XLSX_SHEET_ROWS = 1_000_000
+
+MACCOR_COLUMNS = ["Rec#", "Cyc#", "Step", "TestTime", "StepTime", "Amp-hr", "Watt-hr", "Amps", "Volts", "State", "ES"]
+MACCOR_RAW_COLUMNS = [
+    "Rec#", "Cyc#", "Step", "Test (Sec)", "Step (Sec)", "Amp-hr", "Watt-hr", "Amps", "Volts", "State", "ES", "DPt Time"
+]
+
+
+def cycling(start: int, stop: int) -> dict:
+    """
+        Rows start to stop of a test that charges at constant current, holds at constant voltage,
+        rests, and then discharges, sampling every second.
+        Returns a dict of column name to values.
+    """
+    i = np.arange(start, stop)
+    step_index = i // STEP_ROWS
+    phase = step_index % CYCLE_STEPS
+    step_time = (i % STEP_ROWS).astype(np.float64)
+    progress = step_time / STEP_ROWS
+    amps = np.select(
+        [phase == 0, phase == 1, phase == 2],
+        [np.full(len(i), 1.5), 1.5 * np.exp(-5 * progress), np.zeros(len(i))],
+        -1.5
+    )
+    volts = np.select(
+        [phase == 0, phase == 1, phase == 2],
+        [3.2 + progress, np.full(len(i), 4.2), 4.2 - 0.1 * progress],
+        4.1 - progress
+    )
+    amp_hr = np.abs(amps) * step_time / 3600
+    return {
+        'rec': i + 1,
+        'cycle': step_index // CYCLE_STEPS,
+        'step': phase + 1,
+        'test_time': i.astype(np.float64),
+        'step_time': step_time,
+        'amps': amps,
+        'volts': volts,
+        'amp_hr': amp_hr,
+        'watt_hr': amp_hr * volts,
+        'state': np.array(['C', 'C', 'R', 'D'])[phase],
+        'es': (step_time == 0).astype(np.int64),
+        'mode': np.array([1, 2, 3, 1])[phase],
+        'new_step': (step_time == 0) & (i > 0),
+    }
+
+
+def chunks(rows: int):
+    """
+        Yield the cycling data for rows rows, CHUNK_ROWS at a time
+    """
+    for start in range(0, rows, CHUNK_ROWS):
+        yield cycling(start, min(start + CHUNK_ROWS, rows))
+
+
+def maccor_rows(data: dict) -> zip:
+    return zip(
+        data['rec'].tolist(), data['cycle'].tolist(), data['step'].tolist(),
+        data['test_time'].tolist(), data['step_time'].tolist(), data['amp_hr'].tolist(),
+        data['watt_hr'].tolist(), data['amps'].tolist(), data['volts'].tolist(),
+        data['state'].tolist(), data['es'].tolist(),
+    )
+
+
+def write_maccor_text(path: str, rows: int):
+    """
+        Write a Maccor text export, tab separated for .txt files and comma separated for .csv files
+    """
+    delimiter = "," if path.endswith(".csv") else "\t"
+    with open(path, "w", newline="") as f:
+        # Maccor writes the apostrophe doubled
+        f.write(f"Today''s Date{delimiter}01/02/2020 10:11:12 AM\r\n")
+        f.write(f"Date of Test:{delimiter}01/01/2020 09:00:00 AM\r\n")
+        f.write(delimiter.join(MACCOR_COLUMNS) + "\r\n")
+        for data in chunks(rows):
+            f.write("".join(
+                delimiter.join([
+                    str(rec), str(cyc), str(step), f"{t:.1f}", f"{st:.1f}", f"{ah:.6f}",
+                    f"{wh:.6f}", f"{a:.6f}", f"{v:.6f}", state, str(es)
+                ]) + "\r\n"
+                for rec, cyc, step, t, st, ah, wh, a, v, state, es in maccor_rows(data)
+            ))
+
+
+def write_maccor_raw(path: str, rows: int):
+    """
+        Write a Maccor raw data file
+    """
+    with open(path, "w", newline="") as f:
+        f.write(
+            "Today's Date 01/02/2020  Date of Test:\t01/01/2020\t Filename:\t"
+            f"C:\\data\\{os.path.basename(path)} Procedure: Test.000\tComment/Barcode: benchmark\r\n"
+        )
+        f.write("\t".join(MACCOR_RAW_COLUMNS) + "\r\n")
+        for data in chunks(rows):
+            f.write("".join(
+                f"{rec}\t{cyc}\t{step}\t{t:.1f}\t{st:.1f}\t{ah:.6f}\t{wh:.6f}\t{a:.6f}\t{v:.6f}\t{state}\t{es}"
+                "\t01/01/2020 09:00:00\r\n"
+                for rec, cyc, step, t, st, ah, wh, a, v, state, es in maccor_rows(data)
+            ))
+
+
+def sheet_rows(rows: int, rows_per_sheet: int):
+    """
+        Yield the rows of each sheet of a workbook holding rows rows, as a generator of row lists
+    """
+    def rows_in(start, stop):
+        for chunk_start in range(start, stop, CHUNK_ROWS):
+            yield from maccor_rows(cycling(chunk_start, min(chunk_start + CHUNK_ROWS, stop)))
+
+    for start in range(0, max(rows, 1), rows_per_sheet):
+        yield rows_in(start, min(start + rows_per_sheet, rows))
+
+
+def write_maccor_excel(path: str, rows: int):
+    """
+        Write a Maccor Excel export, with as many sheets as needed to hold the rows.
+        .xls files need xlwt and .xlsx files need openpyxl.
+    """
+    metadata = ["Today's Date", 43832.5, "Date of Test:", 43831.25, "Filename:", f"C:\\data\\{os.path.basename(path)}"]
+    # Excel exports put Rec# last
+    headers = MACCOR_COLUMNS[1:] + MACCOR_COLUMNS[:1]
+    if path.endswith(".xlsx"):
+        if openpyxl is None:
+            raise RuntimeError("openpyxl is required to write .xlsx files")
+        book = openpyxl.Workbook(write_only=True)
+        for n, sheet_data in enumerate(sheet_rows(rows, XLSX_SHEET_ROWS)):
+            sheet = book.create_sheet(f"Sheet{n + 1}")
+            sheet.append(metadata)
+            sheet.append(headers)
+            for row in sheet_data:
+                sheet.append(list(row[1:]) + [row[0]])
+        book.save(path)
+        return
+    if xlwt is None:
+        raise RuntimeError("xlwt is required to write .xls files")
+    book = xlwt.Workbook()
+    for n, sheet_data in enumerate(sheet_rows(rows, XLS_SHEET_ROWS)):
+        sheet = book.add_sheet(f"Sheet{n + 1}")
+        for col, value in enumerate(metadata):
+            sheet.write(0, col, value)
+        for col, value in enumerate(headers):
+            sheet.write(1, col, value)
+        for r, row in enumerate(sheet_data, start=2):
+            for col, value in enumerate(list(row[1:]) + [row[0]]):
+                sheet.write(r, col, value)
+    book.save(path)
+
+
+def write_ivium(path: str, rows: int):
+    """
+        Write an Ivium .idf file of a constant current discharge followed by a rest
+    """
+    duration = max(rows // 2, 1)
+    metadata = [
+        "Mconfig=", "starttime=01/02/2020 10:00:00", "Tasks=2",
+        "Tasks.Mode[1]=CC", "Tasks.End1[1]=Duration", "Tasks.End2[1]=select",
+        "Tasks.End3[1]=select", "Tasks.End4[1]=select", f"Tasks.Duration[1]={duration}",
+        "Tasks.Mode[2]=OCP", "Tasks.End1[2]=Duration", "Tasks.End2[2]=select",
+        "Tasks.End3[2]=select", "Tasks.End4[2]=select", f"Tasks.Duration[2]={rows}",
+        "primary_data", "3", str(rows), "0",
+    ]
+    with open(path, "wb") as f:
+        f.write(IDF_HEADER + b"\r\n")
+        f.write("".join(f"{line}\r\n" for line in metadata).encode())
+        for data in chunks(rows):
+            amps = np.where(data['test_time'] < duration, -0.1, 0.0)
+            volts = 3.5 - np.minimum(data['test_time'], duration) * 1e-6
+            f.write("".join(
+                f"{t:12.5E} {a:12.5E} {v:12.5E}\r\n"
+                for t, a, v in zip(data['test_time'].tolist(), amps.tolist(), volts.tolist())
+            ).encode())
+
+
+# Column IDs of the fields written to .mpr files, in order
+MPR_COLUMN_IDS = [1, 31, 131, 4, 5, 6, 8, 467, 74]
+# Bytes of the data module's header before the records begin, for version 2 data modules
+MPR_DATA_HEADER_BYTES = 405
+
+
+def mpr_module(shortname: bytes, longname: bytes, version: int, length: int) -> bytes:
+    """
+        Header of a .mpr file module whose data are length bytes long
+    """
+    header = np.zeros(1, dtype=BioLogic.VMPmodule_hdr)
+    header['shortname'] = shortname.ljust(10)
+    header['longname'] = longname.ljust(25)
+    header['length'] = length
+    header['version'] = version
+    header['date'] = b"01/02/20"
+    return b"MODULE" + header.tobytes()
+
+
+def write_biologic_mpr(path: str, rows: int):
+    """
+        Write a BioLogic .mpr file readable by galvani, with one step (Ns) per protocol step
+    """
+    dtype, flags = BioLogic.VMPdata_dtype_from_colIDs(MPR_COLUMN_IDS)
+    with open(path, "wb") as f:
+        f.write(BioLogic.MPR_MAGIC)
+        f.write(mpr_module(b"VMP Set", b"VMP settings", 0, 0))
+        f.write(mpr_module(b"VMP data", b"VMP data", 2, MPR_DATA_HEADER_BYTES + rows * dtype.itemsize))
+        header = np.zeros(MPR_DATA_HEADER_BYTES, dtype=np.uint8)
+        header[0:4] = np.frombuffer(np.uint32(rows).tobytes(), dtype=np.uint8)
+        header[4] = len(MPR_COLUMN_IDS)
+        header[5:5 + 2 * len(MPR_COLUMN_IDS)] = np.frombuffer(
+            np.array(MPR_COLUMN_IDS, dtype='<u2').tobytes(), dtype=np.uint8
+        )
+        f.write(header.tobytes())
+        for data in chunks(rows):
+            records = np.zeros(len(data['rec']), dtype=dtype)
+            records['flags'] = data['mode'] | np.where(data['new_step'], flags['Ns changes'][0], 0)
+            records['Ns'] = (data['rec'] - 1) // STEP_ROWS
+            records['time/s'] = data['test_time']
+            records['control/V/mA'] = np.where(data['mode'] == 2, data['volts'], data['amps'] * 1e3)
+            records['Ewe/V'] = data['volts']
+            records['I/mA'] = data['amps'] * 1e3
+            records['Q charge/discharge/mA.h'] = data['amp_hr'] * 1e3
+            records['Energy/W.h'] = data['watt_hr']
+            f.write(records.tobytes())
+
+
+# Format name to the file extension and generator for that format
+GENERATORS = {
+    'maccor_txt': ('.txt', write_maccor_text),
+    'maccor_csv': ('.csv', write_maccor_text),
+    'maccor_raw': ('.001', write_maccor_raw),
+    'maccor_xls': ('.xls', write_maccor_excel),
+    'maccor_xlsx': ('.xlsx', write_maccor_excel),
+    'ivium': ('.idf', write_ivium),
+    'biologic': ('.mpr', write_biologic_mpr),
+}
+
+
+def generate(file_format: str, directory: str, rows: int) -> str:
+    """
+        Write a synthetic file of file_format with rows rows in directory, and return its path
+    """
+    extension, generator = GENERATORS[file_format]
+    path = os.path.join(directory, f"{file_format}_{rows}{extension}")
+    generator(path, rows)
+    return path
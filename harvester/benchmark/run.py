@@ -0,0 +1,216 @@
+# SPDX-License-Identifier: BSD-2-Clause
+# Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
+# of Oxford, and the 'Galv' Developers. All rights reserved.
+
+"""
+Measure how quickly, and with how much memory, each parser reads synthetic files.
+
+Run from the harvester directory, e.g.
+    LOG_FILE=/tmp/benchmark.log python -m benchmark.run run --rows 10000 --rows 1000000 --output results.json
+"""
+
+import click
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import psutil
+
+from harvester.parse.input_file import DEFAULT_BLOCK_ROWS
+from harvester.harvest import get_input_file_class
+from .generators import GENERATORS, generate
+
+MIN_ROWS = 10_000
+MAX_ROWS = 50_000_000
+
+STANDARD_COLUMNS = {
+    name: i for i, name in enumerate([
+        "Unknown", "Sample Number", "Time", "Volts", "Amps", "Energy Capacity", "Charge Capacity",
+        "Temperature", "Step Time", "Impedence Magnitude", "Impedence Phase", "Frequency",
+    ], start=1)
+}
+STANDARD_UNITS = {
+    name: i for i, name in enumerate([
+        "Unitless", "Time", "Volts", "Amps", "Energy", "Charge", "Temperature", "Power", "Ohm", "Degrees", "Frequency",
+    ], start=1)
+}
+
+
+def peak_rss(who: int = resource.RUSAGE_SELF) -> int:
+    """
+    Largest resident set size of this process (or of its largest finished child process) so far, in bytes
+    """
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes and macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def benchmark_file(path: str, parse_processes: int = 1, block_rows: int = DEFAULT_BLOCK_ROWS) -> dict:
+    """
+    Parse the file at path as an import would, timing each phase.
+    Rows and labels are counted rather than kept, so memory use is the parser's own.
+    """
+    start_rss = psutil.Process().memory_info().rss
+    phases = {}
+
+    start = time.perf_counter()
+    input_file_cls = get_input_file_class(path)
+    phases['sniff'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    input_file = input_file_cls(
+        file_path=path,
+        standard_columns=STANDARD_COLUMNS,
+        standard_units=STANDARD_UNITS,
+        parse_processes=parse_processes
+    )
+    phases['metadata'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rows = 0
+    for block in input_file.load_blocks(list(input_file.column_info.keys()), block_rows):
+        rows += len(next(iter(block.values()))) if len(block) else 0
+    phases['data'] = time.perf_counter() - start
+
+    # Parsers with lazy_has_data find their labels while reading the data
+    start = time.perf_counter()
+    labels = sum(1 for _ in input_file.get_data_labels())
+    phases['labels'] = time.perf_counter() - start
+
+    seconds = sum(phases.values())
+    size = os.path.getsize(path)
+    return {
+        'parser': input_file_cls.__name__,
+        'file_bytes': size,
+        'rows': rows,
+        'labels': labels,
+        'parse_processes': parse_processes,
+        'block_rows': block_rows,
+        'phases': phases,
+        'seconds': seconds,
+        'rows_per_second': rows / seconds if seconds else None,
+        'megabytes_per_second': size / 1e6 / seconds if seconds else None,
+        'start_rss_bytes': start_rss,
+        'peak_rss_bytes': peak_rss(),
+        # Parsers using parse_processes read in worker processes
+        'children_peak_rss_bytes': peak_rss(resource.RUSAGE_CHILDREN),
+    }
+
+
+def _benchmark_in_child(connection, *args):
+    try:
+        connection.send(benchmark_file(*args))
+    except Exception as e:
+        connection.send(e)
+    finally:
+        connection.close()
+
+
+def benchmark_in_process(*args) -> dict:
+    """
+    Run benchmark_file in a new process, so each peak RSS measures only that file.
+    The process is not a daemon, so parsers can start their own worker processes.
+    """
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_benchmark_in_child, args=(sender, *args))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = None
+    process.join()
+    if result is None:
+        raise RuntimeError(f"Benchmark process for {args[0]} exited with code {process.exitcode}")
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command(name='generate')
+@click.argument('file_format', type=click.Choice(list(GENERATORS.keys())))
+@click.option('--rows', type=int, default=MIN_ROWS, show_default=True, help="Number of data rows to write.")
+@click.option('--directory', type=click.Path(file_okay=False), default=".", show_default=True)
+def generate_command(file_format: str, rows: int, directory: str):
+    """
+    Write a synthetic FILE_FORMAT file.
+    """
+    os.makedirs(directory, exist_ok=True)
+    click.echo(generate(file_format, directory, rows))
+
+
+@cli.command(name='run')
+@click.option(
+    '--format', 'file_formats', type=click.Choice(list(GENERATORS.keys())), multiple=True,
+    help="Formats to benchmark. May be repeated; all formats by default."
+)
+@click.option(
+    '--rows', 'row_counts', type=click.IntRange(MIN_ROWS, MAX_ROWS), multiple=True,
+    help=f"Rows in each file. May be repeated; {MIN_ROWS} by default."
+)
+@click.option('--parse-processes', type=click.IntRange(1), default=1, show_default=True)
+@click.option('--block-rows', type=click.IntRange(1), default=DEFAULT_BLOCK_ROWS, show_default=True)
+@click.option(
+    '--directory', type=click.Path(file_okay=False),
+    help="Where to write the synthetic files, which are kept. A temporary directory is used by default."
+)
+@click.option('--label', type=str, help="Label to store with the results, e.g. the release being measured.")
+@click.option('--output', type=click.Path(dir_okay=False), help="File to save the results to as JSON.")
+def run_command(
+        file_formats: tuple, row_counts: tuple, parse_processes: int, block_rows: int,
+        directory: str, label: str, output: str
+):
+    """
+    Generate synthetic files and report how fast each is parsed.
+    """
+    file_formats = file_formats or tuple(GENERATORS.keys())
+    row_counts = row_counts or (MIN_ROWS,)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = directory or tmp
+        os.makedirs(directory, exist_ok=True)
+        for rows in row_counts:
+            for file_format in file_formats:
+                try:
+                    path = generate(file_format, directory, rows)
+                except RuntimeError as e:
+                    click.echo(f"Skipping {file_format}: {e}", err=True)
+                    continue
+                result = {
+                    'format': file_format,
+                    **benchmark_in_process(path, parse_processes, block_rows)
+                }
+                results.append(result)
+                click.echo((
+                    f"{file_format:12} {rows:>10} rows {result['file_bytes'] / 1e6:>10.1f} MB "
+                    f"{result['rows_per_second']:>12.0f} rows/s {result['megabytes_per_second']:>8.2f} MB/s "
+                    f"peak RSS {result['peak_rss_bytes'] / 1e6:>8.1f} MB | " +
+                    " ".join(f"{phase} {seconds:.3f}s" for phase, seconds in result['phases'].items())
+                ))
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump({
+                'label': label,
+                'created': datetime.datetime.now().isoformat(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'results': results,
+            }, f, indent=2)
+        click.echo(f"Results saved to {output}")
+
+
+if __name__ == "__main__":
+    cli()
@@ -2,39 +2,123 @@
 # Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
 # of Oxford, and the 'Galv' Developers. All rights reserved.
 
+import gzip
+import logging
 import os
 import json
 from .utils import NpEncoder
+from . import columnar
 import requests
-from .settings import get_setting, get_settings, get_settings_file, get_logger, update_envvars
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .settings import get_setting, get_settings, get_settings_file, get_logger, update_envvars, get_compression, \
+    get_upload_format
 import time
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 logger = get_logger(__file__)
 
+# Request bodies smaller than this are not worth compressing
+COMPRESSION_THRESHOLD = 1024
 
-def report_harvest_result(
+
+def make_session() -> requests.Session:
+    """
+    Create a Session that keeps connections to the server alive between calls.
+
+    Requests are retried if the connection cannot be made, because then the server has not seen them.
+    A proxy reporting the server unavailable only leads to a retry for idempotent methods (e.g. GET),
+    because a 502 can arrive after the server has processed a POSTed report.
+    Resending data chunks is left to UploadPipeline, which only does so when the server can spot duplicates.
+    """
+    retry = Retry(
+        total=3,
+        connect=3,
+        read=0,
+        status=3,
+        status_forcelist=[502, 503],
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+        backoff_factor=0.5,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(max_retries=retry)
+    new_session = requests.Session()
+    new_session.mount('http://', adapter)
+    new_session.mount('https://', adapter)
+    return new_session
+
+
+session = make_session()
+
+
+def compress(body: bytes) -> (bytes, str|None):
+    """
+    Compress a request body according to HARVESTER_COMPRESSION.
+    Returns the body to send and the Content-Encoding to declare (None if uncompressed).
+    """
+    if len(body) < COMPRESSION_THRESHOLD:
+        return body, None
+    encoding = get_compression()
+    if encoding == 'zstd':
+        if zstandard is not None:
+            return zstandard.ZstdCompressor(level=3).compress(body), 'zstd'
+        logger.warning("HARVESTER_COMPRESSION is 'zstd' but zstandard is not installed; using gzip")
+        encoding = 'gzip'
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=5), 'gzip'
+    return body, None
+
+
+def prepare_report(
         path: os.PathLike|str,
         monitored_path_id: int,
         content=None,
         error: BaseException = None
-):
+) -> (bytes, dict):
+    """
+    Serialise and compress a report, returning the request body and headers.
+    This is separate from sending so that the CPU work can be overlapped with other requests.
+    """
+    if error is not None:
+        data = {'status': 'error', 'error': ";".join(error.args)}
+    else:
+        data = {'status': 'success', 'content': content}
+    data['path'] = path
+    data['monitored_path_id'] = monitored_path_id
+    if content is not None and 'data' in content and get_upload_format() == 'columnar':
+        body = columnar.encode(data)
+        content_type = columnar.MEDIA_TYPE
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"{get_setting('url')}report/; columnar data, {len(body)} bytes")
+    else:
+        # NpEncoder converts np values to standard types
+        body = json.dumps(data, cls=NpEncoder)
+        content_type = 'application/json'
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"{get_setting('url')}report/; {body}")
+        body = body.encode('utf-8')
+    body, encoding = compress(body)
+    headers = {
+        'Authorization': f"Harvester {get_setting('api_key')}",
+        'Content-Type': content_type
+    }
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+    return body, headers
+
+
+def send_report(body: bytes, headers: dict):
+    """
+    Send a report prepared by prepare_report.
+    Returns the server's response, or None if there was no valid response.
+    """
     start = time.time()
     try:
-        if error is not None:
-            data = {'status': 'error', 'error': ";".join(error.args)}
-        else:
-            data = {'status': 'success', 'content': content}
-        data['path'] = path
-        data['monitored_path_id'] = monitored_path_id
-        logger.debug(f"{get_setting('url')}report/; {json.dumps(data, cls=NpEncoder)}")
-        out = requests.post(
-            f"{get_setting('url')}report/",
-            headers={
-                'Authorization': f"Harvester {get_setting('api_key')}"
-            },
-            # encode then decode to ensure np values are converted to standard types
-            json=json.loads(json.dumps(data, cls=NpEncoder))
-        )
+        out = session.post(f"{get_setting('url')}report/", headers=headers, data=body)
         try:
             out.json()
         except json.JSONDecodeError:
@@ -50,12 +134,26 @@ def report_harvest_result(
     return out
 
 
+def report_harvest_result(
+        path: os.PathLike|str,
+        monitored_path_id: int,
+        content=None,
+        error: BaseException = None
+):
+    try:
+        body, headers = prepare_report(path, monitored_path_id, content=content, error=error)
+    except BaseException as e:
+        logger.error(e)
+        return None
+    return send_report(body, headers)
+
+
 def update_config():
     logger.info("Updating configuration from API")
     try:
         url = get_setting('url')
         key = get_setting('api_key')
-        result = requests.get(f"{url}config/", headers={'Authorization': f"Harvester {key}"})
+        result = session.get(f"{url}config/", headers={'Authorization': f"Harvester {key}"})
         if result.status_code == 200:
             dirty = False
             new = result.json()
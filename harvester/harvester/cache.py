@@ -0,0 +1,194 @@
+# SPDX-License-Identifier: BSD-2-Clause
+# Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
+# of Oxford, and the 'Galv' Developers. All rights reserved.
+
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+from .settings import get_logger, get_stat_cache_file, get_parse_cache_dir, get_parse_cache_bytes
+
+logger = get_logger(__file__)
+
+# Server states after which an unchanged file needs no further attention
+FINAL_STATES = ['IMPORTED', 'IMPORT FAILED']
+
+
+def fingerprint(stat: os.stat_result) -> list:
+    """
+    Identify a version of a file by its size, modification time, and inode
+    """
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+
+class StatCache:
+    """
+    A persistent record of the files a Harvester has seen.
+
+    Entries are keyed by absolute path and hold the file's fingerprint,
+    the name of the InputFile class that can parse it (None if unsupported),
+    the last state the server assigned it,
+    and, for files that can be resumed, where the last import stopped reading.
+    """
+    def __init__(self, cache_file: os.PathLike|str = None):
+        self.cache_file = cache_file if cache_file is not None else get_stat_cache_file()
+        self.entries = {}
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.cache_file, 'r') as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            self.entries = {}
+        except (json.JSONDecodeError, OSError) as e:
+            logger.warning(f"Discarding unreadable stat cache {self.cache_file}: {e}")
+            self.entries = {}
+        self.dirty = False
+
+    def save(self):
+        if not self.dirty:
+            return
+        try:
+            cache_dir = os.path.dirname(os.path.abspath(self.cache_file))
+            # Write to a temporary file first so an interrupted save can't corrupt the cache
+            with tempfile.NamedTemporaryFile('w', dir=cache_dir, delete=False) as f:
+                json.dump(self.entries, f)
+            os.replace(f.name, self.cache_file)
+            self.dirty = False
+        except OSError as e:
+            logger.warning(f"Unable to save stat cache {self.cache_file}: {e}")
+
+    def get(self, path: str) -> dict|None:
+        return self.entries.get(path)
+
+    def is_unchanged(self, path: str, stat: os.stat_result) -> bool:
+        entry = self.entries.get(path)
+        return entry is not None and entry.get('fingerprint') == fingerprint(stat)
+
+    def is_settled(self, path: str, stat: os.stat_result) -> bool:
+        """
+        True if the file is unchanged since the server last marked it imported or failed
+        """
+        return self.is_unchanged(path, stat) and self.entries[path].get('state') in FINAL_STATES
+
+    def update(self, path: str, stat: os.stat_result = None, **kwargs):
+        """
+        Update the entry for path.
+        A new fingerprint resets the entry, discarding the parser and state it held.
+        The resume point is kept, because files that grow are resumed from it;
+        parsers check the file still matches it before using it.
+        """
+        entry = self.entries.get(path, {})
+        if stat is not None and entry.get('fingerprint') != fingerprint(stat):
+            entry = {
+                'fingerprint': fingerprint(stat),
+                **({'resume': entry['resume']} if 'resume' in entry else {})
+            }
+        entry.update(kwargs)
+        self.entries[path] = entry
+        self.dirty = True
+
+    def unsettle(self, path: str):
+        """
+        Forget the state the server last assigned path, so the file is reported again even if it is unchanged
+        """
+        entry = self.entries.get(path)
+        if entry is not None and entry.pop('state', None) is not None:
+            self.dirty = True
+
+    def discard(self, path: str):
+        if self.entries.pop(path, None) is not None:
+            self.dirty = True
+
+
+class ParseCache:
+    """
+    A local store of what parsers learn about files before reading their data:
+    metadata, column information, the attributes the parser sets while reading them,
+    and the labels of the data once the file has been read.
+
+    Entries are pickled to one file each in cache_dir, keyed by the file's path, size
+    and modification time and by the parser's class and parse_cache_version,
+    so a changed file or parser never uses an old entry.
+    Once the entries take more than max_bytes, the least recently used are removed.
+    """
+    suffix = ".pickle"
+
+    def __init__(self, cache_dir: os.PathLike|str = None, max_bytes: int = None):
+        self.cache_dir = cache_dir if cache_dir is not None else get_parse_cache_dir()
+        self.max_bytes = max_bytes if max_bytes is not None else get_parse_cache_bytes()
+
+    @staticmethod
+    def key(input_file) -> str:
+        stat = os.stat(input_file.file_path)
+        cls = type(input_file)
+        return hashlib.sha256(json.dumps([
+            os.path.abspath(input_file.file_path),
+            stat.st_size,
+            stat.st_mtime_ns,
+            f"{cls.__module__}.{cls.__qualname__}",
+            cls.parse_cache_version
+        ]).encode()).hexdigest()
+
+    def entry_file(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + self.suffix)
+
+    def get(self, key: str) -> dict|None:
+        path = self.entry_file(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+            # Reading an entry makes it the most recently used
+            os.utime(path)
+            return entry
+        except FileNotFoundError:
+            return None
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError, OSError) as e:
+            logger.warning(f"Discarding unreadable parse cache entry {path}: {e}")
+            self.discard(key)
+            return None
+
+    def put(self, key: str, entry: dict):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Write to a temporary file first so an interrupted write can't leave a partial entry
+            with tempfile.NamedTemporaryFile('wb', dir=self.cache_dir, delete=False) as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(f.name, self.entry_file(key))
+        except (OSError, pickle.PicklingError) as e:
+            logger.warning(f"Unable to save parse cache entry {key}: {e}")
+            return
+        self.evict()
+
+    def discard(self, key: str):
+        try:
+            os.remove(self.entry_file(key))
+        except OSError:
+            pass
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the rest fit in max_bytes
+        """
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for e in it:
+                if e.name.endswith(self.suffix):
+                    try:
+                        stat = e.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime_ns, stat.st_size, e.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
@@ -0,0 +1,256 @@
+# SPDX-License-Identifier: BSD-2-Clause
+# Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
+# of Oxford, and the 'Galv' Developers. All rights reserved.
+
+import json
+import math
+import threading
+
+import numpy as np
+
+from .columnar import fits_buffer
+from .utils import NpEncoder
+
+# Bytes reserved in each chunk for the report's metadata and column descriptions
+CHUNK_OVERHEAD_BYTES = 4096
+# Chunks are never adapted to smaller than this
+MIN_CHUNK_BYTES = 64 * 1024
+# Longest JSON text for a value of each numpy dtype kind, including the separating ', '
+JSON_VALUE_BYTES = {'f': 26, 'i': 22, 'u': 22, 'b': 7}
+# Other values are sized from a sample, allowing this much for longer values later
+SAMPLE_MARGIN = 1.25
+# Limits on how much a single latency measurement can change the target chunk size
+MAX_SHRINK = 0.5
+MAX_GROWTH = 2.0
+
+
+class Chunker:
+    """
+    Decides how many rows of data to send to the server in each chunk.
+
+    The size of a row is estimated once, from the types of the values in a sample of rows,
+    rather than by serialising every row.
+    Chunks are cut by row count so that they fit within max_bytes.
+
+    If target_latency is given, the chunk size adapts so that each upload
+    takes about target_latency seconds, but never exceeds max_bytes.
+    """
+    def __init__(
+            self,
+            max_bytes: int,
+            columnar: bool = False,
+            target_latency: float = None,
+            min_bytes: int = MIN_CHUNK_BYTES,
+            overhead_bytes: int = CHUNK_OVERHEAD_BYTES
+    ):
+        self.max_bytes = max_bytes
+        self.columnar = columnar
+        self.target_latency = target_latency
+        self.min_bytes = min(min_bytes, max_bytes)
+        self.overhead_bytes = overhead_bytes
+        self.target_bytes = max_bytes
+        self.bytes_per_row = None
+        self.lock = threading.Lock()
+
+    def value_bytes(self, values: list|np.ndarray) -> float:
+        """
+        Estimate the wire bytes taken by each of the values in a column
+        """
+        array = values if isinstance(values, np.ndarray) else np.asarray(values)
+        kind = array.dtype.kind
+        if self.columnar and kind in 'fiu':
+            return 8
+        if kind in JSON_VALUE_BYTES:
+            return JSON_VALUE_BYTES[kind]
+        if len(values) == 0:
+            return 0
+        return len(json.dumps(list(values), cls=NpEncoder)) / len(values) * SAMPLE_MARGIN
+
+    def calibrate(self, columns: dict[str, list|np.ndarray]):
+        """
+        Set the estimated size of a row from a sample of column values
+        """
+        self.bytes_per_row = math.ceil(sum(self.value_bytes(v) for v in columns.values()))
+
+    @property
+    def calibrated(self) -> bool:
+        return self.bytes_per_row is not None
+
+    @property
+    def rows_per_chunk(self) -> int:
+        """
+        Number of rows to send in each chunk. 0 if a single row is too large to send.
+        """
+        if self.bytes_per_row is None:
+            raise ValueError("Chunker must be calibrated before use")
+        return self.rows_within_budget(self.bytes_per_row)
+
+    def rows_within_budget(self, bytes_per_row: float) -> int:
+        """
+        Number of rows of the given size that fit in a chunk
+        """
+        with self.lock:
+            budget = self.target_bytes - self.overhead_bytes
+        if budget <= 0:
+            return 0
+        return int(budget // max(bytes_per_row, 1))
+
+    def record_latency(self, seconds: float):
+        """
+        Adjust the target chunk size after an upload took the given time
+        """
+        if self.target_latency is None or seconds <= 0:
+            return
+        ratio = min(max(self.target_latency / seconds, MAX_SHRINK), MAX_GROWTH)
+        with self.lock:
+            self.target_bytes = int(min(max(self.target_bytes * ratio, self.min_bytes), self.max_bytes))
+
+
+# numpy dtypes used to hold columns of each server data_type; other columns are held in lists
+BUFFER_DTYPES = {'float': np.float64, 'int': np.int64}
+# Rows allocated for each column before the chunk size is known
+INITIAL_CAPACITY = 1024
+
+
+class ColumnBuffer:
+    """
+    Holds the values of a column waiting to be uploaded.
+
+    Numeric values are stored in a preallocated numpy array, which grows as needed.
+    If a value cannot be stored in the array (e.g. None, or a string)
+    the column falls back to a list.
+    """
+    def __init__(self, info: dict, capacity: int = INITIAL_CAPACITY):
+        self.info = info
+        dtype = BUFFER_DTYPES.get(info.get('data_type'))
+        self.values = np.empty(capacity, dtype=dtype) if dtype is not None else []
+        self.length = 0
+
+    @property
+    def is_array(self) -> bool:
+        return isinstance(self.values, np.ndarray)
+
+    def _reserve(self, length: int):
+        if length > len(self.values):
+            values = np.empty(max(length, 2 * len(self.values)), dtype=self.values.dtype)
+            values[:self.length] = self.values[:self.length]
+            self.values = values
+
+    def _to_list(self):
+        self.values = self.values[:self.length].tolist()
+
+    def append(self, value):
+        if self.is_array:
+            self._reserve(self.length + 1)
+            try:
+                if value is None:
+                    # numpy would store None as NaN
+                    raise TypeError
+                self.values[self.length] = value
+            except (ValueError, TypeError, OverflowError):
+                self._to_list()
+                self.values.append(value)
+        else:
+            self.values.append(value)
+        self.length += 1
+
+    def extend(self, values: np.ndarray|list):
+        """
+        Add many values at once, e.g. a slice of an array produced by a parser
+        """
+        if self.is_array:
+            self._reserve(self.length + len(values))
+            try:
+                if not isinstance(values, np.ndarray):
+                    values = np.asarray(values)
+                if values.dtype.kind not in 'biuf':
+                    raise TypeError
+                if values.dtype.kind == 'u' and self.values.dtype.kind == 'i' and not fits_buffer(values):
+                    # numpy would wrap the largest unsigned values round to negative numbers
+                    raise OverflowError
+                self.values[self.length:self.length + len(values)] = values
+            except (ValueError, TypeError, OverflowError):
+                self._to_list()
+                self.values.extend(values)
+        else:
+            self.values.extend(values.tolist() if isinstance(values, np.ndarray) else values)
+        self.length += len(values)
+
+    def view(self) -> np.ndarray|list:
+        """
+        The values held, without copying
+        """
+        return self.values[:self.length]
+
+    def take(self, n: int) -> np.ndarray|list:
+        """
+        Remove and return the first n values
+        """
+        n = min(n, self.length)
+        if self.is_array:
+            taken = self.values[:n].copy()
+            remaining = self.length - n
+            self.values[:remaining] = self.values[n:self.length]
+        else:
+            taken = self.values[:n]
+            del self.values[:n]
+        self.length -= n
+        return taken
+
+
+class ChunkBuilder:
+    """
+    Accumulates rows of data into per-column buffers until they are uploaded in chunks.
+    """
+    def __init__(self, capacity: int = INITIAL_CAPACITY):
+        self.capacity = capacity
+        self.columns = {}
+        self.rows = 0
+
+    def __contains__(self, column: str) -> bool:
+        return column in self.columns
+
+    def add_column(self, column: str, info: dict):
+        """
+        Add a column described by info, which is sent to the server with the column's values.
+        info['data_type'] determines how the values are stored.
+        """
+        self.columns[column] = ColumnBuffer(info, self.capacity)
+
+    def append(self, column: str, value):
+        """
+        Add a single value to a column without adding a row
+        """
+        self.columns[column].append(value)
+
+    def append_row(self, row: dict):
+        columns = self.columns
+        for k, v in row.items():
+            columns[k].append(v)
+        self.rows += 1
+
+    def extend(self, block: dict[str, np.ndarray|list]):
+        """
+        Add a block of rows given as arrays of values for each column
+        """
+        length = 0
+        for k, v in block.items():
+            self.columns[k].extend(v)
+            length = max(length, len(v))
+        self.rows += length
+
+    def sample(self) -> dict[str, np.ndarray|list]:
+        return {k: c.view() for k, c in self.columns.items()}
+
+    def take(self, n: int, columns: list[str] = None) -> list[dict]:
+        """
+        Remove the first n rows, returning them as column descriptions with values for upload.
+        If columns is given, only those columns are returned, but rows are removed from all columns.
+        """
+        data = []
+        for name, column in self.columns.items():
+            values = column.take(n)
+            if columns is None or name in columns:
+                data.append({**column.info, 'values': values})
+        self.rows = max(self.rows - n, 0)
+        return data
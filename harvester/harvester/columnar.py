@@ -0,0 +1,69 @@
+# SPDX-License-Identifier: BSD-2-Clause
+# Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
+# of Oxford, and the 'Galv' Developers. All rights reserved.
+
+"""
+Binary columnar encoding for report bodies carrying timeseries data.
+
+A columnar body is:
+    * a 4-byte little-endian unsigned int giving the length of the header
+    * a UTF-8 JSON header: the report, with the 'values' of each numeric column in
+      content['data'] replaced by a 'buffer' description {dtype, count, offset}
+    * the packed little-endian column arrays, concatenated.
+      Buffer offsets are relative to the start of this section.
+
+Columns whose values are not numeric (e.g. strings), or are unsigned integers too large
+for a signed 64-bit buffer, keep their 'values' in the header.
+"""
+
+import json
+import struct
+
+import numpy as np
+
+from .utils import NpEncoder
+
+MEDIA_TYPE = 'application/vnd.galv.columnar'
+
+HEADER_LENGTH = struct.Struct('<I')
+
+# numpy dtype kinds sent as packed buffers, and the little-endian dtypes used for them
+BUFFER_DTYPES = {'f': '<f8', 'i': '<i8', 'u': '<i8'}
+
+
+def fits_buffer(array: np.ndarray) -> bool:
+    """
+    True if the array's values can be packed in its kind's buffer dtype without changing them.
+    Unsigned values of 2**63 or more would wrap round to negative numbers as '<i8'.
+    """
+    if array.ndim != 1 or array.dtype.kind not in BUFFER_DTYPES:
+        return False
+    if array.dtype.kind == 'u' and array.dtype.itemsize >= 8 and len(array):
+        return array.max() <= np.iinfo(np.int64).max
+    return True
+
+
+def encode(report: dict) -> bytes:
+    """
+    Encode a report whose content includes a 'data' list of columns
+    """
+    content = report.get('content') or {}
+    columns = []
+    buffers = []
+    offset = 0
+    for column in content.get('data', []):
+        values = column.get('values')
+        array = values if isinstance(values, np.ndarray) else np.asarray(values)
+        if not fits_buffer(array):
+            # Sent as JSON, which holds integers of any size
+            columns.append(column)
+            continue
+        array = np.ascontiguousarray(array, dtype=BUFFER_DTYPES[array.dtype.kind])
+        columns.append({
+            **{k: v for k, v in column.items() if k != 'values'},
+            'buffer': {'dtype': array.dtype.str, 'count': len(array), 'offset': offset}
+        })
+        buffers.append(array.tobytes())
+        offset += array.nbytes
+    header = json.dumps({**report, 'content': {**content, 'data': columns}}, cls=NpEncoder).encode('utf-8')
+    return b''.join([HEADER_LENGTH.pack(len(header)), header, *buffers])
@@ -5,12 +5,13 @@
 import datetime
 import os
 import time
-import sys
 import json
+import numpy as np
 
 from .utils import NpEncoder
 
 from .parse.exceptions import UnsupportedFileTypeError
+from .parse.input_file import SNIFF_BYTES
 from .parse.ivium_input_file import IviumInputFile
 from .parse.biologic_input_file import BiologicMprInputFile
 from .parse.maccor_input_file import (
@@ -19,8 +20,12 @@ from .parse.maccor_input_file import (
     MaccorRawInputFile,
 )
 
-from .settings import get_logger, get_setting, get_standard_units, get_standard_columns
+from .settings import get_logger, get_setting, get_standard_units, get_standard_columns, get_upload_format, \
+    get_target_upload_latency, get_parse_processes, get_parse_cache_bytes
 from .api import report_harvest_result
+from .pipeline import UploadPipeline, UploadError, UPLOAD_RETRIES
+from .chunker import Chunker, ChunkBuilder
+from .cache import StatCache, ParseCache
 
 logger = get_logger(__file__)
 
@@ -50,29 +55,88 @@ def serialize_datetime(v):
     return v
 
 
-def get_import_file_handler(file_path: str):
+def get_data_type(values: np.ndarray) -> str:
     """
-        Get the handler for the given file by iterating through parsers until one hits
+    Name of the server data type for an array of values
     """
+    kind = values.dtype.kind
+    if kind == 'f':
+        return 'float'
+    if kind in 'iub':
+        # The server has no boolean type, so flags are sent as 0/1
+        return 'int'
+    # Determine data type from the first value via json serialization
+    return type(json.loads(json.dumps(values[0], cls=NpEncoder))).__name__
+
+
+def get_input_file_class(file_path: str):
+    """
+        Get the parser class for the given file by sniffing its name and first bytes.
+        No parser is constructed, so this is cheap enough to run on every file.
+    """
+    with open(file_path, 'rb') as f:
+        head = f.read(SNIFF_BYTES)
     for input_file_cls in registered_input_files:
         try:
-            logger.debug('Tried input reader {}'.format(input_file_cls))
-            input_file = input_file_cls(
-                file_path=file_path,
-                standard_units=get_standard_units(),
-                standard_columns=get_standard_columns()
-            )
+            if input_file_cls.sniff(file_path, head):
+                logger.debug('Identified {} as {}'.format(file_path, input_file_cls))
+                return input_file_cls
         except Exception as e:
-            logger.debug('...failed with: ', type(e), e)
-        else:
-            logger.debug('...succeeded...')
-            return input_file
+            logger.debug('Sniffing with {} failed with: {} {}'.format(input_file_cls, type(e), e))
     raise UnsupportedFileTypeError
 
 
-def import_file(path: str, monitored_path: dict) -> bool:
+def get_import_file_handler(file_path: str, parse_processes: int = 1, parse_cache: ParseCache = None):
+    """
+        Get the handler for the given file, constructing only the parser that recognises it.
+        If parse_cache holds the parser's results for this version of the file, they are used
+        instead of reading its metadata again.
+    """
+    input_file_cls = get_input_file_class(file_path)
+    return input_file_cls(
+        file_path=file_path,
+        standard_units=get_standard_units(),
+        standard_columns=get_standard_columns(),
+        parse_processes=parse_processes,
+        parse_cache=parse_cache
+    )
+
+
+def declare_columns(path: str, monitored_path_id: int, upload_session: str, columns: dict) -> dict|None:
+    """
+        Tell the server about columns before their data are sent in an upload session.
+        columns maps each column's name in the file to its description.
+        Returns the server's id for each column by name, or None if the server refused.
+    """
+    report = report_harvest_result(
+        path=path,
+        monitored_path_id=monitored_path_id,
+        content={
+            'task': 'import',
+            'status': 'columns',
+            'upload_session': upload_session,
+            'columns': [{'key': k, **info} for k, info in columns.items()]
+        }
+    )
+    if report is None:
+        logger.error(f"API Error")
+        return None
+    if not report.ok:
+        try:
+            logger.error(f"API responded with Error: {report.json()['error']}")
+        except BaseException:
+            logger.error(f"API Error: {report.status_code}")
+        return None
+    return report.json()['upload_session']['columns']
+
+
+def import_file(path: str, monitored_path: dict, stat_cache: StatCache = None) -> bool|None:
     """
-        Attempts to import a given file
+        Attempts to import a given file.
+        If stat_cache holds the point an earlier import of the file stopped,
+        and the file has only been appended to since, only the new rows are read.
+        Returns None if the server is still writing data from an earlier import of the file,
+        in which case the import should be tried again later.
     """
     monitored_path_id = monitored_path.get('id')
     default_column_ids = get_standard_columns()
@@ -90,10 +154,15 @@ def import_file(path: str, monitored_path: dict) -> bool:
         # TODO handle rows in the dataset and access tables with no
         # corresponding data since the import might fail while reading the data
         # anyway
-        input_file = get_import_file_handler(file_path=path)
+        # The same handler is used for metadata, data, and labels
+        input_file = get_import_file_handler(
+            file_path=path,
+            parse_processes=monitored_path.get('parse_processes') or get_parse_processes(),
+            parse_cache=ParseCache() if get_parse_cache_bytes() > 0 else None
+        )
 
         # Send metadata
-        core_metadata, extra_metadata = input_file.load_metadata()
+        core_metadata, extra_metadata = input_file.metadata, input_file.column_info
         report = report_harvest_result(
             path=path,
             monitored_path_id=monitored_path_id,
@@ -108,6 +177,9 @@ def import_file(path: str, monitored_path: dict) -> bool:
         if report is None:
             logger.error(f"API Error")
             return False
+        if report.status_code == 409:
+            logger.info(f"Server is still writing data from an earlier import of {path}; will try again later")
+            return None
         if not report.ok:
             try:
                 logger.error(f"API responded with Error: {report.json()['error']}")
@@ -117,131 +189,225 @@ def import_file(path: str, monitored_path: dict) -> bool:
         upload_info = report.json()['upload_info']
         last_uploaded_record = upload_info.get('last_record_number')
         columns = upload_info.get('columns')
+        # Servers that support upload sessions resolve columns once, so chunks only carry column ids
+        upload_session = report.json().get('upload_session')
+        if upload_session is not None:
+            chunk_content = {'task': 'import', 'status': 'in_progress', 'upload_session': upload_session['token']}
+        else:
+            chunk_content = {
+                'task': 'import',
+                'status': 'in_progress',
+                'test_date': serialize_datetime(core_metadata['Date of Test'])
+            }
 
         # Figure out column data
-        if len(columns):
-            mapping = {c.get('name'): c.get('id') for c in columns}
-        else:
-            mapping = input_file.get_file_column_to_standard_column_mapping()
-        # limit size of requests. 1kb/column is an arbitrary buffer size.
-        size = 0
-        max_size = max_upload_size
+        mapping = input_file.get_file_column_to_standard_column_mapping()
+        cache_entry = stat_cache.get(path) if stat_cache is not None else None
+        resume_point = cache_entry.get('resume') if cache_entry is not None else None
+        # Only resume if the server holds exactly the rows sent before
+        if input_file.resumable and resume_point is not None and last_uploaded_record is not None \
+                and resume_point.get('last_record') == last_uploaded_record \
+                and input_file.resume(resume_point):
+            logger.info(f"Resuming from row {input_file.resumed_rows} (byte {resume_point['offset']})")
+            # Columns already sent carry on being sent, even if the new rows are all zeros
+            standard_column_names = {v: k for k, v in default_column_ids.items()}
+            server_column_names = [c.get('name') for c in columns]
+            for k, info in input_file.column_info.items():
+                if standard_column_names.get(mapping.get(k), k) in server_column_names:
+                    info['has_data'] = True
+        # Chunks are cut by row count to fit within the server's upload size limit
+        chunker = Chunker(
+            max_upload_size,
+            columnar=get_upload_format() == 'columnar',
+            target_latency=get_target_upload_latency()
+        )
         nth_part = 0
         start_row = last_uploaded_record if last_uploaded_record is not None else 0
         # Find out if there's a Sample number column, otherwise we use the row number
         record_number_column = [k for k, v in mapping.items() if v == default_column_ids['Sample Number']]
+        # Values are held in typed buffers until they are sent
+        chunk = ChunkBuilder()
+        # Columns found in the data that have not been added to the chunk yet
+        new_columns = {}
         if len(record_number_column):
             record_number_column = record_number_column[0]
-            column_data = {}
         else:
             record_number_column = None
-            column_data = {"Sample Number": {
+            new_columns["Sample Number"] = {
                 "column_id": default_column_ids["Sample Number"],
                 "official_sample_counter": True,
-                "values": []
-            }}
-
-        # TODO: is this actually determined correctly? Seems there are actually lots of data columns we miss??
-        # Anyway, leaving this as instructed because everyone's happy with it as is.
-        columns_with_data = [c for c in input_file.column_info.keys() if input_file.column_info[c].get('has_data')]
-        generator = input_file.load_data(input_file.file_path, columns_with_data)
-        start = time.process_time()
-        new_row = {}
-        for i, r in enumerate(generator):
-            if start_row > 0 and int(r.get(record_number_column, i)) <= start_row:
-                continue
-            # Data are stored up in rows and shipped out when
-            # adding the current row would exceed the server data
-            # size limit.
-            # If sent, sent data are wiped from column_data.
-            # New row data are added to column_data below.
-            size += sys.getsizeof(json.dumps(new_row, cls=NpEncoder))
-            if size > max_size:
-                if start_row == i:
-                    logger.error(f"Row too large to upload {len(r.keys())} columns, size={sys.getsizeof(r)}")
-                    return False
-                logger.info(f"Upload part {nth_part} (rows {start_row}-{i - 1}; {size}bytes)")
-                logger.info(f"Read took {time.process_time() - start}")
-                nth_part += 1
-                start_row = i
-                report = report_harvest_result(
-                    path=path,
-                    monitored_path_id=monitored_path_id,
-                    content={
-                    'task': 'import',
-                    'status': 'in_progress',
-                    'data': [v for v in column_data.values()],
-                    'test_date': serialize_datetime(core_metadata['Date of Test'])
+                "data_type": "int"
+            }
+
+        # Columns are only sent once they are known to have data
+        active_columns = []
+        uploaded_rows = 0
+
+        def has_data(column: str) -> bool:
+            return column not in input_file.column_info or input_file.column_info[column].get('has_data')
+
+        chunks_submitted = 0
+
+        def numbering(start: int, stop: int) -> dict:
+            """
+            Number chunks sent in an upload session, so the server can tell if one is sent twice,
+            and give the samples (counted from the start of the session) the chunk holds
+            """
+            nonlocal chunks_submitted
+            if upload_session is None:
+                return {}
+            chunks_submitted += 1
+            return {'sequence': chunks_submitted - 1, 'samples': [start, stop]}
+
+        def submit_rows(pipeline: UploadPipeline, n: int, **kwargs):
+            """
+            Send the first n rows held in chunk, keeping the rest for the next chunk
+            """
+            nonlocal uploaded_rows
+            start = uploaded_rows
+            uploaded_rows += min(n, chunk.rows)
+            pipeline.submit({
+                **chunk_content,
+                **numbering(start, uploaded_rows),
+                'data': chunk.take(n, columns=active_columns),
+                **kwargs
+            })
+
+        def submit_zeros(pipeline: UploadPipeline, column: str, n: int):
+            """
+            Send n zeros for a column found to have data after rows were already sent without it
+            """
+            info = chunk.columns[column].info
+            zeros = np.zeros(n, dtype=np.int64 if info['data_type'] == 'int' else np.float64)
+            rows = max(chunker.rows_within_budget(chunker.value_bytes(zeros[:1])), 1)
+            for i in range(0, n, rows):
+                pipeline.submit({
+                    **chunk_content,
+                    **numbering(i, min(i + rows, n)),
+                    'data': [{**info, 'values': zeros[i:i + rows]}]
                 })
-                if report is None:
-                    logger.error(f"API Error")
-                    return False
-                if not report.ok:
-                    try:
-                        logger.error(f"API responded with Error: {report.json()['error']}")
-                    except BaseException:
-                        logger.error(f"API Error: {report.status_code}")
-                    return False
-                for k in column_data.keys():
-                    column_data[k]['values'] = []
-                start = time.process_time()
-                size = 0
-
-            if i > 0:
-                for k, v in new_row.items():
-                    column_data[k]['values'].append(v)
-
-            # Make sure we send record numbers to the server
-            new_row = {"Sample Number": i} if record_number_column is None else {}
-
-            for k, v in r.items():
-                if k not in column_data:
-                    column_data[k] = {}
+
+        if input_file.lazy_has_data:
+            # Whether a column has data is decided as the file is read
+            columns_with_data = list(input_file.column_info.keys())
+        else:
+            # TODO: is this actually determined correctly? Seems there are actually lots of data columns we miss??
+            # Anyway, leaving this as instructed because everyone's happy with it as is.
+            columns_with_data = [c for c in input_file.column_info.keys() if input_file.column_info[c].get('has_data')]
+        # Chunks are uploaded in the background while the file is read
+        last_record = last_uploaded_record
+        # Numbered chunks can be resent safely, because the server ignores any it has already received
+        with UploadPipeline(
+                path,
+                monitored_path_id,
+                on_upload=chunker.record_latency,
+                retries=UPLOAD_RETRIES if upload_session is not None else 0
+        ) as pipeline:
+            start = time.process_time()
+            row_index = input_file.resumed_rows
+            for block in input_file.load_blocks(columns_with_data):
+                length = max([len(v) for v in block.values()], default=0)
+                if length == 0:
+                    continue
+                if start_row > 0:
+                    if record_number_column in block:
+                        record_numbers = np.asarray(block[record_number_column]).astype(np.int64)
+                    else:
+                        record_numbers = np.arange(row_index, row_index + length)
+                    new_rows = record_numbers > start_row
+                    if not new_rows.all():
+                        block = {k: v[new_rows] for k, v in block.items()}
+                # Make sure we send record numbers to the server
+                if record_number_column is None:
+                    sample_numbers = np.arange(row_index, row_index + length)
+                    if start_row > 0:
+                        sample_numbers = sample_numbers[new_rows]
+                    block = {"Sample Number": sample_numbers, **block}
+                row_index += length
+                sent = block.get(record_number_column if record_number_column is not None else "Sample Number")
+                if sent is not None and len(sent):
+                    last_record = int(sent[-1])
+
+                for k in [k for k in block.keys() if k not in chunk and k not in new_columns]:
                     if k in mapping:
-                        column_data[k]['column_id'] = mapping[k]
+                        info = {'column_id': mapping[k]}
                     else:
-                        column_data[k]['column_name'] = k
+                        info = {'column_name': k}
                         if 'unit' in input_file.column_info[k]:
-                            column_data[k]['unit_symbol'] = input_file.column_info[k].get('unit')
+                            info['unit_symbol'] = input_file.column_info[k].get('unit')
                         else:
-                            column_data[k]['unit_id'] = default_units['Unitless']
-                    column_data[k]['values'] = []
+                            info['unit_id'] = default_units['Unitless']
+                    info['data_type'] = get_data_type(block[k])
                     if k == record_number_column:
-                        sample_counters = [k for k, v in column_data.items() if v.get('official_sample_counter')]
+                        sample_counters = [
+                            *[c for c, b in chunk.columns.items() if b.info.get('official_sample_counter')],
+                            *[c for c, i in new_columns.items() if i.get('official_sample_counter')]
+                        ]
                         if len(sample_counters) > 0:
                             logger.error(f"Cannot set more than one official_sample_counter column ({[*sample_counters, k]})")
                             return False
-                        column_data[k]['official_sample_counter'] = True
-                new_row[k] = v
+                        info['official_sample_counter'] = True
+                    new_columns[k] = info
+                if len(new_columns):
+                    if upload_session is not None:
+                        column_ids = declare_columns(path, monitored_path_id, upload_session['token'], new_columns)
+                        if column_ids is None:
+                            return False
+                        for k, info in new_columns.items():
+                            new_columns[k] = {
+                                'column': column_ids[k],
+                                **{i: v for i, v in info.items() if i in ['data_type', 'official_sample_counter']}
+                            }
+                    for k, info in new_columns.items():
+                        chunk.add_column(k, info)
+                    new_columns = {}
+                chunk.extend(block)
+                for k in [k for k in chunk.columns if k not in active_columns and has_data(k)]:
+                    if uploaded_rows > 0:
+                        # The column only held zeros in the rows already sent
+                        submit_zeros(pipeline, k, uploaded_rows)
+                    active_columns.append(k)
 
-            if i == 1:
-                # Determine data types from first row via json serialization
-                types_row = json.loads(json.dumps(new_row, cls=NpEncoder))
-                for k in column_data.keys():
-                    column_data[k]['data_type'] = type(types_row[k]).__name__
+                # Row size is estimated from the first block
+                if not chunker.calibrated and chunk.rows > 0:
+                    chunker.calibrate(chunk.sample())
+                while chunker.calibrated and chunk.rows >= chunker.rows_per_chunk:
+                    n = chunker.rows_per_chunk
+                    if n == 0:
+                        logger.error(f"Row too large to upload: {len(block)} columns, ~{chunker.bytes_per_row} bytes")
+                        return False
+                    logger.info(f"Upload part {nth_part} ({n} rows; ~{n * chunker.bytes_per_row} bytes)")
+                    logger.info(f"Read took {time.process_time() - start}")
+                    submit_rows(pipeline, n)
+                    nth_part += 1
+                    start = time.process_time()
 
-        # Send data
-        report = report_harvest_result(
-            path=path,
-            monitored_path_id=monitored_path_id,
-            content={
-            'task': 'import',
-            'status': 'in_progress',
-            'data': [v for v in column_data.values()],
-            'labels': tuple(input_file.get_data_labels()),
-            'test_date': serialize_datetime(core_metadata['Date of Test'])
-        })
-        if report is None:
-            logger.error(f"API Error")
-            return False
-        if not report.ok:
-            try:
-                logger.error(f"API responded with Error: {report.json()['error']}")
-            except BaseException:
-                logger.error(f"API Error: {report.status_code}")
-            return False
+            # Labels cached from an earlier read of the file cover all its rows, so they can't be used
+            # when only the rows added since an earlier import were read
+            labels = input_file.cached_labels
+            if labels is None or input_file.resumed_rows:
+                labels = tuple(input_file.get_data_labels())
+            # Send data, with row counts for parsers that only know them once the file is read
+            submit_rows(
+                pipeline,
+                chunk.rows,
+                labels=labels,
+                core_metadata=serialize_datetime({
+                    k: core_metadata[k]
+                    for k in ['num_rows', 'first_sample_no', 'last_sample_no']
+                    if k in core_metadata
+                })
+            )
+            pipeline.close()
 
+        if input_file.cached_labels is None and not input_file.resumed_rows:
+            input_file.save_to_parse_cache(labels)
+        if stat_cache is not None and input_file.resume_point is not None:
+            stat_cache.update(path, resume={**input_file.resume_point, 'last_record': last_record})
         logger.info("File successfully imported")
+    except UploadError:
+        # Already logged by the pipeline
+        return False
     except Exception as e:
         logger.error(e)
         report_harvest_result(
@@ -4,9 +4,10 @@
 
 import os
 import ntpath
+import numpy as np
 from galvani import BioLogic
 from .exceptions import UnsupportedFileTypeError
-from .input_file import InputFile
+from .input_file import InputFile, DEFAULT_BLOCK_ROWS
 
 
 class BiologicMprInputFile(InputFile):
@@ -14,6 +15,10 @@ class BiologicMprInputFile(InputFile):
         A class for handling input files
     """
 
+    @classmethod
+    def sniff(cls, file_path: str, head: bytes) -> bool:
+        return file_path.endswith(".mpr") and head.startswith(BioLogic.MPR_MAGIC)
+
     def __init__(self, file_path, **kwargs):
         if not file_path.endswith(".mpr"):
             raise UnsupportedFileTypeError
@@ -39,22 +44,42 @@ class BiologicMprInputFile(InputFile):
             "freq/Hz": self.standard_columns['Frequency'],
         }
 
-    def load_data(self, file_path, columns):
-        columns_of_interest = []
-        column_names = list(self.mpr_file.data.dtype.names)
-        for col_idx, column_name in enumerate(column_names):
-            if column_name in columns:
-                columns_of_interest.append(col_idx)
-        for row in self.mpr_file.data:
-            yield {
-                column_names[col_idx]: row[col_idx]
-                for col_idx in columns_of_interest
-            }
+    def get_unit_multipliers(self) -> dict:
+        """
+        Return a dict of column name to the multiplier that converts its values
+        to the units of the standard column it maps to, e.g. 1e-3 for I/mA.
+        Columns that do not map to a standard column keep the units in their names.
+        """
+        multipliers = {}
+        for name in self.get_file_column_to_standard_column_mapping():
+            unit = name.rsplit("/", 1)[-1]
+            if "/" in name and unit in self.unit_conversion_multipliers:
+                multipliers[name] = self.unit_conversion_multipliers[unit]
+        return multipliers
+
+    def load_blocks(self, columns, block_rows: int = DEFAULT_BLOCK_ROWS):
+        """
+            Yield slices of the fields of the parsed data array.
+            Slices are views of the array, except for columns that need unit conversion,
+            which are scaled with a single multiply per block.
+        """
+        data = self.mpr_file.data
+        column_names = [name for name in data.dtype.names if name in columns]
+        multipliers = self.get_unit_multipliers()
+        fields = {name: data[name] for name in column_names}
+        for start in range(0, len(data), block_rows):
+            block = {}
+            for name, field in fields.items():
+                values = field[start:start + block_rows]
+                if name in multipliers:
+                    values = values * multipliers[name]
+                block[name] = values
+            yield block
 
     def get_data_labels(self):
+        data = self.mpr_file.data
         modes = self.mpr_file.get_flag('mode')
         Ns_changes = self.mpr_file.get_flag('Ns changes')
-        Ns_index = self.mpr_file.data.dtype.names.index('Ns')
         mode_labels = {
             1: 'CC',
             2: 'CV',
@@ -62,45 +87,46 @@ class BiologicMprInputFile(InputFile):
         }
         last_Ns_change = 1
 
-        column_names = self.mpr_file.data.dtype.names
+        column_names = data.dtype.names
         time_col = next((i for i, c in enumerate(column_names) if c.startswith("time")), 3)
         cont_col = next((i for i, c in enumerate(column_names) if c.startswith("control")), 4)
+        Ns = data['Ns']
+        times = data[column_names[time_col]]
+        controls = data[column_names[cont_col]]
         prev_time = 0
 
-        for i in range(len(self.mpr_file.data)):
+        # Only rows where Ns changes end a range, so find them all at once
+        for i in np.flatnonzero(Ns_changes).tolist():
             last_mode = modes[i-1]
-            last_Ns = self.mpr_file.data[i-1][Ns_index]
-            Ns_change = Ns_changes[i]
-            if Ns_change:
-                time = self.mpr_file.data[i][time_col]
-                mode_label = mode_labels.get(last_mode)
-                if mode_label.casefold() == "rest":
-                    experiment_label = "Rest "
+            last_Ns = Ns[i-1]
+            time = times[i]
+            mode_label = mode_labels.get(last_mode)
+            if mode_label.casefold() == "rest":
+                experiment_label = "Rest "
+            else:
+                control = controls[i - 1]
+                if control > 0:
+                    experiment_label = "Charge "
                 else:
-                    control = self.mpr_file.data[i - 1][cont_col]
-                    if control > 0:
-                        experiment_label = "Charge "
-                    else:
-                        experiment_label = "Discharge "
-
-                    is_const_curr = mode_label.casefold() == "cc"
-                    experiment_label += f"at {control} {'mA' if is_const_curr else 'V'} "
-                experiment_label += f"for {time - prev_time} seconds"
-
-                if last_mode in mode_labels:
-                    data_label = (
-                        f"Ns_{last_Ns}_{mode_label}", (last_Ns_change, i - 1), experiment_label
-                    )
-                else:
-                    data_label = (
-                        f"Ns_{last_Ns}", (last_Ns_change, i - 1), experiment_label
-                    )
+                    experiment_label = "Discharge "
+
+                is_const_curr = mode_label.casefold() == "cc"
+                experiment_label += f"at {control} {'mA' if is_const_curr else 'V'} "
+            experiment_label += f"for {time - prev_time} seconds"
 
-                last_Ns_change = i
-                prev_time = time
+            if last_mode in mode_labels:
+                data_label = (
+                    f"Ns_{last_Ns}_{mode_label}", (last_Ns_change, i - 1), experiment_label
+                )
+            else:
+                data_label = (
+                    f"Ns_{last_Ns}", (last_Ns_change, i - 1), experiment_label
+                )
 
-                yield data_label
+            last_Ns_change = i
+            prev_time = time
 
+            yield data_label
 
     def load_metadata(self):
         file_path = self.file_path
@@ -4,8 +4,14 @@
 
 from .exceptions import UnsupportedFileTypeError
 import traceback
+import numpy as np
 from ..settings import get_logger
 
+# Number of bytes read from the start of a file to identify its type
+SNIFF_BYTES = 8192
+# Number of rows in each block yielded by load_blocks
+DEFAULT_BLOCK_ROWS = 4096
+
 # see https://gist.github.com/jsheedy/ed81cdf18190183b3b7d
 # https://stackoverflow.com/a/30721460
 
@@ -18,13 +24,66 @@ class InputFile:
         'mA': 1e-3,
         'mA.h': 1e-3
     }
+    # If True, column_info['has_data'] may only become True as load_blocks reads the file,
+    # and num_rows, first_sample_no and last_sample_no are only in metadata afterwards
+    lazy_has_data = False
+    # If True, load_blocks can continue from where an earlier read of the file stopped (see resume)
+    resumable = False
+    # Rows before the point load_blocks continues from
+    resumed_rows = 0
+    # Where load_blocks stopped, for resumable parsers once all blocks have been read
+    resume_point = None
+    # Increase when a parser's metadata, column_info or labels change, so older parse cache entries are ignored
+    parse_cache_version = 1
+    # Attributes set by load_metadata that reading the data relies on, restored along with cached metadata
+    parse_cache_attributes = ()
+
+    @classmethod
+    def sniff(cls, file_path: str, head: bytes) -> bool:
+        """
+            Cheaply decide whether this class can parse the file,
+            using only its name and its first few bytes (head)
+        """
+        return False
 
-    def __init__(self, file_path, standard_columns: dict, standard_units: dict):
+    def __init__(
+            self, file_path, standard_columns: dict, standard_units: dict,
+            parse_processes: int = 1, parse_cache=None
+    ):
         self.file_path = file_path
         self.standard_columns = standard_columns
         self.standard_units = standard_units
+        # Number of processes parsers that support it may use to read the file
+        self.parse_processes = parse_processes
         self.logger = get_logger(f"InputFile({self.file_path})")
-        self.metadata, self.column_info = self.load_metadata()
+        # Labels of a previous complete read of this version of the file, if the parse cache has them
+        self.cached_labels = None
+        self.parse_cache = parse_cache
+        self.parse_cache_key = parse_cache.key(self) if parse_cache is not None else None
+        entry = parse_cache.get(self.parse_cache_key) if parse_cache is not None else None
+        if entry is not None:
+            self.logger.info("Using cached metadata")
+            self.metadata, self.column_info = entry['metadata'], entry['column_info']
+            for name, value in entry['attributes'].items():
+                setattr(self, name, value)
+            self.cached_labels = entry['labels']
+        else:
+            self.metadata, self.column_info = self.load_metadata()
+            self.save_to_parse_cache()
+
+    def save_to_parse_cache(self, labels: tuple = None):
+        """
+            Store metadata, column_info and parse_cache_attributes in the parse cache, if there is one.
+            labels should only be given once all the file's data have been read.
+        """
+        if self.parse_cache is None:
+            return
+        self.parse_cache.put(self.parse_cache_key, {
+            'metadata': self.metadata,
+            'column_info': self.column_info,
+            'attributes': {name: getattr(self, name) for name in self.parse_cache_attributes},
+            'labels': labels,
+        })
 
     def get_columns(self):
         name_to_type_id = self.get_file_column_to_standard_column_mapping()
@@ -128,7 +187,43 @@ class InputFile:
             raise
 
     def load_data(self, file_path, available_desired_columns):
-        raise UnsupportedFileTypeError()
+        """
+            Yield a dict of column name to value for each row.
+            Parsers must implement at least one of load_data and load_blocks;
+            by default rows are unpacked from load_blocks.
+        """
+        if type(self).load_blocks is InputFile.load_blocks:
+            raise UnsupportedFileTypeError()
+        for block in self.load_blocks(available_desired_columns):
+            names = list(block.keys())
+            for values in zip(*block.values()):
+                yield dict(zip(names, values))
+
+    def load_blocks(self, columns, block_rows: int = DEFAULT_BLOCK_ROWS):
+        """
+            Yield dicts of column name to a numpy array holding the values
+            of up to block_rows consecutive rows.
+            By default blocks are assembled from the rows of load_data.
+        """
+        if type(self).load_data is InputFile.load_data:
+            raise UnsupportedFileTypeError()
+        rows = []
+        for row in self.load_data(self.file_path, columns):
+            rows.append(row)
+            if len(rows) == block_rows:
+                yield rows_to_block(rows)
+                rows = []
+        if len(rows):
+            yield rows_to_block(rows)
+
+    def resume(self, resume_point: dict) -> bool:
+        """
+            Make load_blocks continue from a resume_point saved after an earlier read,
+            so that only rows appended since are read.
+            Returns False if the file cannot be resumed, e.g. because it was changed
+            rather than appended to, in which case it must be read from the start.
+        """
+        return False
 
     def get_data_labels(self):
         raise UnsupportedFileTypeError()
@@ -141,3 +236,20 @@ class InputFile:
 
     def load_metadata(self):
         raise UnsupportedFileTypeError()
+
+
+def rows_to_block(rows: list[dict]) -> dict[str, np.ndarray]:
+    """
+        Convert a list of row dicts to a dict of column arrays
+    """
+    block = {}
+    for name in rows[0].keys():
+        values = [row.get(name) for row in rows]
+        try:
+            block[name] = np.asarray(values)
+        except ValueError:
+            block[name] = np.asarray(values, dtype=object)
+        if block[name].dtype.kind == 'U':
+            # Keep strings as Python objects rather than fixed-width numpy strings
+            block[name] = block[name].astype(object)
+    return block
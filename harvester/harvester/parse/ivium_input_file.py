@@ -3,10 +3,12 @@
 # of Oxford, and the 'Galv' Developers. All rights reserved.
 
 import os
+import mmap
 import ntpath
 import re
 from datetime import datetime
-from .input_file import InputFile
+import numpy as np
+from .input_file import InputFile, DEFAULT_BLOCK_ROWS
 from .exceptions import (
     UnsupportedFileTypeError,
     InvalidDataInFileError,
@@ -14,11 +16,31 @@ from .exceptions import (
 
 IDF_HEADER = b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xfb\x00\x00\x00\r\x00Version=11'
 
+MATCH_SCI_NOTATION = re.compile(r'[+\-]?(?:0|[1-9]\d*)(?:\.\d*)?(?:[eE][+\-]?\d+)?')
+# Sample lines are fixed width: three 12 character columns separated by spaces, ending with \r\n
+SAMPLE_LINE_BYTES = 40
+SAMPLE_COLUMNS = ["test_time", "amps", "volts"]
+SAMPLE_FIELDS = [(0, 12), (13, 25), (26, 39)]
+# Number of lines checked for the fixed-width layout at a time
+SCAN_LINES = 1 << 20
+# Classes of the bytes allowed in sample lines: 0 is not allowed, 1 separates numbers,
+# 2 may be part of a number, 3 is a digit
+SAMPLE_BYTE_CLASS = np.zeros(256, dtype=np.uint8)
+SAMPLE_BYTE_CLASS[np.frombuffer(b" \r", dtype=np.uint8)] = 1
+SAMPLE_BYTE_CLASS[np.frombuffer(b"+-.eE", dtype=np.uint8)] = 2
+SAMPLE_BYTE_CLASS[np.frombuffer(b"0123456789", dtype=np.uint8)] = 3
+
 
 class IviumInputFile(InputFile):
     """
         A class for handling input files
     """
+    # The sample offsets are the expensive part of load_metadata, so they are cached with it
+    parse_cache_attributes = ('_samples_start', '_sample_starts', '_sample_lengths', '_file_metadata')
+
+    @classmethod
+    def sniff(cls, file_path: str, head: bytes) -> bool:
+        return file_path.endswith(".idf") and head.startswith(IDF_HEADER)
 
     def __init__(self, file_path, **kwargs):
         self.validate_file(file_path)
@@ -38,55 +60,129 @@ class IviumInputFile(InputFile):
             "test_time": self.standard_columns['Time']
         }
 
-    def load_data(self, file_path, columns):
+    @staticmethod
+    def _sample_text(data: np.ndarray, starts: np.ndarray) -> np.ndarray:
         """
-            Load data in a ivium text file"
+            A 2D array of the bytes of the SAMPLE_LINE_BYTES long lines starting at starts,
+            without their final newline.
+            Consecutive lines are viewed in place rather than copied.
         """
+        if len(starts) and starts[-1] - starts[0] == (len(starts) - 1) * SAMPLE_LINE_BYTES:
+            lines = data[starts[0]:starts[-1] + SAMPLE_LINE_BYTES].reshape(-1, SAMPLE_LINE_BYTES)
+            return lines[:, :SAMPLE_LINE_BYTES - 1]
+        return data[starts[:, None] + np.arange(SAMPLE_LINE_BYTES - 1)]
 
-        with open(file_path, "rb") as f:
-            for i in range(self._sample_rows[0]):
-                line = f.readline()
-            columns_of_interest = []
-            column_names = ["test_time", "amps", "volts"]
-            for col_idx, column_name in enumerate(column_names):
-                if column_name in columns:
-                    columns_of_interest.append(col_idx)
-
-            current_line = self._sample_rows[0] - 1
-            for sample_row in self._sample_rows:
-                while current_line != sample_row:
-                    line = f.readline()
-                    current_line += 1
-                line = line.decode('ascii')
-
-                if len(line) != 40:
-                    self.logger.debug(line)
-                    raise InvalidDataInFileError(
-                        (
-                            "Incorrect line length on line {} was {} expected {}"
-                        ).format(current_line, len(line), 40)
-                    )
-                row = [line[:12].strip(), line[13:25].strip(), line[26:].strip()]
-                yield {
-                    column_names[col_idx]: row[col_idx]
-                    for col_idx in columns_of_interest
-                }
+    @classmethod
+    def _is_fixed_width_sample(cls, data: np.ndarray, starts: np.ndarray) -> np.ndarray:
+        """
+            Check which of the SAMPLE_LINE_BYTES long lines starting at starts hold
+            exactly one number in each of the SAMPLE_FIELDS
+        """
+        byte_class = SAMPLE_BYTE_CLASS[cls._sample_text(data, starts)]
+        is_number = byte_class >= 2
+        ok = byte_class.all(axis=1) & (byte_class[:, 12] == 1) & (byte_class[:, 25] == 1)
+        # With the fields separated, three runs of number bytes means one in each field
+        runs = is_number[:, 0] + np.count_nonzero(is_number[:, 1:] > is_number[:, :-1], axis=1)
+        ok &= runs == 3
+        is_digit = byte_class == 3
+        for start, end in SAMPLE_FIELDS:
+            ok &= is_digit[:, start:end].any(axis=1)
+        return ok
+
+    def _find_samples(self, data: np.ndarray, offset: int):
+        """
+            Find the start and length of each sample line from offset to the end of the file.
+            Lines in the fixed-width layout are recognised with numpy,
+            only other lines are checked for three numbers with a regular expression.
+        """
+        ends = np.flatnonzero(data[offset:] == ord("\n")) + offset + 1
+        if len(data) > offset and data[-1] != ord("\n"):
+            ends = np.append(ends, len(data))
+        starts = np.concatenate([[offset], ends[:-1]]).astype(np.int64)
+        lengths = ends - starts
+        is_sample = np.zeros(len(starts), dtype=bool)
+        for i in range(0, len(starts), SCAN_LINES):
+            candidates = np.flatnonzero(lengths[i:i + SCAN_LINES] == SAMPLE_LINE_BYTES) + i
+            is_sample[candidates] = self._is_fixed_width_sample(data, starts[candidates])
+        for i in np.flatnonzero(~is_sample):
+            line = data[starts[i]:ends[i]].tobytes().decode('ascii', errors='replace')
+            is_sample[i] = len(MATCH_SCI_NOTATION.findall(line)) == 3
+        return starts[is_sample], lengths[is_sample]
+
+    def _map_file(self) -> np.ndarray:
+        """
+            Map the file into memory as an array of bytes.
+            The file is unmapped when the array is no longer used.
+        """
+        with open(self.file_path, "rb") as f:
+            return np.frombuffer(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), dtype=np.uint8)
+
+    def _decode_samples(self, data: np.ndarray, starts: np.ndarray, columns_of_interest: list[int]) -> dict:
+        """
+            Decode the columns of fixed-width sample lines into float arrays
+        """
+        text = self._sample_text(data, starts)
+        block = {}
+        for col_idx in columns_of_interest:
+            start, end = SAMPLE_FIELDS[col_idx]
+            field = np.ascontiguousarray(text[:, start:end]).view(f"S{end - start}").ravel()
+            try:
+                block[SAMPLE_COLUMNS[col_idx]] = field.astype(np.float64)
+            except ValueError as e:
+                raise InvalidDataInFileError(f"Invalid sample in column {SAMPLE_COLUMNS[col_idx]}: {e}")
+        return block
+
+    def load_blocks(self, columns, block_rows: int = DEFAULT_BLOCK_ROWS):
+        """
+            Load data in a ivium text file as blocks of float arrays,
+            decoding the fixed-width sample lines in bulk from a memory map of the file
+        """
+        columns_of_interest = [
+            col_idx for col_idx, column_name in enumerate(SAMPLE_COLUMNS)
+            if column_name in columns
+        ]
+        data = self._map_file()
+        for start in range(0, len(self._sample_starts), block_rows):
+            starts = self._sample_starts[start:start + block_rows]
+            lengths = self._sample_lengths[start:start + block_rows]
+            irregular = np.flatnonzero(lengths != SAMPLE_LINE_BYTES)
+            if len(irregular):
+                i = irregular[0]
+                if i > 0:
+                    yield self._decode_samples(data, starts[:i], columns_of_interest)
+                line_no = self._samples_start + np.count_nonzero(
+                    data[self._sample_starts[0]:starts[i]] == ord("\n")
+                )
+                self.logger.debug(data[starts[i]:starts[i] + lengths[i]].tobytes())
+                raise InvalidDataInFileError(
+                    (
+                        "Incorrect line length on line {} was {} expected {}"
+                    ).format(line_no, lengths[i], SAMPLE_LINE_BYTES)
+                )
+            yield self._decode_samples(data, starts, columns_of_interest)
 
     def _get_end_task_function(self, task):
-        def duration(row):
-            return row['test_time'] > task['Duration']
+        """
+            Return a function giving a boolean array of the rows of a block
+            that meet any of the task's end conditions
+        """
+        def threshold(key):
+            return float(task[key])
+
+        def duration(block):
+            return block['test_time'] > threshold('Duration')
 
-        def E_greater_than(row):
-            return row['volts'] > task['E>']
+        def E_greater_than(block):
+            return block['volts'] > threshold('E>')
 
-        def E_less_than(row):
-            return row['volts'] < task['E<']
+        def E_less_than(block):
+            return block['volts'] < threshold('E<')
 
-        def I_greater_than(row):
-            return row['amps'] > task['I<']
+        def I_greater_than(block):
+            return block['amps'] > threshold('I>')
 
-        def I_less_than(row):
-            return row['amps'] < task['I<']
+        def I_less_than(block):
+            return block['amps'] < threshold('I<')
 
         end_funcs = []
         for end_key in ['End1', 'End2', 'End3', 'End4']:
@@ -108,27 +204,36 @@ class IviumInputFile(InputFile):
                     'task end condition {} unknown'.format(end)
                 )
 
-        def is_end_task(row):
-            is_end = False
+        def is_end_task(block):
+            is_end = np.zeros(len(block['test_time']), dtype=bool)
             for f in end_funcs:
-                is_end |= f(row)
+                is_end |= f(block)
             return is_end
 
         return is_end_task
 
     def get_data_labels(self):
-        column_names = ["test_time", "amps", "volts"]
+        tasks = self._file_metadata['Tasks']
+        if not len(tasks):
+            return
         task_index = 0
-        current_task = self._file_metadata['Tasks'][task_index]
+        current_task = tasks[task_index]
         is_end_task = self._get_end_task_function(current_task)
         start_task_row = 0
-        end_task_row = 0
+        rows_read = 0
 
         prev_time = 0
-        for row in self.load_data(self.file_path, column_names):
-            end_task_row += 1
-            if is_end_task(row):
-                time = float(row.get("test_time"))
+        for block in self.load_blocks(SAMPLE_COLUMNS):
+            # Rows of the block not yet assigned to a task
+            offset = 0
+            length = len(block['test_time'])
+            while offset < length:
+                ends = np.flatnonzero(is_end_task({k: v[offset:] for k, v in block.items()}))
+                if not len(ends):
+                    break
+                row = offset + int(ends[0])
+                end_task_row = rows_read + row + 1
+                time = float(block['test_time'][row])
                 mode = current_task.get("Mode")
                 if mode.casefold() == "ocp":
                     experiment_label = "Rest "
@@ -140,7 +245,7 @@ class IviumInputFile(InputFile):
                         key = "volts"
                         units = "V"
 
-                    control = float(row.get(key))
+                    control = float(block[key][row])
                     if control > 0:
                         experiment_label = f"Charge "
                     else:
@@ -157,18 +262,18 @@ class IviumInputFile(InputFile):
 
                 prev_time = time
                 task_index += 1
-                if task_index < len(self._file_metadata['Tasks']):
-                    current_task = self._file_metadata['Tasks'][task_index]
+                if task_index < len(tasks):
+                    current_task = tasks[task_index]
                     is_end_task = self._get_end_task_function(current_task)
                     start_task_row = end_task_row
+                    offset = row + 1
                 else:
-                    break
+                    return
+            rows_read += length
 
     def _load_ivium_metadata(self):
         file_path = self.file_path
         regex_key_array = re.compile(r'([^,\[]+)\[([0-9]+)\]$')
-        match_sci_notation = re.compile(
-            r'[+\-]?(?:0|[1-9]\d*)(?:\.\d*)?(?:[eE][+\-]?\d+)?')
         with open(file_path, "rb") as f:
             # header
             line = f.readline()
@@ -248,36 +353,26 @@ class IviumInputFile(InputFile):
                         )
                     # looks ok, check samples start where we expect them to
                     for i in range(4):
+                        samples_offset = f.tell()
                         line = f.readline().decode('ascii', errors='replace')
                         line = line.replace('\n', '').replace('\r', '')
                         samples_start += 1
-                    if len(match_sci_notation.findall(line)) != 3:
+                    if len(MATCH_SCI_NOTATION.findall(line)) != 3:
                         raise UnsupportedFileTypeError(
                             'cannot find samples start', line
                         )
                     # everything looks good, so we can terminate the loop
                     break
 
-            # continue looping through file getting the sample line numbers
-            sample_rows = [samples_start]
-            line_no = samples_start
-            while True:
-                line = f.readline()
-                line_no += 1
-                if line:
-                    line = line.decode('ascii', errors='replace')
-                    if len(match_sci_notation.findall(line)) == 3:
-                        sample_rows.append(line_no)
-                else:
-                    break
-
-        return sample_rows, ivium_metadata
+        return samples_start, samples_offset, ivium_metadata
 
     def load_metadata(self):
         """
             Load metadata in a ivium_text file"
         """
-        self._sample_rows, self._file_metadata = self._load_ivium_metadata()
+        self._samples_start, samples_offset, self._file_metadata = self._load_ivium_metadata()
+        # Sample lines are found by scanning the rest of the file once
+        self._sample_starts, self._sample_lengths = self._find_samples(self._map_file(), samples_offset)
 
         file_path = self.file_path
         metadata = {}
@@ -307,10 +402,10 @@ class IviumInputFile(InputFile):
         }
 
         # number of samples is total line count minus sample start, minus last line
-        metadata["num_rows"] = len(self._sample_rows)
+        metadata["num_rows"] = len(self._sample_starts)
         metadata["first_sample_no"] = 1
         # if sample number not provided by file then we count from 0
-        metadata["last_sample_no"] = len(self._sample_rows) - 1
+        metadata["last_sample_no"] = len(self._sample_starts) - 1
         self.logger.debug(metadata)
         # put in all the ivium metadata
         metadata["misc_file_data"] = dict(self._file_metadata)
@@ -4,32 +4,65 @@
 
 import os
 import csv
+import hashlib
 import ntpath
 import re
 from datetime import datetime
-import xlrd
+from itertools import islice
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import maya
-from .input_file import InputFile
+import numpy as np
+from .input_file import InputFile, SNIFF_BYTES, DEFAULT_BLOCK_ROWS
+from .workbook import open_workbook
 from .exceptions import (
     UnsupportedFileTypeError,
     EmptyFileError,
     InvalidDataInFileError
 )
 
+XLS_MAGIC = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+XLSX_MAGIC = b'PK\x03\x04'
+
+# Numeric columns holding whole numbers; other numeric columns are read as floats
+INTEGER_COLUMNS = ["Rec#", "Cyc#", "Step", "ES"]
+# Raw files smaller than this are always parsed in a single process
+PARALLEL_PARSE_BYTES = 64 * 1024 * 1024
+# Size of the byte ranges raw files are split into for parallel parsing
+PARSE_RANGE_BYTES = 8 * 1024 * 1024
+# Number of byte ranges being parsed or waiting to be yielded, per process
+RANGES_IN_FLIGHT_PER_PROCESS = 2
+# Bytes before the point a file is resumed from that must be unchanged since it was last read
+RESUME_CHECK_BYTES = 4096
+
 
 class MaccorInputFile(InputFile):
     """
         A class for handling input files
     """
 
+    # Column presence, row counts and labels are only known once load_blocks has read the file
+    lazy_has_data = True
+    # Data rows are appended to the file as a test runs
+    resumable = True
+    parse_cache_attributes = ('num_header_rows',)
+
     def __init__(self, file_path, **kwargs):
+        self._labels = None
+        # Byte offsets of the data read by read_blocks
+        self.start_offset = None
+        self.data_start = None
+        self.data_end = None
+        self._resumed_from = None
         self.validate_file(file_path)
         super().__init__(file_path, **kwargs)
         self.logger.info("Type is MACCOR")
 
     def identify_columns(self, reader):
         """
-            Identifies columns in a maccor csv or tsv file"
+            Identifies columns in a maccor csv or tsv file from its headers and first row.
+            Numeric columns are marked as having data if the first row is non-zero;
+            the rest of the file is checked as it is read by load_blocks.
         """
         headers = [header for header in next(reader) if header != ""]
         correct_number_of_columns = len(headers)
@@ -37,51 +70,14 @@ class MaccorInputFile(InputFile):
             recno_col = headers.index("Rec#")
         except ValueError:
             recno_col = -1
-        column_has_data = [False for column in headers]
-        row_idx = 1
-        first_data = next(reader)
         first_data = handle_recno(
-            first_data, correct_number_of_columns, recno_col, row_idx
+            next(reader), correct_number_of_columns, recno_col, 1
         )
         column_is_numeric = [isfloat(column) for column in first_data]
         self.logger.debug(column_is_numeric)
-        numeric_columns = []
-        for i in range(0, len(column_is_numeric)):
-            if column_is_numeric[i]:
-                numeric_columns.append(i)
-            else:
-                column_has_data[i] = True
-        for row_idx, row in enumerate(reader, 1):
-            row = handle_recno(row, correct_number_of_columns, recno_col, row_idx)
-            for col in numeric_columns[:]:
-                data_detected = False
-                is_float = True
-                try:
-                    data_detected = float(row[col]) != 0.0
-                except ValueError:
-                    # Failed to cast a string to float so it is a value
-                    data_detected = True
-                    is_float = False
-                if data_detected:
-                    column_has_data[col] = True
-                    numeric_columns.remove(col)
-                    self.logger.debug(
-                        "Found data in col {} ( {} ) : {}{} on row {}".format(
-                            col,
-                            headers[col],
-                            row[col],
-                            (
-                                (" as float: " + str(float(row[col])))
-                                if is_float
-                                else ""
-                            ),
-                            row_idx,
-                        )
-                    )
-
         column_info = {
             headers[i]: {
-                "has_data": column_has_data[i],
+                "has_data": not column_is_numeric[i] or float(first_data[i]) != 0.0,
                 "is_numeric": column_is_numeric[i],
             }
             for i in range(0, len(headers))
@@ -104,18 +100,8 @@ class MaccorInputFile(InputFile):
             if name in known_units:
                 column_info[name]['unit'] = known_units[name]
 
-        # account for 0 based indexing
-        total_rows = row_idx + 1
-        if recno_col == -1:
-            # No Rec# , make up numbers
-            first_rec = 1  # Maccor count from 1
-            last_rec = total_rows
-        else:
-            first_rec = int(first_data[recno_col])
-            last_rec = int(row[recno_col])
         self.logger.debug(column_info)
-        self.logger.debug("Num rows {}".format(total_rows))
-        return column_info, total_rows, first_rec, last_rec
+        return column_info
 
     def load_metadata(self):
         """
@@ -135,11 +121,7 @@ class MaccorInputFile(InputFile):
                 ntpath.basename(self.file_path)
             )[0]
             metadata["Machine Type"] = "Maccor"
-            column_info, total_rows, first_rec, last_rec = \
-                self.identify_columns(reader)
-            metadata["num_rows"] = total_rows
-            metadata["first_sample_no"] = first_rec
-            metadata["last_sample_no"] = last_rec
+            column_info = self.identify_columns(reader)
             self.logger.debug(metadata)
             return metadata, column_info
 
@@ -196,159 +178,352 @@ class MaccorInputFile(InputFile):
                     for col_idx in columns_of_interest
                 }
 
-    def get_data_labels(self):
-        file_path = self.file_path
-        column_info = self.column_info
-        columns = [
-            column
-            for column, info in column_info.items()
-            if info["has_data"] or column == "Cyc#"
-        ]
-        data_generator = self.load_data(file_path, columns)
+    def make_block(self, values: dict) -> dict:
+        """
+            Convert lists of cell values to arrays typed according to column_info
+        """
+        block = {}
+        for name, column_values in values.items():
+            if not self.column_info.get(name, {}).get("is_numeric"):
+                if len(column_values) and isinstance(column_values[0], bytes):
+                    # Values from split_block can't contain newlines, so decode them all at once
+                    column_values = b"\n".join(column_values).decode("utf-8", errors="replace").split("\n")
+                block[name] = np.array(column_values, dtype=object)
+            elif name in INTEGER_COLUMNS:
+                try:
+                    block[name] = np.array(column_values, dtype=np.int64)
+                except ValueError:
+                    try:
+                        block[name] = np.array(column_values, dtype=np.float64).astype(np.int64)
+                    except ValueError:
+                        raise InvalidDataInFileError(f"Non-integer value in column {name}")
+            else:
+                try:
+                    block[name] = np.array(column_values, dtype=np.float64)
+                except ValueError:
+                    # Blank or text cells in a numeric column are stored as NaN
+                    self.logger.warning(f"Non-numeric values in column {name} stored as NaN")
+                    block[name] = np.array([to_float(v) for v in column_values], dtype=np.float64)
+        return block
 
-        # Generate labels for some specific numeric columns
-        numeric_columns = [
-            column
-            for column, info in column_info.items()
-            if column in {"Step", "ES"} and info["is_numeric"]
-        ]
+    def split_block(self, lines, correct_number_of_columns, recno_col):
+        """
+            Split lines of a maccor csv or tsv file into lists of bytes for each column.
+            The delimiters are located for the whole block at once, and thousands separators
+            in Rec# are removed without looking at each row in Python.
+            Returns None for blocks this can't handle (quoted values, missing or extra values),
+            which must be parsed with split_rows instead.
+        """
+        delimiter = self.delimiter.encode()
+        text = b"".join(lines)
+        if b'"' in text:
+            return None
+        if b"\r" in text:
+            text = text.replace(b"\r\n", b"\n")
+        if not text.endswith(b"\n"):
+            text += b"\n"
+        buffer = np.frombuffer(text, dtype=np.uint8)
+        line_ends = np.flatnonzero(buffer == ord("\n"))
+        if len(line_ends) != len(lines):
+            return None
+        delimiters = np.flatnonzero(buffer == ord(delimiter))
+        # index in delimiters of the first delimiter of each row
+        first_delimiter = np.searchsorted(delimiters, np.concatenate(([0], line_ends[:-1] + 1)))
+        delimiters_per_row = np.searchsorted(delimiters, line_ends) - first_delimiter
+        # A Rec# written with a thousands separator is split in two in csv files
+        split_recno = delimiters_per_row == correct_number_of_columns
+        if not np.all(split_recno | (delimiters_per_row == correct_number_of_columns - 1)):
+            return None
+        remove = []
+        if split_recno.any():
+            if recno_col < 0:
+                return None
+            remove.append(delimiters[first_delimiter[split_recno] + recno_col])
+        elif recno_col >= 0 and delimiter != b"," and b"," in text:
+            commas = np.flatnonzero(buffer == ord(","))
+            row = np.searchsorted(line_ends, commas)
+            column = np.searchsorted(delimiters, commas) - first_delimiter[row]
+            remove.append(commas[column == recno_col])
+        if len(remove):
+            text = np.delete(buffer, np.concatenate(remove)).tobytes()
+        fields = text.replace(b"\n", delimiter).split(delimiter)[:-1]
+        return [fields[i::correct_number_of_columns] for i in range(correct_number_of_columns)]
 
-        non_numeric_columns = [
-            column
-            for column, info in column_info.items()
-            if info["has_data"] and not info["is_numeric"] and column != "DPt Time"
+    def split_rows(self, lines, correct_number_of_columns, recno_col, first_row_idx):
+        """
+            Split lines of a maccor csv or tsv file into lists of values for each column, row by row
+        """
+        reader = csv.reader(
+            (line.decode("utf-8", errors="replace") for line in lines),
+            delimiter=self.delimiter
+        )
+        columns = [[] for _ in range(correct_number_of_columns)]
+        for row_idx, row in enumerate(reader, first_row_idx):
+            if not len(row):
+                continue
+            row = handle_recno(
+                row, correct_number_of_columns, recno_col, row_idx
+            )
+            if len(row) != correct_number_of_columns:
+                # Every column must get a value from every row, or the columns would be misaligned
+                raise InvalidDataInFileError(
+                    f"Row {row_idx} has {len(row)} cols, expected {correct_number_of_columns}"
+                )
+            for column_values, value in zip(columns, row):
+                column_values.append(value)
+        return columns
+
+    def is_complete_row(self, line: bytes, correct_number_of_columns, recno_col) -> bool:
+        """
+            True if a line of a maccor csv or tsv file ends with a newline and has a value for each column
+        """
+        if not line.endswith(b"\n"):
+            return False
+        row = next(csv.reader([line.decode("utf-8", errors="replace")], delimiter=self.delimiter), [])
+        if not len(row):
+            return True
+        try:
+            row = handle_recno(row, correct_number_of_columns, recno_col, 0)
+        except InvalidDataInFileError:
+            return False
+        return len(row) == correct_number_of_columns
+
+    def complete_data_end(self, f, start: int, end: int, correct_number_of_columns, recno_col) -> int:
+        """
+            Find the end of the data between start and end that can be read now.
+            The last line of a file may still be being written, so it is left to be read next time
+            if it has no newline or is missing values.
+        """
+        if end <= start:
+            return start
+        last_start = self.last_line_end(f, start, end - 1)
+        f.seek(last_start)
+        if self.is_complete_row(f.read(end - last_start), correct_number_of_columns, recno_col):
+            return end
+        return last_start
+
+    @staticmethod
+    def read_lines(f, end: int):
+        """
+            Read lines from the current position of f up to the offset end
+        """
+        position = f.tell()
+        while position < end:
+            line = f.readline(end - position)
+            if not line:
+                return
+            position += len(line)
+            yield line
+
+    def read_header(self, csvfile):
+        """
+            Skip the metadata rows of a maccor csv or tsv file opened in binary mode,
+            returning the column names and the index of the Rec# column (-1 if absent)
+        """
+        csvfile.readline()
+        if self.num_header_rows > 1:
+            csvfile.readline()
+        header = csvfile.readline().decode("utf-8", errors="replace")
+        column_names = [
+            header for header in next(csv.reader([header], delimiter=self.delimiter))
+            if header != ""
         ]
+        try:
+            recno_col = column_names.index("Rec#")
+        except ValueError:
+            recno_col = -1
+        return column_names, recno_col
 
-        # note ranges returned are inclusive lower bound, exclusive upper bound
-        cyc_no = None
-        cyc_no_start = None
-        cyc_amps = 0
-        numeric_value = {column: None for column in numeric_columns}
-        numeric_start = {column: 0 for column in numeric_columns}
-        numeric_value_counts = {column: {} for column in numeric_columns}
-        non_numeric_value = {column: None for column in non_numeric_columns}
-        non_numeric_start = {column: 0 for column in non_numeric_columns}
-        non_numeric_value_counts = {column: {} for column in non_numeric_columns}
-        for row_idx, row in enumerate(data_generator, 1):
-            rec_no = int(row.get("Rec#", row_idx))
-
-            # Generate ranges for cycles
-            if "Cyc#" in row:
-                row_cyc = int(row["Cyc#"])
-                if cyc_no is None:
-                    cyc_no = row_cyc
-                    cyc_no_start = rec_no
-                elif cyc_no < row_cyc:
-                    # on a new cycle
-                    yield "cycle_{}".format(cyc_no), (cyc_no_start, rec_no + 1)
-                    cyc_no = row_cyc
-                    cyc_no_start = rec_no
-            elif "Amps" in row:
-                # This file doesn't have cycles recorded, try and detect them from
-                # amps
-                amps = float(row["Amps"])
-                cyc_begin = cyc_amps <= 0 and amps > 0.0
-                cyc_mid = cyc_amps > 0 and amps < 0.0
-                cyc_end = cyc_amps < 0 and amps >= 0.0
-                # a <=0 to positive amps edge
-                if cyc_begin:
-                    cyc_amps = 1
-                    if cyc_no_start is not None:
-                        yield "cycle_{}".format(cyc_no), (cyc_no_start, rec_no + 1)
-                    cyc_no_start = rec_no
-                    cyc_no = 0 if cyc_no is None else cyc_no + 1
-                # a <0 to 0 change
-                elif cyc_end:  # cycle ended at zero amps, not start of a new cycle
-                    yield "cycle_{}".format(cyc_no), (cyc_no_start, rec_no + 1)
-                    cyc_no_start = None
-                    cyc_amps = 0
-                elif cyc_mid:
-                    # positive to 0 or negative
-                    cyc_amps = -1
-
-            # Handle ranges for specific numeric data
-            for column in numeric_columns:
-                prev_val = numeric_value[column]
-                col_val = row[column]
-                # handle first iteration
-                if prev_val is None:
-                    numeric_value[column] = col_val
-                    numeric_start[column] = rec_no
-                elif prev_val != col_val:
-                    # value has changed, end range
-                    count = numeric_value_counts[column].get(prev_val, -1) + 1
-                    numeric_value_counts[column][prev_val] = count
-                    yield f"{column}_{prev_val}_{count}", (
-                        numeric_start[column],
-                        rec_no + 1,
-                    )
-                    numeric_value[column] = col_val
-                    numeric_start[column] = rec_no
-
-            # Handle ranges for non-numeric data
-            for column in non_numeric_columns:
-                prev_val = non_numeric_value[column]
-                col_val = row[column]
-                # handle first iteration
-                if prev_val is None:
-                    non_numeric_value[column] = col_val
-                    non_numeric_start[column] = rec_no
-                elif prev_val != col_val:
-                    # value has changed, end range
-                    count = non_numeric_value_counts[column].get(prev_val, -1) + 1
-                    non_numeric_value_counts[column][prev_val] = count
-                    yield f"{column}_{prev_val}_{count}", (
-                        non_numeric_start[column],
-                        rec_no + 1,
+    def parse_lines(self, lines, column_names, recno_col, block_rows: int = DEFAULT_BLOCK_ROWS):
+        """
+            Parse an iterable of data lines (bytes) into blocks of arrays
+        """
+        lines = iter(lines)
+        row_idx = 0
+        while True:
+            block_lines = list(islice(lines, block_rows))
+            if not len(block_lines):
+                break
+            columns = self.split_block(block_lines, len(column_names), recno_col)
+            if columns is None:
+                self.logger.debug(f"Reading rows {row_idx} to {row_idx + len(block_lines)} one at a time")
+                columns = self.split_rows(block_lines, len(column_names), recno_col, row_idx)
+            yield self.make_block(dict(zip(column_names, columns)))
+            row_idx += len(block_lines)
+
+    def read_blocks(self, block_rows: int = DEFAULT_BLOCK_ROWS):
+        """
+            Read all columns of a maccor csv or tsv file as blocks of arrays
+        """
+        with open(self.file_path, "rb") as csvfile:
+            column_names, recno_col = self.read_header(csvfile)
+            self.data_start = csvfile.tell()
+            offset = self.start_offset if self.start_offset is not None else self.data_start
+            data_end = self.complete_data_end(
+                csvfile, offset, os.fstat(csvfile.fileno()).st_size, len(column_names), recno_col
+            )
+            csvfile.seek(offset)
+            yield from self.parse_lines(self.read_lines(csvfile, data_end), column_names, recno_col, block_rows)
+            self.data_end = data_end
+
+    def load_blocks(self, columns, block_rows: int = DEFAULT_BLOCK_ROWS):
+        """
+            Load data as blocks of arrays.
+            In the same pass, numeric columns are checked for data, rows are counted
+            and labels are generated, so the file is read only once.
+            column_info, num_rows, first_sample_no, last_sample_no and the labels
+            are complete once all blocks have been read.
+        """
+        labeller = MaccorLabeller(self.column_info)
+        num_rows = 0
+        first_rec = None
+        last_rec = None
+        for block in self.read_blocks(block_rows):
+            length = len(next(iter(block.values())))
+            for name, values in block.items():
+                info = self.column_info.get(name)
+                if info is None or info["has_data"] or values.dtype.kind not in "fi":
+                    continue
+                found = np.flatnonzero(values != 0)
+                if len(found):
+                    info["has_data"] = True
+                    self.logger.debug(
+                        f"Found data in col {name} : {values[found[0]]} on row {num_rows + found[0] + 1}"
                     )
-                    non_numeric_value[column] = col_val
-                    non_numeric_start[column] = rec_no
-
-        # return any partial ranges
-        if cyc_no_start is not None:
-            yield "cycle_{}".format(cyc_no), (cyc_no_start, rec_no + 1)
-        for column in numeric_columns:
-            prev_val = numeric_value[column]
-            if numeric_start[column] is not None:
-                count = numeric_value_counts[column].get(prev_val, -1) + 1
-                yield f"{column}_{prev_val}_{count}", (
-                    numeric_start[column],
-                    rec_no + 1,
-                )
-        for column in non_numeric_columns:
-            prev_val = non_numeric_value[column]
-            if non_numeric_start[column] is not None:
-                count = non_numeric_value_counts[column].get(prev_val, -1) + 1
-                yield f"{column}_{prev_val}_{count}", (
-                    non_numeric_start[column],
-                    rec_no + 1,
-                )
+            if "Rec#" in block:
+                if first_rec is None:
+                    first_rec = int(block["Rec#"][0])
+                last_rec = int(block["Rec#"][-1])
+            labeller.feed(block, num_rows)
+            num_rows += length
+            yield {name: values for name, values in block.items() if name in columns}
+
+        self._labels = labeller.finish()
+        if self._resumed_from is not None:
+            # Only the rows after the resume point were read
+            num_rows += self.resumed_rows
+            first_rec = self._resumed_from["first_sample_no"]
+            if last_rec is None:
+                last_rec = self._resumed_from["last_sample_no"]
+        self.metadata["num_rows"] = num_rows
+        # Maccor counts from 1, so make up record numbers if there's no Rec#
+        self.metadata["first_sample_no"] = first_rec if first_rec is not None else 1
+        self.metadata["last_sample_no"] = last_rec if last_rec is not None else num_rows
+        self.logger.debug("Num rows {}".format(num_rows))
+        if self.resumable:
+            self.resume_point = self.get_resume_point(num_rows)
+
+    @staticmethod
+    def hash_bytes(f, start: int, end: int) -> str:
+        f.seek(start)
+        return hashlib.sha256(f.read(end - start)).hexdigest()
+
+    @staticmethod
+    def last_line_end(f, start: int, end: int) -> int:
+        """
+            Find the offset after the last newline between start and end
+        """
+        position = end
+        while position > start:
+            chunk_start = max(position - RESUME_CHECK_BYTES, start)
+            f.seek(chunk_start)
+            newline = f.read(position - chunk_start).rfind(b"\n")
+            if newline >= 0:
+                return chunk_start + newline + 1
+            position = chunk_start
+        return start
+
+    def get_resume_point(self, num_rows: int) -> dict:
+        """
+            Record where read_blocks stopped, with hashes of the header and of the bytes before that point
+            so resume can check the file has only been appended to since.
+            read_blocks stops before a final line that may still be being written, so it is read next time.
+        """
+        with open(self.file_path, "rb") as f:
+            offset = self.data_end
+            check_start = max(offset - RESUME_CHECK_BYTES, self.data_start)
+            return {
+                "offset": offset,
+                "rows": num_rows,
+                "first_sample_no": self.metadata["first_sample_no"],
+                "last_sample_no": self.metadata["last_sample_no"],
+                "header_hash": self.hash_bytes(f, 0, self.data_start),
+                "check_hash": self.hash_bytes(f, check_start, offset),
+            }
+
+    def resume(self, resume_point: dict) -> bool:
+        try:
+            offset = resume_point["offset"]
+            with open(self.file_path, "rb") as f:
+                self.read_header(f)
+                data_start = f.tell()
+                if not data_start <= offset <= os.fstat(f.fileno()).st_size:
+                    return False
+                if self.hash_bytes(f, 0, data_start) != resume_point["header_hash"]:
+                    self.logger.info("Header has changed, reading the whole file")
+                    return False
+                check_start = max(offset - RESUME_CHECK_BYTES, data_start)
+                if self.hash_bytes(f, check_start, offset) != resume_point["check_hash"]:
+                    self.logger.info("Data before the resume point have changed, reading the whole file")
+                    return False
+            self.resumed_rows = resume_point["rows"]
+        except (KeyError, TypeError, OSError) as e:
+            self.logger.warning(f"Cannot resume from {resume_point}: {e}")
+            return False
+        self.start_offset = offset
+        self._resumed_from = resume_point
+        return True
+
+    def get_data_labels(self):
+        if self._labels is None:
+            # Labels are generated while the data are loaded
+            for _ in self.load_blocks([]):
+                pass
+        yield from self._labels
 
-    def is_maccor_text_file(self, file_path, delimiter):
-        with open(file_path, "r") as f:
-            line = f.readline()
-            line_start = "Today''s Date" + delimiter
-            date_regex = r"\d\d\/\d\d\/\d\d\d\d \d?\d:\d\d:\d\d [AP]M"
-            if not line.startswith(line_start):
-                return False
-            if not re.match((line_start + date_regex), line):
-                return False
-            line = f.readline()
-            line_start = "Date of Test:" + delimiter
-            if not line.startswith(line_start):
-                return False
-            if not re.match((line_start + date_regex), line):
-                return False
-            reader = csv.reader(f, delimiter=delimiter)
-            headers = next(reader)
-            if (
-                "Amps" not in headers
-                or "Volts" not in headers
-                or "TestTime" not in headers
-            ):
-                return False
+    @staticmethod
+    def is_maccor_text_file(lines, delimiter):
+        line_start = "Today''s Date" + delimiter
+        date_regex = r"\d\d\/\d\d\/\d\d\d\d \d?\d:\d\d:\d\d [AP]M"
+        if len(lines) < 3:
+            return False
+        if not lines[0].startswith(line_start):
+            return False
+        if not re.match((line_start + date_regex), lines[0]):
+            return False
+        line_start = "Date of Test:" + delimiter
+        if not lines[1].startswith(line_start):
+            return False
+        if not re.match((line_start + date_regex), lines[1]):
+            return False
+        headers = next(csv.reader([lines[2]], delimiter=delimiter))
+        if (
+            "Amps" not in headers
+            or "Volts" not in headers
+            or "TestTime" not in headers
+        ):
+            return False
         return True
 
+    @classmethod
+    def detect_delimiter(cls, head):
+        """
+            Return the delimiter of a maccor csv or tsv file from its first bytes,
+            or None if it isn't one
+        """
+        lines = head.decode("utf-8", errors="replace").splitlines()[:3]
+        delimiter = None
+        for delim in [',', '\t']:
+            if cls.is_maccor_text_file(lines, delim):
+                delimiter = delim
+        return delimiter
+
+    @classmethod
+    def sniff(cls, file_path: str, head: bytes) -> bool:
+        if not (file_path.endswith(".csv") or file_path.endswith(".txt")):
+            return False
+        return cls.detect_delimiter(head) is not None
+
     def validate_file(self, file_path):
         if not (
                 file_path.endswith(".csv") or
@@ -356,10 +531,8 @@ class MaccorInputFile(InputFile):
         ):
             raise UnsupportedFileTypeError
 
-        self.delimiter = None
-        for delim in [',', '\t']:
-            if self.is_maccor_text_file(file_path, delim):
-                self.delimiter = delim
+        with open(file_path, "rb") as f:
+            self.delimiter = self.detect_delimiter(f.read(SNIFF_BYTES))
         if self.delimiter is None:
             raise UnsupportedFileTypeError
 
@@ -368,122 +541,93 @@ class MaccorExcelInputFile(MaccorInputFile):
     """
         A class for handling input files
     """
+    resumable = False
+    parse_cache_attributes = ('nsheets', 'headers_row', '_has_metadata_row')
 
-    def __init__(self, file_path):
-        self.validate_file(file_path)
-        super().__init__(file_path)
+    @classmethod
+    def sniff(cls, file_path: str, head: bytes) -> bool:
+        if file_path.endswith(".xls"):
+            return head.startswith(XLS_MAGIC)
+        if file_path.endswith(".xlsx"):
+            return head.startswith(XLSX_MAGIC)
+        return False
 
-    def identify_columns(self, wbook):
+    def identify_columns(self, rows):
         """
-            Identifies columns in a maccor excel file"
+            Identifies columns in a maccor excel file from its headers and first row.
+            Numeric columns are marked as having data if the first row is non-zero;
+            the rest of the file is checked as it is read by load_blocks.
         """
-        sheet = wbook.sheet_by_index(0)
-        column_has_data = [False for col in range(0, sheet.ncols)]
-        headers = []
-        numeric_columns = []
-        column_is_numeric = []
-        if self._has_metadata_row:
-            headers_row = 1
-        else:
-            headers_row = 0
-        for col in range(0, sheet.ncols):
-            headers.append(sheet.cell_value(headers_row, col))
-            is_numeric = isfloat(
-                sheet.cell_value(headers_row+1, col)
-            )
-            column_is_numeric.append(is_numeric)
-            if is_numeric:
-                numeric_columns.append(col)
-            else:
-                column_has_data[col] = True
+        headers = rows[self.headers_row]
+        first_data = rows[self.headers_row + 1] if len(rows) > self.headers_row + 1 else []
+        first_data = [*first_data, *([""] * (len(headers) - len(first_data)))]
+        column_is_numeric = [isfloat(value) for value in first_data]
         self.logger.debug("headers: {}".format(headers))
-        self.logger.debug("numeric_columns: {}".format(numeric_columns))
-        try:
-            recno_col = headers.index("Rec#")
-            first_rec = sheet.cell_value(headers_row+1, recno_col)
-        except ValueError:
-            # Don't have record numbers, make them up
-            first_rec = 1
-        total_rows = 0
-        for sheet_id in range(0, wbook.nsheets):
-            self.logger.debug("Loading sheet... " + str(sheet_id))
-            sheet = wbook.sheet_by_index(sheet_id)
-            total_rows += sheet.nrows - 1 - int(self._has_metadata_row)
-            for row in range(headers_row+1, sheet.nrows):
-                for column in numeric_columns[:]:
-                    if float(sheet.cell_value(row, column)) != 0.0:
-                        column_has_data[column] = True
-                        numeric_columns.remove(column)
-                        self.logger.debug(
-                            "Found data in col {} ( {} ) : {}".format(
-                                column,
-                                headers[column],
-                                float(sheet.cell_value(row, column)),
-                            )
-                        )
-            if sheet.nrows > 2:
-                # update this each time there is a valid answer since we don't know for
-                # sure if the last sheet actually will have data
-                try:
-                    recno_col = headers.index("Rec#")
-                    last_rec = sheet.cell_value(headers_row+1, row)
-                except ValueError:
-                    # Don't have record numbers, make them up
-                    last_rec = total_rows
-            self.logger.debug("Unloading sheet " + str(sheet_id))
-            wbook.unload_sheet(sheet_id)
-
         column_info = {
             headers[i]: {
-                "has_data": column_has_data[i],
+                "has_data": not column_is_numeric[i] or float(first_data[i]) != 0.0,
                 "is_numeric": column_is_numeric[i],
             }
             for i in range(0, len(headers))
         }
         self.logger.debug(column_info)
-        self.logger.debug("Num rows {}".format(total_rows))
-        return column_info, total_rows, first_rec, last_rec
+        return column_info
+
+    # Rows are unpacked from load_blocks
+    load_data = InputFile.load_data
 
-    def load_data(self, file_path,
-                  columns, column_renames=None):
+    def read_sheet(self, sheet_id: int, block_rows: int = DEFAULT_BLOCK_ROWS):
         """
-            Load metadata in a maccor excel file"
+            Read all columns of one sheet as blocks of arrays, reading whole columns at a time.
+            Run in worker processes by read_blocks if there are several sheets.
         """
-        if self._has_metadata_row:
-            headers_row = 1
-        else:
-            headers_row = 0
+        with open_workbook(self.file_path, logfile=LogFilter(self.logger)) as wbook:
+            return list(self.sheet_blocks(wbook, sheet_id, block_rows))
 
-        with xlrd.open_workbook(
-            file_path, on_demand=True, logfile=LogFilter(self.logger)
-        ) as wbook:
-            sheet = wbook.sheet_by_index(0)
-            columns_of_interest = []
-            column_names = []
-            recno_col = -1
-            for col in range(0, sheet.ncols):
-                column_name = sheet.cell_value(headers_row, col)
-                if column_name in columns:
-                    columns_of_interest.append(col)
-                if column_name == "Rec#":
-                    recno_col = col
-                if column_renames is not None and column_name in column_renames:
-                    column_name = column_renames[column_name]
-                column_names.append(column_name)
-            for sheet_id in range(0, wbook.nsheets):
-                self.logger.debug("Loading sheet..." + str(sheet_id))
-                sheet = wbook.sheet_by_index(sheet_id)
-                for row in range(headers_row+1, sheet.nrows):
-                    yield {
-                        column_names[col_idx]: (
-                            sheet.cell_value(row, col_idx)
-                            if recno_col != col_idx
-                            else sheet.cell_value(row, col_idx).replace(",", "")
-                        )
-                        for col_idx in columns_of_interest
-                    }
-                self.logger.debug("Unloading sheet " + str(sheet_id))
-                wbook.unload_sheet(sheet_id)
+    def sheet_blocks(self, wbook, sheet_id: int, block_rows: int = DEFAULT_BLOCK_ROWS):
+        column_names = list(self.column_info.keys())
+        self.logger.debug("Loading sheet..." + str(sheet_id))
+        for columns in wbook.column_blocks(sheet_id, self.headers_row + 1, block_rows):
+            values = {}
+            for name, column_values in zip(column_names, columns):
+                if name == "Rec#":
+                    column_values = [
+                        v.replace(",", "") if isinstance(v, str) else v
+                        for v in column_values
+                    ]
+                values[name] = column_values
+            if len(columns) < len(column_names):
+                # Trailing empty cells may be missing
+                length = len(columns[0]) if len(columns) else 0
+                for name in column_names[len(columns):]:
+                    values[name] = [""] * length
+            if len(columns):
+                yield self.make_block(values)
+        self.logger.debug("Unloading sheet " + str(sheet_id))
+
+    def read_blocks(self, block_rows: int = DEFAULT_BLOCK_ROWS):
+        """
+            Read all columns of a maccor excel file as blocks of arrays.
+            Workbooks with several sheets are read a sheet per worker process
+            if parse_processes is more than 1, with blocks yielded in sheet order.
+        """
+        with open_workbook(self.file_path, logfile=LogFilter(self.logger)) as wbook:
+            if self.parse_processes <= 1 or self.nsheets <= 1:
+                for sheet_id in range(0, wbook.nsheets):
+                    yield from self.sheet_blocks(wbook, sheet_id, block_rows)
+                return
+        self.logger.info(f"Parsing {self.nsheets} sheets with {self.parse_processes} processes")
+        executor = ProcessPoolExecutor(max_workers=self.parse_processes)
+        try:
+            pending = deque()
+            for sheet_id in range(0, self.nsheets):
+                pending.append(executor.submit(self.read_sheet, sheet_id, block_rows))
+                if len(pending) >= self.parse_processes:
+                    yield from pending.popleft().result()
+            while len(pending):
+                yield from pending.popleft().result()
+        finally:
+            executor.shutdown(cancel_futures=True)
 
     def load_metadata(self):
         """
@@ -491,44 +635,41 @@ class MaccorExcelInputFile(MaccorInputFile):
         """
         metadata = {}
         metadata['Filename'] = self.file_path
-        with xlrd.open_workbook(
-            self.file_path, on_demand=True, logfile=LogFilter(self.logger)
-        ) as wbook:
-            sheet = wbook.sheet_by_index(0)
-            col = 0
-            self._has_metadata_row = True
-            if sheet.ncols == 0:
+        with open_workbook(self.file_path, logfile=LogFilter(self.logger)) as wbook:
+            self.nsheets = wbook.nsheets
+            rows = wbook.head(0, 3)
+            if not len(rows) or not len(rows[0]):
                 raise EmptyFileError()
-            elif "Cyc#" in sheet.cell_value(0, 0):
-                self._has_metadata_row = False
+            metadata_row = rows[0]
+            col = 0
+            self._has_metadata_row = "Cyc#" not in str(metadata_row[0])
+            self.headers_row = 1 if self._has_metadata_row else 0
             if self._has_metadata_row:
-                while col < sheet.ncols:
-                    key = sheet.cell_value(0, col)
+                while col < len(metadata_row):
+                    key = metadata_row[col]
                     if not key:
                         break
                     key = clean_key(key)
                     if "Date" in key:
-                        metadata[key] = xlrd.xldate.xldate_as_datetime(
-                            sheet.cell_value(0, col + 1), wbook.datemode
-                        )
+                        metadata[key] = wbook.to_datetime(metadata_row[col + 1])
                         self.logger.debug(
                             "key "
                             + key
                             + " value: "
-                            + str(sheet.cell_value(0, col + 1))
+                            + str(metadata_row[col + 1])
                             + " - datemode: "
                             + str(wbook.datemode)
                         )
                         col = col + 1
                     elif "Procedure" in key:
                         metadata[key] = (
-                            clean_value(sheet.cell_value(0, col + 1))
+                            clean_value(metadata_row[col + 1])
                             + "\t"
-                            + clean_value(sheet.cell_value(0, col + 2))
+                            + clean_value(metadata_row[col + 2])
                         )
                         col = col + 2
                     else:
-                        metadata[key] = sheet.cell_value(0, col + 1)
+                        metadata[key] = metadata_row[col + 1]
                         col = col + 1
                     col = col + 1
                 metadata["misc_file_data"] = dict(metadata)
@@ -541,11 +682,7 @@ class MaccorExcelInputFile(MaccorInputFile):
                     os.path.getctime(self.file_path)
                 )
             metadata["Machine Type"] = "Maccor"
-            column_info, total_rows, first_rec, last_rec = \
-                self.identify_columns(wbook)
-            metadata["num_rows"] = total_rows
-            metadata["first_sample_no"] = first_rec
-            metadata["last_sample_no"] = last_rec
+            column_info = self.identify_columns(rows)
             self.logger.debug(metadata)
             return metadata, column_info
 
@@ -561,10 +698,62 @@ class MaccorRawInputFile(MaccorInputFile):
         A class for handling input files
     """
 
-    def __init__(self, file_path):
-        self.validate_file(file_path)
-        super().__init__(file_path)
+    def __init__(self, file_path, **kwargs):
         self.delimiter = '\t'
+        super().__init__(file_path, **kwargs)
+
+    def split_ranges(self, csvfile, start: int, end: int):
+        """
+            Split the bytes from start to end of the file into ranges of about PARSE_RANGE_BYTES
+            that begin and end on line boundaries
+        """
+        while start < end:
+            csvfile.seek(min(start + PARSE_RANGE_BYTES, end))
+            csvfile.readline()
+            range_end = min(csvfile.tell(), end)
+            yield start, range_end
+            start = range_end
+
+    def read_range(self, start: int, end: int, block_rows: int = DEFAULT_BLOCK_ROWS):
+        """
+            Parse the data lines between two byte offsets into a list of blocks.
+            Run in worker processes by read_blocks.
+        """
+        with open(self.file_path, "rb") as csvfile:
+            column_names, recno_col = self.read_header(csvfile)
+            csvfile.seek(start)
+            lines = csvfile.read(end - start).splitlines(keepends=True)
+        return list(self.parse_lines(lines, column_names, recno_col, block_rows))
+
+    def read_blocks(self, block_rows: int = DEFAULT_BLOCK_ROWS):
+        """
+            Read all columns of a maccor raw file as blocks of arrays.
+            Large files are split into byte ranges which are parsed by parse_processes worker processes.
+            Only a few ranges per process are in flight at once,
+            and blocks are yielded in file (i.e. Rec#) order.
+        """
+        size = os.path.getsize(self.file_path)
+        if self.parse_processes <= 1 or size - (self.start_offset or 0) < PARALLEL_PARSE_BYTES:
+            yield from super().read_blocks(block_rows)
+            return
+        with open(self.file_path, "rb") as csvfile:
+            column_names, recno_col = self.read_header(csvfile)
+            self.data_start = csvfile.tell()
+            self.logger.info(f"Parsing with {self.parse_processes} processes")
+            executor = ProcessPoolExecutor(max_workers=self.parse_processes)
+            try:
+                pending = deque()
+                offset = self.start_offset if self.start_offset is not None else self.data_start
+                data_end = self.complete_data_end(csvfile, offset, size, len(column_names), recno_col)
+                for start, end in self.split_ranges(csvfile, offset, data_end):
+                    pending.append(executor.submit(self.read_range, start, end, block_rows))
+                    if len(pending) >= RANGES_IN_FLIGHT_PER_PROCESS * self.parse_processes:
+                        yield from pending.popleft().result()
+                while len(pending):
+                    yield from pending.popleft().result()
+                self.data_end = data_end
+            finally:
+                executor.shutdown(cancel_futures=True)
 
     def load_metadata(self):
         """
@@ -593,46 +782,188 @@ class MaccorRawInputFile(MaccorInputFile):
             # parse what we have and leave handling anything different to some
             # future person
             metadata["Machine Type"] = "Maccor"
-            column_info, total_rows, first_rec, last_rec = \
-                self.identify_columns(reader)
-            metadata["num_rows"] = total_rows
-            metadata["first_sample_no"] = first_rec
-            metadata["last_sample_no"] = last_rec
+            column_info = self.identify_columns(reader)
             self.logger.debug(metadata)
 
         return metadata, column_info
 
+    @staticmethod
+    def is_maccor_raw_file(lines):
+        if len(lines) < 2:
+            return False
+        line_start = "Today's Date"
+        if not lines[0].startswith(line_start):
+            return False
+        line_bits = lines[0].split("\t")
+        if not len(line_bits) == 5:
+            return False
+        date_regex = r"\d\d\/\d\d\/\d\d\d\d"
+        dates_regex = line_start + " " + date_regex + "  Date of Test:"
+        if not re.match(dates_regex, line_bits[0]):
+            return False
+        if not re.match(date_regex, line_bits[1]):
+            return False
+        if not line_bits[2] == " Filename:":
+            return False
+        if not line_bits[4].startswith("Comment/Barcode: "):
+            return False
+        standard_columns = (
+            "Rec#\tCyc#\tStep\tTest (Sec)\tStep (Sec)\tAmp-hr\tWatt-hr\tAmps\t"
+            "Volts\tState\tES\tDPt Time"
+        )
+        return lines[1].startswith(standard_columns)
+
+    @classmethod
+    def sniff(cls, file_path: str, head: bytes) -> bool:
+        lines = head.decode("utf-8", errors="replace").split("\n")[:2]
+        return cls.is_maccor_raw_file(lines)
+
     def validate_file(self, file_path):
-        self.logger.debug('is_maccor_raw_file')
-        with open(file_path, "r") as f:
-            self.logger.debug('got line')
-            line = f.readline()
-            self.logger.debug('got line', line)
-            line_start = "Today's Date"
-            if not line.startswith(line_start):
-                raise UnsupportedFileTypeError
-            line_bits = line.split("\t")
-            if not len(line_bits) == 5:
-                raise UnsupportedFileTypeError
-            date_regex = "\d\d\/\d\d\/\d\d\d\d"
-            dates_regex = line_start + " " + date_regex + "  Date of Test:"
-            if not re.match(dates_regex, line_bits[0]):
-                raise UnsupportedFileTypeError
-            if not re.match(date_regex, line_bits[1]):
-                raise UnsupportedFileTypeError
-            if not line_bits[2] == " Filename:":
-                raise UnsupportedFileTypeError
-            if not line_bits[4].startswith("Comment/Barcode: "):
-                raise UnsupportedFileTypeError
-            line = f.readline()
-            standard_columns = (
-                "Rec#\tCyc#\tStep\tTest (Sec)\tStep (Sec)\tAmp-hr\tWatt-hr\tAmps\t"
-                "Volts\tState\tES\tDPt Time"
-            )
-            if not line.startswith(standard_columns):
+        with open(file_path, "rb") as f:
+            if not self.sniff(file_path, f.read(SNIFF_BYTES)):
                 raise UnsupportedFileTypeError
 
 
+class MaccorLabeller:
+    """
+        Generates range labels for cycles, steps and non-numeric columns
+        from blocks of maccor data fed to it in order.
+        Ranges are inclusive lower bound, exclusive upper bound.
+    """
+
+    def __init__(self, column_info):
+        # Generate labels for some specific numeric columns
+        numeric_columns = [
+            column
+            for column, info in column_info.items()
+            if column in {"Step", "ES"} and info["is_numeric"]
+        ]
+        non_numeric_columns = [
+            column
+            for column, info in column_info.items()
+            if info["has_data"] and not info["is_numeric"] and column != "DPt Time"
+        ]
+        self.range_columns = numeric_columns + non_numeric_columns
+        self.labels = []
+        self.rec_no = None
+        self.cyc_no = None
+        self.cyc_no_start = None
+        self.cyc_amps = 0
+        self.value = {column: None for column in self.range_columns}
+        self.start = {column: 0 for column in self.range_columns}
+        self.value_counts = {column: {} for column in self.range_columns}
+
+    def feed(self, block, first_row):
+        """
+            Add labels for a block of rows, first_row being the number of rows already fed.
+            Rows where values change are found with numpy, so Python code only runs
+            once per label rather than once per row.
+        """
+        length = len(next(iter(block.values())))
+        if length == 0:
+            return
+        if "Rec#" in block:
+            rec_nos = np.asarray(block["Rec#"])
+        else:
+            rec_nos = np.arange(first_row + 1, first_row + length + 1)
+        # Labels are sorted by the row they end on, then in the order they were generated
+        events = []
+        if "Cyc#" in block:
+            self.feed_cycles(np.asarray(block["Cyc#"]), rec_nos, events)
+        elif "Amps" in block:
+            # This file doesn't have cycles recorded, try and detect them from amps
+            self.feed_amps(np.asarray(block["Amps"], dtype=float), rec_nos, events)
+        for order, column in enumerate(self.range_columns, 1):
+            if column in block:
+                self.feed_range(column, np.asarray(block[column]), rec_nos, order, events)
+        events.sort(key=lambda e: (e[0], e[1]))
+        self.labels.extend(label for _, _, label in events)
+        self.rec_no = rec_nos[-1].item()
+
+    def feed_cycles(self, cycles, rec_nos, events):
+        """
+            A new cycle starts on each row whose Cyc# is above all those before it
+        """
+        if self.cyc_no is None:
+            self.cyc_no = cycles[0].item()
+            self.cyc_no_start = rec_nos[0].item()
+        if self.cyc_no != self.cyc_no:
+            # NaN is never exceeded
+            return
+        highest = np.fmax.accumulate(np.concatenate([[self.cyc_no], cycles]))
+        changes = np.flatnonzero(cycles > highest[:-1])
+        for i, cyc_no, rec_no in zip(changes, highest[changes].tolist(), rec_nos[changes].tolist()):
+            events.append((i, 0, ("cycle_{}".format(cyc_no), (self.cyc_no_start, rec_no + 1))))
+            self.cyc_no_start = rec_no
+        self.cyc_no = highest[-1].item()
+
+    def feed_amps(self, amps, rec_nos, events):
+        """
+            Cycles begin when amps turn positive, and end when they return to zero after going negative.
+            Only the first row after each change of sign can change the state.
+        """
+        signs = np.sign(amps)
+        changes = np.flatnonzero(signs[1:] != signs[:-1]) + 1
+        changes = np.concatenate([[0], changes])
+        cyc_no, cyc_no_start, cyc_amps = self.cyc_no, self.cyc_no_start, self.cyc_amps
+        for i, row_amps, rec_no in zip(changes, amps[changes].tolist(), rec_nos[changes].tolist()):
+            # a <=0 to positive amps edge
+            if cyc_amps <= 0 and row_amps > 0.0:
+                cyc_amps = 1
+                if cyc_no_start is not None:
+                    events.append((i, 0, ("cycle_{}".format(cyc_no), (cyc_no_start, rec_no + 1))))
+                cyc_no_start = rec_no
+                cyc_no = 0 if cyc_no is None else cyc_no + 1
+            # a <0 to 0 change
+            elif cyc_amps < 0 and row_amps >= 0.0:
+                # cycle ended at zero amps, not start of a new cycle
+                events.append((i, 0, ("cycle_{}".format(cyc_no), (cyc_no_start, rec_no + 1))))
+                cyc_no_start = None
+                cyc_amps = 0
+            elif cyc_amps > 0 and row_amps < 0.0:
+                # positive to 0 or negative
+                cyc_amps = -1
+        self.cyc_no, self.cyc_no_start, self.cyc_amps = cyc_no, cyc_no_start, cyc_amps
+
+    def feed_range(self, column, values, rec_nos, order, events):
+        """
+            A range of a step number or non-numeric value ends on each row where the value changes
+        """
+        changes = np.flatnonzero(values[1:] != values[:-1]) + 1
+        if self.value[column] is None:
+            # handle first iteration
+            self.value[column] = values[0:1].tolist()[0]
+            self.start[column] = rec_nos[0].item()
+        elif values[0:1].tolist()[0] != self.value[column]:
+            changes = np.concatenate([[0], changes])
+        if len(changes):
+            previous = values[np.maximum(changes - 1, 0)].tolist()
+            if changes[0] == 0:
+                previous[0] = self.value[column]
+            counts = self.value_counts[column]
+            for i, prev_val, rec_no in zip(changes.tolist(), previous, rec_nos[changes].tolist()):
+                # value has changed, end range
+                count = counts.get(prev_val, -1) + 1
+                counts[prev_val] = count
+                events.append((i, order, (f"{column}_{prev_val}_{count}", (self.start[column], rec_no + 1))))
+                self.start[column] = rec_no
+        self.value[column] = values[-1:].tolist()[0]
+
+    def finish(self):
+        """
+            Add labels for any partial ranges and return all labels
+        """
+        if self.rec_no is None:
+            return self.labels
+        if self.cyc_no_start is not None:
+            self.labels.append(("cycle_{}".format(self.cyc_no), (self.cyc_no_start, self.rec_no + 1)))
+        for column in self.range_columns:
+            prev_val = self.value[column]
+            count = self.value_counts[column].get(prev_val, -1) + 1
+            self.labels.append((f"{column}_{prev_val}_{count}", (self.start[column], self.rec_no + 1)))
+        return self.labels
+
+
 class LogFilter(object):
     def __init__(self, logger):
         self.logger = logger
@@ -652,11 +983,18 @@ class LogFilter(object):
         pass
 
 
+def to_float(value):
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return np.nan
+
+
 def isfloat(value):
     try:
         float(value)
         return True
-    except ValueError:
+    except (ValueError, TypeError):
         return False
 
 
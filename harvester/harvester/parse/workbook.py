@@ -0,0 +1,141 @@
+# SPDX-License-Identifier: BSD-2-Clause
+# Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
+# of Oxford, and the 'Galv' Developers. All rights reserved.
+
+from datetime import datetime
+import xlrd
+from .exceptions import UnsupportedFileTypeError
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+
+class Workbook:
+    """
+        Read access to the sheets of a spreadsheet file, one block of columns at a time.
+        Empty cells are read as "".
+        Use open_workbook to get the right reader for a file.
+    """
+    datemode = 0
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def close(self):
+        pass
+
+    @property
+    def nsheets(self) -> int:
+        raise NotImplementedError
+
+    def head(self, sheet_id: int, rows: int) -> list[list]:
+        """
+            Values of the first rows of a sheet
+        """
+        raise NotImplementedError
+
+    def column_blocks(self, sheet_id: int, start_row: int, block_rows: int):
+        """
+            Yield lists holding the values of each column for up to block_rows rows at a time,
+            from start_row to the end of the sheet
+        """
+        raise NotImplementedError
+
+    def to_datetime(self, value) -> datetime:
+        """
+            Convert a date cell's value to a datetime
+        """
+        if isinstance(value, datetime):
+            return value
+        return xlrd.xldate.xldate_as_datetime(value, self.datemode)
+
+
+class XlsWorkbook(Workbook):
+    """
+        Reads .xls files with xlrd, reading whole column slices rather than single cells
+    """
+    def __init__(self, file_path, logfile=None):
+        super().__init__(file_path)
+        self.book = xlrd.open_workbook(file_path, on_demand=True, logfile=logfile)
+        self.datemode = self.book.datemode
+
+    def close(self):
+        self.book.release_resources()
+
+    @property
+    def nsheets(self) -> int:
+        return self.book.nsheets
+
+    def head(self, sheet_id: int, rows: int) -> list[list]:
+        sheet = self.book.sheet_by_index(sheet_id)
+        return [sheet.row_values(row) for row in range(0, min(rows, sheet.nrows))]
+
+    def column_blocks(self, sheet_id: int, start_row: int, block_rows: int):
+        sheet = self.book.sheet_by_index(sheet_id)
+        try:
+            for start in range(start_row, sheet.nrows, block_rows):
+                end = min(start + block_rows, sheet.nrows)
+                yield [sheet.col_values(col, start, end) for col in range(0, sheet.ncols)]
+        finally:
+            self.book.unload_sheet(sheet_id)
+
+
+class XlsxWorkbook(Workbook):
+    """
+        Reads .xlsx files with openpyxl in read-only mode, streaming rows rather than loading whole sheets
+    """
+    def __init__(self, file_path):
+        super().__init__(file_path)
+        if openpyxl is None:
+            raise UnsupportedFileTypeError("openpyxl is required to read .xlsx files")
+        self.book = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        self.datemode = 1 if self.book.epoch == openpyxl.utils.datetime.CALENDAR_MAC_1904 else 0
+
+    def close(self):
+        self.book.close()
+
+    @property
+    def nsheets(self) -> int:
+        return len(self.book.worksheets)
+
+    @staticmethod
+    def _values(row, width: int) -> list:
+        values = ["" if v is None else v for v in row]
+        if len(values) < width:
+            values.extend([""] * (width - len(values)))
+        return values
+
+    def head(self, sheet_id: int, rows: int) -> list[list]:
+        sheet = self.book.worksheets[sheet_id]
+        return [self._values(row, 0) for row in sheet.iter_rows(max_row=rows, values_only=True)]
+
+    def column_blocks(self, sheet_id: int, start_row: int, block_rows: int):
+        sheet = self.book.worksheets[sheet_id]
+        width = 0
+        rows = []
+        for row in sheet.iter_rows(min_row=start_row + 1, values_only=True):
+            width = max(width, len(row))
+            rows.append(row)
+            if len(rows) == block_rows:
+                yield [list(column) for column in zip(*[self._values(r, width) for r in rows])]
+                rows = []
+        if len(rows):
+            yield [list(column) for column in zip(*[self._values(r, width) for r in rows])]
+
+
+def open_workbook(file_path: str, logfile=None) -> Workbook:
+    """
+        Open a .xls or .xlsx file with the appropriate reader
+    """
+    if file_path.endswith(".xlsx"):
+        return XlsxWorkbook(file_path)
+    return XlsWorkbook(file_path, logfile=logfile)
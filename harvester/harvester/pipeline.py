@@ -0,0 +1,197 @@
+# SPDX-License-Identifier: BSD-2-Clause
+# Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
+# of Oxford, and the 'Galv' Developers. All rights reserved.
+
+import os
+import queue
+import threading
+import time
+from typing import Callable
+
+from .api import prepare_report, send_report
+from .settings import get_logger, get_upload_threads
+
+logger = get_logger(__file__)
+
+# Maximum number of chunks waiting to be uploaded before the parser is made to wait
+UPLOAD_QUEUE_SIZE = 4
+# Number of times a chunk that can be resent safely is sent again before the upload fails
+UPLOAD_RETRIES = 3
+# Seconds to wait before resending a chunk the first time; the wait doubles with each retry
+RETRY_DELAY = 1.0
+
+
+class UploadError(Exception):
+    pass
+
+
+class UploadPipeline:
+    """
+    Uploads import chunks in the background so that parsing can continue while data are sent.
+
+    The parser submits chunks to a bounded queue, so it is held back if uploading falls behind.
+    Uploader threads take chunks from the queue and serialise them concurrently,
+    but send them to the server strictly in the order they were submitted,
+    because the server appends each chunk to the data it already holds.
+    Once any chunk fails, later chunks are discarded and the next call to submit or close raises UploadError.
+
+    Use as a context manager and call close() once all chunks are submitted;
+    leaving the context without closing (e.g. because of an exception) discards unsent chunks.
+    on_upload, if given, is called with the duration of each successful upload.
+    A chunk that gets no response, or a server error, is sent again up to `retries` times.
+    Only retry when the server can recognise a chunk it has already received (i.e. numbered chunks
+    in an upload session), otherwise a chunk that was written before the response was lost is written twice.
+    """
+    def __init__(
+            self,
+            path: os.PathLike|str,
+            monitored_path_id: int,
+            threads: int = None,
+            queue_size: int = UPLOAD_QUEUE_SIZE,
+            on_upload: Callable[[float], None] = None,
+            retries: int = 0
+    ):
+        self.path = path
+        self.monitored_path_id = monitored_path_id
+        self.on_upload = on_upload
+        self.retries = retries
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.turn = threading.Condition()
+        self.next_to_send = 0
+        self.submitted = 0
+        self.error = None
+        self.closed = False
+        self.start_time = time.time()
+        self.timings_lock = threading.Lock()
+        self.timings = {'blocked': 0.0, 'prepare': 0.0, 'upload': 0.0, 'idle': 0.0}
+        self.threads = [
+            threading.Thread(target=self._upload, name=f"uploader-{i}", daemon=True)
+            for i in range(threads if threads is not None else get_upload_threads())
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.abort()
+        return False
+
+    def _add_time(self, stage: str, since: float):
+        with self.timings_lock:
+            self.timings[stage] += time.time() - since
+
+    def _fail(self, message: str):
+        if self.error is None:
+            logger.error(message)
+            self.error = UploadError(message)
+
+    def raise_for_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def submit(self, content: dict):
+        """
+        Queue a report content dict for upload, waiting for space in the queue if necessary
+        """
+        self.raise_for_error()
+        start = time.time()
+        while True:
+            try:
+                self.queue.put((self.submitted, content), timeout=0.5)
+                break
+            except queue.Full:
+                self.raise_for_error()
+        self._add_time('blocked', start)
+        self.submitted += 1
+
+    def _upload(self):
+        while True:
+            start = time.time()
+            item = self.queue.get()
+            self._add_time('idle', start)
+            if item is None:
+                return
+            sequence_number, content = item
+            prepared = None
+            if self.error is None:
+                start = time.time()
+                try:
+                    prepared = prepare_report(self.path, self.monitored_path_id, content=content)
+                except BaseException as e:
+                    self._fail(f"Unable to prepare chunk {sequence_number}: {e}")
+                self._add_time('prepare', start)
+            with self.turn:
+                while self.next_to_send != sequence_number:
+                    self.turn.wait()
+                try:
+                    if self.error is None and prepared is not None:
+                        start = time.time()
+                        report = self._send(sequence_number, prepared)
+                        upload_time = time.time() - start
+                        self._add_time('upload', start)
+                        if report is not None and report.ok and self.on_upload is not None:
+                            self.on_upload(upload_time)
+                        if report is None:
+                            self._fail(f"API Error")
+                        elif not report.ok:
+                            try:
+                                self._fail(f"API responded with Error: {report.json()['error']}")
+                            except BaseException:
+                                self._fail(f"API Error: {report.status_code}")
+                finally:
+                    self.next_to_send += 1
+                    self.turn.notify_all()
+
+    def _send(self, sequence_number: int, prepared: tuple):
+        report = send_report(*prepared)
+        for attempt in range(self.retries):
+            if report is not None and report.status_code < 500:
+                break
+            delay = RETRY_DELAY * 2 ** attempt
+            logger.warning(f"Chunk {sequence_number} not accepted; sending again in {delay:.0f}s")
+            time.sleep(delay)
+            report = send_report(*prepared)
+        return report
+
+    def _stop(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def log_timings(self):
+        elapsed = time.time() - self.start_time
+        parse = elapsed - self.timings['blocked']
+        logger.info((
+            f"Upload pipeline for {self.path}: {self.submitted} chunks in {elapsed:.2f}s; "
+            f"parsing {parse:.2f}s, parser waiting for uploaders {self.timings['blocked']:.2f}s; "
+            f"preparing {self.timings['prepare']:.2f}s, uploading {self.timings['upload']:.2f}s, "
+            f"uploaders idle {self.timings['idle']:.2f}s"
+        ))
+        if self.timings['blocked'] > parse:
+            logger.info("Uploading is the bottleneck")
+        elif self.submitted > 1:
+            logger.info("Parsing is the bottleneck")
+
+    def close(self):
+        """
+        Wait for all submitted chunks to be sent, raising UploadError if any failed
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self._stop()
+        self.log_timings()
+        self.raise_for_error()
+
+    def abort(self):
+        """
+        Discard any chunks not yet sent and stop the uploader threads
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self._fail(f"Upload of {self.path} aborted")
+        self._stop()
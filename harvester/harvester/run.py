@@ -8,11 +8,16 @@ import time
 
 from .parse.exceptions import UnsupportedFileTypeError
 from .settings import get_logger, get_setting
+from .cache import StatCache, FINAL_STATES
+from .watch import PathWatcher, get_path_watcher
 from .api import report_harvest_result, update_config
-from .harvest import import_file, get_import_file_handler
+from .harvest import import_file, get_input_file_class
 
 logger = get_logger(__file__)
 
+# Maximum number of files whose sizes are reported in a single request
+FILE_REPORT_BATCH_SIZE = 5000
+
 
 def split_path(core_path: os.PathLike|str, path: os.PathLike|str) -> (os.PathLike, os.PathLike):
     """
@@ -23,7 +28,7 @@ def split_path(core_path: os.PathLike|str, path: os.PathLike|str) -> (os.PathLik
     return core_path, os.path.relpath(path, core_path_abs)
 
 
-def harvest():
+def harvest(watcher: PathWatcher = None):
     logger.info("Beginning harvest cycle")
     paths = get_setting('monitored_paths')
     if not paths:
@@ -32,96 +37,246 @@ def harvest():
 
     logger.debug(paths)
 
-    for path in paths:
-        if path.get('active'):
-            harvest_path(path)
-        else:
-            logger.info(f"Skipping inactive path {path.get('path')} {path.get('regex')}")
+    if watcher is not None:
+        watcher.sync([p.get('path') for p in paths if p.get('active')])
+
+    stat_cache = StatCache()
+    # Files queued for reimport on the server are reported again, however long ago they settled
+    for full_path in get_setting('pending_reimports') or []:
+        stat_cache.unsettle(full_path)
+    try:
+        for path in paths:
+            if path.get('active'):
+                changed_files = watcher.drain(path.get('path')) if watcher is not None else None
+                harvest_path(path, stat_cache=stat_cache, changed_files=changed_files)
+            else:
+                logger.info(f"Skipping inactive path {path.get('path')} {path.get('regex')}")
+    finally:
+        stat_cache.save()
+
+def harvest_path(monitored_path: dict, stat_cache: StatCache = None, changed_files: set = None):
+    """
+    Report on the files in a MonitoredPath and import any the server says are ready.
 
-def harvest_path(monitored_path: dict):
+    If changed_files is given, only those files (and files the server has not yet
+    settled) are considered, instead of walking the whole directory.
+    """
     path = monitored_path.get('path')
     regex_str = monitored_path.get('regex')
     if regex_str is not None:
         logger.info(f"Harvesting from {path} with regex {regex_str}")
     else:
         logger.info(f"Harvesting from {path}")
+    save_stat_cache = stat_cache is None
+    if save_stat_cache:
+        stat_cache = StatCache()
     try:
         regex = re.compile(regex_str) if regex_str is not None else None
-        for (dir_path, dir_names, filenames) in os.walk(path):
-            for filename in filenames:
-                full_path = os.path.join(dir_path, filename)
-                core_path, file_path = split_path(path, full_path)
-                if regex is not None and not regex.match(file_path):
-                    logger.debug(f"Skipping {file_path} as it does not match regex {regex}")
-                    continue
+        path_prefix = os.path.join(path, '')
+        candidates = {}
+
+        def consider(full_path: str):
+            core_path, file_path = split_path(path, full_path)
+            if regex is not None and not regex.match(file_path):
+                logger.debug(f"Skipping {file_path} as it does not match regex {regex}")
+                return
+            try:
+                stat = os.stat(full_path)
+            except FileNotFoundError:
+                stat_cache.discard(full_path)
+                return
+            if stat_cache.is_settled(full_path, stat):
+                logger.debug(f"Skipping unchanged file {file_path}")
+                return
+            if stat_cache.is_unchanged(full_path, stat):
+                parser = stat_cache.get(full_path).get('parser')
+            else:
                 try:
-                    get_import_file_handler(full_path)
-                except UnsupportedFileTypeError:
-                    logger.debug(f"Skipping unsupported file {file_path}")
-                    continue
+                    parser = get_input_file_class(full_path).__name__
+                except (UnsupportedFileTypeError, OSError):
+                    parser = None
+                stat_cache.update(full_path, stat, parser=parser)
+            if parser is None:
+                logger.debug(f"Skipping unsupported file {file_path}")
+                return
+            candidates[full_path] = stat
+
+        if changed_files is not None:
+            # Files the server is still waiting on need reporting until they settle
+            pending = [
+                p for p, entry in stat_cache.entries.items()
+                if p.startswith(path_prefix) and entry.get('parser') is not None and entry.get('state') not in FINAL_STATES
+            ]
+            for full_path in {*[p for p in changed_files if p.startswith(path_prefix)], *pending}:
+                if os.path.isfile(full_path) or full_path in stat_cache.entries:
+                    consider(full_path)
+            logger.info(f"Checked {len(changed_files)} changed and {len(pending)} pending files in {path}")
+        else:
+            seen = set()
+            for (dir_path, dir_names, filenames) in os.walk(path):
+                for filename in filenames:
+                    full_path = os.path.join(dir_path, filename)
+                    seen.add(full_path)
+                    consider(full_path)
+
+            # Forget files that have been removed from the path
+            for cached_path in [p for p in stat_cache.entries.keys() if p.startswith(path_prefix)]:
+                if cached_path not in seen:
+                    stat_cache.discard(cached_path)
+            logger.info(f"Completed directory walking of {path}")
+
+        candidate_paths = list(candidates.keys())
+        for i in range(0, len(candidate_paths), FILE_REPORT_BATCH_SIZE):
+            batch = {p: candidates[p] for p in candidate_paths[i:i + FILE_REPORT_BATCH_SIZE]}
+            for full_path, status in report_file_stats(monitored_path, batch, stat_cache).items():
+                if status in ['STABLE', 'RETRY IMPORT']:
+                    harvest_file(full_path, monitored_path, stat_cache)
+    except BaseException as e:
+        logger.error(e)
+        report_harvest_result(
+            path=path,
+            monitored_path_id=monitored_path.get('id'),
+            error=e
+        )
+    finally:
+        if save_stat_cache:
+            stat_cache.save()
+
+
+def report_file_stats(monitored_path: dict, stats: dict, stat_cache: StatCache) -> dict:
+    """
+    Report the sizes of files to the server in a single request.
+
+    Returns a dictionary of file paths to server-assigned states
+    for the files that need importing.
+    """
+    logger.info(f"Reporting stats for {len(stats)} files in {monitored_path.get('path')}")
+    result = report_harvest_result(
+        path=monitored_path.get('path'),
+        monitored_path_id=monitored_path.get('id'),
+        content={
+            'task': 'file_sizes',
+            'files': [
+                {'path': p, 'size': stat.st_size, 'mtime': stat.st_mtime}
+                for p, stat in stats.items()
+            ]
+        }
+    )
+    if result is None:
+        return {}
+    if not result.ok:
+        try:
+            error = result.json().get('error')
+        except (ValueError, AttributeError):
+            error = None
+        if result.status_code == 400 and error == 'Unrecognised task':
+            # Servers that predate the file_sizes task get a report for each file
+            logger.warning("Server does not support bulk file reports, reporting files individually")
+            return {p: report_file_stat(monitored_path, p, stat, stat_cache) for p, stat in stats.items()}
+        # Reporting each file would only add to the load on a failing server; the batch is retried next cycle
+        logger.error(f"Bulk file report failed (HTTP {result.status_code}): {error}")
+        return {}
+    result = result.json()
+    for f in result.get('settled', []):
+        stat_cache.update(f['path'], state=f['state'])
+    states = {}
+    for f in result.get('files', []):
+        logger.info(f"Server assigned status '{f['state']}' to {f['path']}")
+        stat_cache.update(f['path'], state=f['state'])
+        states[f['path']] = f['state']
+    return states
+
+
+def report_file_stat(monitored_path: dict, full_path: str, stat: os.stat_result, stat_cache: StatCache):
+    try:
+        logger.info(f"Reporting stats for {full_path}")
+        result = report_harvest_result(
+            path=full_path,
+            monitored_path_id=monitored_path.get('id'),
+            content={
+                'task': 'file_size',
+                'size': stat.st_size
+            }
+        )
+        if result is not None:
+            status = result.json()['state']
+            logger.info(f"Server assigned status '{status}'")
+            stat_cache.update(full_path, state=status)
+            return status
+    except BaseException as e:
+        logger.error(e)
+        report_harvest_result(
+            path=full_path,
+            monitored_path_id=monitored_path.get('id'),
+            error=e
+        )
+    return None
+
+
+def harvest_file(full_path: str, monitored_path: dict, stat_cache: StatCache):
+    try:
+        logger.info(f"Parsing file {full_path}")
+        result = import_file(full_path, monitored_path, stat_cache=stat_cache)
+        if result is None:
+            # Tried again next cycle
+            return
+        if result:
+            report = report_harvest_result(
+                path=full_path,
+                monitored_path_id=monitored_path.get('id'),
+                content={'task': 'import', 'status': 'complete'}
+            )
+            # Data queued on the server (HTTP 202) may yet fail to be written, so the file is only
+            # settled once the server reports a final state; until then it is reported each cycle
+            state = None
+            if report is not None and report.ok:
                 try:
-                    logger.info(f"Reporting stats for {file_path}")
-                    result = report_harvest_result(
-                        path=full_path,
-                        monitored_path_id=monitored_path.get('id'),
-                        content={
-                            'task': 'file_size',
-                            'size': os.stat(full_path).st_size
-                        }
-                    )
-                    if result is not None:
-                        result = result.json()
-                        status = result['state']
-                        logger.info(f"Server assigned status '{status}'")
-                        if status in ['STABLE', 'RETRY IMPORT']:
-                            logger.info(f"Parsing file {file_path}")
-                            if import_file(full_path, monitored_path):
-                                report_harvest_result(
-                                    path=full_path,
-                                    monitored_path_id=monitored_path.get('id'),
-                                    content={'task': 'import', 'status': 'complete'}
-                                )
-                                logger.info(f"Successfully parsed file {file_path}")
-                            else:
-                                logger.warn(f"FAILED parsing file {file_path}")
-                                report_harvest_result(
-                                    path=full_path,
-                                    monitored_path_id=monitored_path.get('id'),
-                                    content={'task': 'import', 'status': 'failed'}
-                                )
-                except BaseException as e:
-                    logger.error(e)
-                    report_harvest_result(
-                        path=full_path,
-                        monitored_path_id=monitored_path.get('id'),
-                        error=e
-                    )
-        logger.info(f"Completed directory walking of {path}")
+                    state = report.json().get('state')
+                except ValueError:
+                    pass
+            stat_cache.update(full_path, state=state)
+            if state == 'IMPORTED':
+                logger.info(f"Successfully parsed file {full_path}")
+            else:
+                logger.info(f"Parsed file {full_path}; waiting for the server to finish importing it")
+        else:
+            logger.warn(f"FAILED parsing file {full_path}")
+            report_harvest_result(
+                path=full_path,
+                monitored_path_id=monitored_path.get('id'),
+                content={'task': 'import', 'status': 'failed'}
+            )
+            stat_cache.update(full_path, state='IMPORT FAILED')
     except BaseException as e:
         logger.error(e)
         report_harvest_result(
+            path=full_path,
             monitored_path_id=monitored_path.get('id'),
             error=e
         )
 
 
-def run():
+def run(watcher: PathWatcher = None):
     update_config()
-    harvest()
+    harvest(watcher)
 
 
 def run_cycle():
     sleep_time = 10
+    watcher = get_path_watcher()
     while True:
         try:
-            run()
+            run(watcher)
         except BaseException as e:
             logger.error(e)
         try:
             sleep_time = get_setting('sleep_time')
         except BaseException as e:
             logger.error(e)
-        time.sleep(sleep_time)
+        if watcher is not None:
+            watcher.wait(sleep_time)
+        else:
+            time.sleep(sleep_time)
 
 
 if __name__ == "__main__":
@@ -39,6 +39,66 @@ def get_settings_file() -> pathlib.Path:
     return pathlib.Path(os.getenv('SETTINGS_FILE', "/harvester_files/.harvester.json"))
 
 
+def get_stat_cache_file() -> pathlib.Path:
+    return pathlib.Path(os.getenv('STAT_CACHE_FILE', "/harvester_files/.harvester_cache.json"))
+
+
+def get_parse_cache_dir() -> pathlib.Path:
+    return pathlib.Path(os.getenv('PARSE_CACHE_DIR', "/harvester_files/.harvester_parse_cache"))
+
+
+def get_parse_cache_bytes() -> int:
+    """
+    Maximum size of the parse cache; least recently used entries are removed beyond it. 0 disables the cache.
+    """
+    return max(0, int(os.getenv('HARVESTER_PARSE_CACHE_BYTES', 64_000_000)))
+
+
+def get_watch_mode() -> bool:
+    return (os.getenv('HARVESTER_WATCH') or "FALSE").upper()[0] not in ["F", "0", "N"]
+
+
+def get_full_scan_interval() -> float:
+    return float(os.getenv('HARVESTER_FULL_SCAN_INTERVAL', 3600))
+
+
+def get_compression() -> str:
+    """
+    Content-Encoding used for request bodies sent to the server: 'gzip', 'zstd', or 'none'
+    """
+    return (os.getenv('HARVESTER_COMPRESSION') or "gzip").lower()
+
+
+def get_upload_format() -> str:
+    """
+    Wire format for timeseries data sent to the server: 'json' or 'columnar'
+    """
+    return (os.getenv('HARVESTER_UPLOAD_FORMAT') or "json").lower()
+
+
+def get_upload_threads() -> int:
+    """
+    Number of threads preparing and sending data while a file is parsed
+    """
+    return max(1, int(os.getenv('HARVESTER_UPLOAD_THREADS', 1)))
+
+
+def get_target_upload_latency() -> float|None:
+    """
+    Seconds each data upload should take; chunk sizes adapt to meet it. None to always use the largest chunks.
+    """
+    latency = os.getenv('HARVESTER_TARGET_UPLOAD_SECONDS')
+    return float(latency) if latency else None
+
+
+def get_parse_processes() -> int:
+    """
+    Number of processes used to parse large files, for parsers that support it.
+    Monitored paths may override this with their parse_processes setting.
+    """
+    return max(1, int(os.getenv('HARVESTER_PARSE_PROCESSES', 1)))
+
+
 def get_settings():
     try:
         with open(get_settings_file(), 'r') as f:
@@ -0,0 +1,139 @@
+# SPDX-License-Identifier: BSD-2-Clause
+# Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
+# of Oxford, and the 'Galv' Developers. All rights reserved.
+
+import os
+import threading
+import time
+
+from .settings import get_logger, get_watch_mode, get_full_scan_interval
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+logger = get_logger(__file__)
+
+# Seconds to wait after the first change is noticed so that bursts of writes are handled together
+WATCH_SETTLE_TIME = 1
+
+
+class DirtySet(FileSystemEventHandler):
+    """
+    Collects the paths of files changed within a watched directory.
+    """
+    def __init__(self, changed: threading.Event):
+        self.lock = threading.Lock()
+        self.paths = set()
+        self.needs_rescan = False
+        self.changed = changed
+
+    def on_any_event(self, event):
+        if event.event_type in ['opened', 'closed_no_write']:
+            return
+        with self.lock:
+            if event.is_directory:
+                # Files may have moved in or out with the directory
+                if event.event_type in ['created', 'moved', 'deleted']:
+                    self.needs_rescan = True
+            else:
+                self.paths.add(event.src_path)
+                if getattr(event, 'dest_path', None):
+                    self.paths.add(event.dest_path)
+        self.changed.set()
+
+    def drain(self) -> (set, bool):
+        with self.lock:
+            paths, needs_rescan = self.paths, self.needs_rescan
+            self.paths, self.needs_rescan = set(), False
+        return paths, needs_rescan
+
+
+class PathWatcher:
+    """
+    Watches MonitoredPaths for file changes (using inotify on Linux)
+    so that harvest cycles only need to visit files that changed.
+
+    Files are still found by a full directory walk when a path is first watched,
+    when directories are moved around, and every full_scan_interval seconds,
+    because some changes (e.g. writes to network shares from other machines)
+    do not generate events.
+    """
+    def __init__(self, full_scan_interval: float = None):
+        self.full_scan_interval = full_scan_interval if full_scan_interval is not None else get_full_scan_interval()
+        self.changed = threading.Event()
+        self.watches = {}
+        self.last_full_scan = {}
+        self.observer = Observer()
+        self.observer.daemon = True
+        self.observer.start()
+
+    def watch(self, path: str):
+        if path in self.watches:
+            return
+        if not os.path.isdir(path):
+            logger.warning(f"Cannot watch {path} because it is not a directory")
+            return
+        dirty_set = DirtySet(self.changed)
+        try:
+            watch = self.observer.schedule(dirty_set, path, recursive=True)
+        except OSError as e:
+            logger.warning(f"Unable to watch {path}: {e}")
+            return
+        logger.info(f"Watching {path} for changes")
+        self.watches[path] = (watch, dirty_set)
+
+    def unwatch(self, path: str):
+        watch, _ = self.watches.pop(path, (None, None))
+        if watch is not None:
+            self.observer.unschedule(watch)
+            logger.info(f"Stopped watching {path}")
+        self.last_full_scan.pop(path, None)
+
+    def sync(self, paths: list[str]):
+        """
+        Watch exactly the given paths
+        """
+        for path in [p for p in self.watches.keys() if p not in paths]:
+            self.unwatch(path)
+        for path in paths:
+            self.watch(path)
+
+    def drain(self, path: str) -> set|None:
+        """
+        Return the files changed in path since the last call,
+        or None if the path is due a full scan.
+        """
+        if path not in self.watches:
+            return None
+        _, dirty_set = self.watches[path]
+        paths, needs_rescan = dirty_set.drain()
+        last_full_scan = self.last_full_scan.get(path)
+        if needs_rescan or last_full_scan is None or time.time() - last_full_scan > self.full_scan_interval:
+            self.last_full_scan[path] = time.time()
+            return None
+        return paths
+
+    def wait(self, timeout: float):
+        """
+        Sleep for timeout seconds, or until shortly after a change is noticed
+        """
+        if self.changed.wait(timeout):
+            time.sleep(WATCH_SETTLE_TIME)
+        self.changed.clear()
+
+    def stop(self):
+        self.observer.stop()
+        self.observer.join()
+
+
+def get_path_watcher() -> PathWatcher|None:
+    if not get_watch_mode():
+        return None
+    if Observer is None:
+        logger.warning("HARVESTER_WATCH is set but watchdog is not installed; falling back to polling")
+        return None
+    return PathWatcher()
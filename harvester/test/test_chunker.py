@@ -0,0 +1,141 @@
+# SPDX-License-Identifier: BSD-2-Clause
+# Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
+# of Oxford, and the 'Galv' Developers. All rights reserved.
+
+import unittest
+import numpy as np
+
+from harvester.harvester.chunker import Chunker, ChunkBuilder, JSON_VALUE_BYTES
+
+
+class TestChunker(unittest.TestCase):
+    def test_requires_calibration(self):
+        chunker = Chunker(1000, overhead_bytes=0)
+        self.assertFalse(chunker.calibrated)
+        with self.assertRaises(ValueError):
+            _ = chunker.rows_per_chunk
+
+    def test_numeric_row_size(self):
+        chunker = Chunker(1000, overhead_bytes=0)
+        chunker.calibrate({'a': [1.5, 2.5], 'b': [1, 2]})
+        self.assertEqual(chunker.bytes_per_row, JSON_VALUE_BYTES['f'] + JSON_VALUE_BYTES['i'])
+        columnar = Chunker(1000, columnar=True, overhead_bytes=0)
+        columnar.calibrate({'a': np.array([1.5, 2.5]), 'b': [1, 2]})
+        self.assertEqual(columnar.bytes_per_row, 16)
+
+    def test_sampled_row_size(self):
+        chunker = Chunker(1000, overhead_bytes=0)
+        chunker.calibrate({'s': ['abc', 'def']})
+        # json.dumps gives '["abc", "def"]', 14 characters for 2 values, plus the margin
+        self.assertEqual(chunker.bytes_per_row, 9)
+
+    def test_exact_fit(self):
+        chunker = Chunker(160, columnar=True, overhead_bytes=0)
+        chunker.calibrate({'a': [1.0], 'b': [1.0]})
+        self.assertEqual(chunker.rows_per_chunk, 10)
+        chunker = Chunker(159, columnar=True, overhead_bytes=0)
+        chunker.calibrate({'a': [1.0], 'b': [1.0]})
+        self.assertEqual(chunker.rows_per_chunk, 9)
+
+    def test_single_row(self):
+        chunker = Chunker(16, columnar=True, overhead_bytes=0)
+        chunker.calibrate({'a': [1.0], 'b': [1.0]})
+        self.assertEqual(chunker.rows_per_chunk, 1)
+
+    def test_row_too_large(self):
+        chunker = Chunker(15, columnar=True, overhead_bytes=0)
+        chunker.calibrate({'a': [1.0], 'b': [1.0]})
+        self.assertEqual(chunker.rows_per_chunk, 0)
+
+    def test_overhead_exceeds_budget(self):
+        chunker = Chunker(100, columnar=True, overhead_bytes=100)
+        chunker.calibrate({'a': [1.0]})
+        self.assertEqual(chunker.rows_per_chunk, 0)
+
+    def test_latency_adaptation(self):
+        chunker = Chunker(8000, columnar=True, target_latency=1.0, min_bytes=1000, overhead_bytes=0)
+        chunker.calibrate({'a': [1.0]})
+        self.assertEqual(chunker.rows_per_chunk, 1000)
+        # Slow uploads shrink chunks, but by at most half at a time
+        chunker.record_latency(10.0)
+        self.assertEqual(chunker.target_bytes, 4000)
+        chunker.record_latency(2.0)
+        self.assertEqual(chunker.target_bytes, 2000)
+        # ... and never below min_bytes
+        chunker.record_latency(10.0)
+        chunker.record_latency(10.0)
+        self.assertEqual(chunker.target_bytes, 1000)
+        self.assertEqual(chunker.rows_per_chunk, 125)
+        # Fast uploads grow chunks, but never beyond max_bytes
+        for _ in range(10):
+            chunker.record_latency(0.01)
+        self.assertEqual(chunker.target_bytes, 8000)
+
+    def test_no_latency_target(self):
+        chunker = Chunker(8000, columnar=True, overhead_bytes=0)
+        chunker.record_latency(100.0)
+        self.assertEqual(chunker.target_bytes, 8000)
+
+
+class TestChunkBuilder(unittest.TestCase):
+    def make_builder(self):
+        builder = ChunkBuilder(capacity=2)
+        builder.add_column('f', {'column_name': 'f', 'data_type': 'float'})
+        builder.add_column('i', {'column_id': 1, 'data_type': 'int'})
+        builder.add_column('s', {'column_name': 's', 'data_type': 'str'})
+        return builder
+
+    def test_rows(self):
+        builder = self.make_builder()
+        for n in range(5):
+            builder.append_row({'f': n + 0.5, 'i': np.int64(n), 's': str(n)})
+        self.assertEqual(builder.rows, 5)
+        self.assertIsInstance(builder.columns['f'].values, np.ndarray)
+        self.assertEqual(builder.columns['i'].values.dtype, np.int64)
+        self.assertIsInstance(builder.columns['s'].values, list)
+        f, i, s = builder.take(3)
+        self.assertDictEqual({k: v for k, v in f.items() if k != 'values'}, {'column_name': 'f', 'data_type': 'float'})
+        np.testing.assert_array_equal(f['values'], [0.5, 1.5, 2.5])
+        np.testing.assert_array_equal(i['values'], [0, 1, 2])
+        self.assertListEqual(s['values'], ['0', '1', '2'])
+        self.assertEqual(builder.rows, 2)
+        # Taken values are not changed by later rows
+        builder.append_row({'f': 9.5, 'i': 9, 's': '9'})
+        np.testing.assert_array_equal(f['values'], [0.5, 1.5, 2.5])
+        f, i, s = builder.take(10)
+        np.testing.assert_array_equal(f['values'], [3.5, 4.5, 9.5])
+        self.assertListEqual(s['values'], ['3', '4', '9'])
+        self.assertEqual(builder.rows, 0)
+
+    def test_extend(self):
+        builder = self.make_builder()
+        builder.extend({'f': np.arange(5, dtype=np.float32), 'i': np.arange(5), 's': np.array(list('abcde'))})
+        builder.append_row({'f': 5.0, 'i': 5, 's': 'f'})
+        self.assertEqual(builder.rows, 6)
+        f, i, s = builder.take(6)
+        np.testing.assert_array_equal(f['values'], np.arange(6))
+        self.assertEqual(f['values'].dtype, np.float64)
+        self.assertListEqual(s['values'], list('abcdef'))
+
+    def test_take_columns(self):
+        builder = self.make_builder()
+        builder.extend({'f': np.arange(4.0), 'i': np.arange(4), 's': np.array(list('abcd'))})
+        data = builder.take(2, columns=['i'])
+        self.assertEqual(len(data), 1)
+        np.testing.assert_array_equal(data[0]['values'], [0, 1])
+        # Rows are removed from columns that were not returned too
+        f, i, s = builder.take(2)
+        np.testing.assert_array_equal(f['values'], [2.0, 3.0])
+        self.assertListEqual(s['values'], ['c', 'd'])
+
+    def test_fallback_to_list(self):
+        builder = self.make_builder()
+        builder.append_row({'f': 1.0, 'i': 1, 's': 'a'})
+        builder.append_row({'f': None, 'i': 2 ** 70, 's': 'b'})
+        f, i, s = builder.take(2)
+        self.assertListEqual(f['values'], [1.0, None])
+        self.assertListEqual(i['values'], [1, 2 ** 70])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,11 +5,28 @@
 import unittest
 from unittest.mock import patch
 import os
+import json
+import time
+import struct
+import numpy as np
+import tempfile
 from pathlib import Path
 
 from harvester.harvester.parse.input_file import InputFile
+from harvester.harvester.parse.maccor_input_file import MaccorInputFile, MaccorRawInputFile, MaccorExcelInputFile, \
+    MaccorLabeller
+from harvester.harvester.parse.workbook import openpyxl
+from harvester.harvester.parse.biologic_input_file import BiologicMprInputFile
+from harvester.harvester.parse.ivium_input_file import IviumInputFile, IDF_HEADER
+from harvester.harvester.parse.exceptions import UnsupportedFileTypeError, InvalidDataInFileError
+from harvester.harvester.cache import StatCache, ParseCache
+from harvester.harvester.chunker import ColumnBuffer
 import harvester.harvester.run
+import harvester.harvester.watch
 import harvester.harvester.harvest
+import harvester.harvester.columnar
+import harvester.harvester.api
+from harvester.harvester.pipeline import UploadPipeline, UploadError
 
 def get_test_file_path():
     return os.getenv('TEST_DIR', "/usr/test_data")
@@ -157,8 +174,35 @@ def fail(e, *kwargs):
     raise Exception(e)
 
 
+def write_maccor_raw(path, first_row, last_row, mode='w'):
+    """
+    Write rows first_row to last_row of a Maccor raw file, with its header if mode is 'w'
+    """
+    with open(path, mode) as f:
+        if mode == 'w':
+            f.write((
+                "Today's Date 01/02/2020  Date of Test:\t01/01/2020\t Filename:\t"
+                "C:\\data\\maccor.001 Procedure: Test.000\tComment/Barcode: test\n"
+            ))
+            f.write("Rec#\tCyc#\tStep\tTest (Sec)\tStep (Sec)\tAmp-hr\tWatt-hr\tAmps\tVolts\tState\tES\tDPt Time\n")
+        for i in range(first_row, last_row + 1):
+            f.write((
+                f"{i}\t{i // 100}\t{i // 10 % 3 + 1}\t{i * 0.5}\t{i % 10 * 0.5}\t{i * 1e-3}\t{i * 2e-3}\t"
+                f"{i % 7 - 3}\t{3.5 + i % 10 * 0.01}\tC\t{i % 2}\t01/01/2020 09:00:00\n"
+            ))
+
+
+def report_all_stable(**kwargs):
+    if kwargs.get('content', {}).get('task') == 'file_sizes':
+        files = kwargs['content']['files']
+        return JSONResponse(200, {'files': [{'path': f['path'], 'state': 'STABLE'} for f in files]})
+    if kwargs.get('content', {}).get('status') == 'complete':
+        return JSONResponse(200, {'state': 'IMPORTED'})
+    return JSONResponse(200, {'state': 'STABLE'})
+
+
 class TestHarvester(unittest.TestCase):
-    @patch('requests.get')
+    @patch('harvester.harvester.api.session.get')
     @patch('harvester.harvester.api.logger')
     @patch('harvester.harvester.run.logger')
     @patch('harvester.harvester.api.get_settings_file')
@@ -193,7 +237,7 @@ class TestHarvester(unittest.TestCase):
         Path(os.path.join(get_test_file_path(), 'unparsable.foo')).touch(exist_ok=True)
         Path(os.path.join(get_test_file_path(), 'skipped_by_regex.skip')).touch(exist_ok=True)
         mock_logger.error = fail
-        mock_report.return_value = JSONResponse(200, {'state': 'STABLE'})
+        mock_report.side_effect = report_all_stable
         mock_import.return_value = True
         harvester.harvester.run.harvest_path(Path(get_test_file_path()))
         files = []
@@ -203,7 +247,7 @@ class TestHarvester(unittest.TestCase):
         if len(files) != 5:
             raise AssertionError(f"Did not find 5 files in path {get_test_file_path()}")
         for f in files:
-            for task in ['file_size', 'import']:
+            for task in ['file_sizes', 'import']:
                 ok = False
                 for c in mock_report.call_args_list:
                     if c.kwargs['content']['task'] == task:
@@ -213,6 +257,352 @@ class TestHarvester(unittest.TestCase):
                 if not ok:
                     raise AssertionError(f"{f} did not make call with 'task'={task}")
 
+    @patch('harvester.harvester.run.get_input_file_class')
+    @patch('harvester.harvester.run.report_harvest_result')
+    @patch('harvester.harvester.run.import_file')
+    @patch('harvester.harvester.run.logger')
+    def test_stat_cache(self, mock_logger, mock_import, mock_report, mock_handler):
+        mock_logger.error = fail
+        mock_handler.return_value = InputFile
+
+        mock_report.side_effect = report_all_stable
+        mock_import.return_value = True
+        with tempfile.TemporaryDirectory() as tmp:
+            data_file = os.path.join(tmp, 'data.txt')
+            with open(data_file, 'w') as f:
+                f.write('data')
+            stat_cache = StatCache(os.path.join(tmp, 'cache.json'))
+            harvester.harvester.run.harvest_path({'id': 1, 'path': tmp, 'regex': '^data'}, stat_cache)
+            self.assertEqual(mock_import.call_count, 1)
+            self.assertEqual(stat_cache.get(data_file)['state'], 'IMPORTED')
+            stat_cache.save()
+
+            # Unchanged, imported files cost nothing on later cycles
+            stat_cache = StatCache(os.path.join(tmp, 'cache.json'))
+            harvester.harvester.run.harvest_path({'id': 1, 'path': tmp, 'regex': '^data'}, stat_cache)
+            self.assertEqual(mock_handler.call_count, 1)
+            self.assertEqual(mock_import.call_count, 1)
+            stat_cache.save()
+
+            # Files queued for reimport on the server are reported and imported again, without being sniffed
+            settings = {'monitored_paths': [{'id': 1, 'path': tmp, 'regex': '^data', 'active': True}]}
+            with patch('harvester.harvester.run.get_setting') as mock_setting, \
+                    patch('harvester.harvester.cache.get_stat_cache_file', return_value=os.path.join(tmp, 'cache.json')):
+                mock_setting.side_effect = lambda key: settings.get(key)
+                harvester.harvester.run.harvest()
+                self.assertEqual(mock_import.call_count, 1)
+                settings['pending_reimports'] = [data_file]
+                harvester.harvester.run.harvest()
+            self.assertEqual(mock_handler.call_count, 1)
+            self.assertEqual(mock_import.call_count, 2)
+            stat_cache = StatCache(os.path.join(tmp, 'cache.json'))
+            self.assertEqual(stat_cache.get(data_file)['state'], 'IMPORTED')
+
+            # Changed files are sniffed and reported again
+            with open(data_file, 'a') as f:
+                f.write('more data')
+            harvester.harvester.run.harvest_path({'id': 1, 'path': tmp, 'regex': '^data'}, stat_cache)
+            self.assertEqual(mock_handler.call_count, 2)
+            self.assertEqual(mock_import.call_count, 3)
+
+            # Files whose data are still queued on the server are reported until the server settles them
+            def report_queued(**kwargs):
+                if kwargs['content'].get('status') == 'complete':
+                    return JSONResponse(202, {'state': 'IMPORTING'})
+                return report_all_stable(**kwargs)
+            mock_report.side_effect = report_queued
+            stat_cache.unsettle(data_file)
+            harvester.harvester.run.harvest_path({'id': 1, 'path': tmp, 'regex': '^data'}, stat_cache)
+            self.assertEqual(mock_import.call_count, 4)
+            self.assertFalse(stat_cache.is_settled(data_file, os.stat(data_file)))
+            mock_report.side_effect = lambda **kwargs: JSONResponse(200, {'settled': [
+                {'path': f['path'], 'state': 'IMPORT FAILED'} for f in kwargs['content']['files']
+            ]})
+            harvester.harvester.run.harvest_path({'id': 1, 'path': tmp, 'regex': '^data'}, stat_cache)
+            self.assertEqual(mock_import.call_count, 4)
+            self.assertEqual(stat_cache.get(data_file)['state'], 'IMPORT FAILED')
+            mock_report.side_effect = report_all_stable
+
+            # Removed files are forgotten
+            os.remove(data_file)
+            harvester.harvester.run.harvest_path({'id': 1, 'path': tmp, 'regex': '^data'}, stat_cache)
+            self.assertIsNone(stat_cache.get(data_file))
+
+    @patch('harvester.harvester.run.report_harvest_result')
+    @patch('harvester.harvester.run.logger')
+    def test_file_sizes_fallback(self, mock_logger, mock_report):
+        with tempfile.TemporaryDirectory() as tmp:
+            data_file = os.path.join(tmp, 'data.txt')
+            with open(data_file, 'w') as f:
+                f.write('data')
+            stats = {data_file: os.stat(data_file)}
+            stat_cache = StatCache(os.path.join(tmp, 'cache.json'))
+
+            def tasks():
+                return [c.kwargs['content']['task'] for c in mock_report.call_args_list]
+
+            # A failing server is not sent a report for each file; the batch is tried again next cycle
+            mock_report.side_effect = lambda **kwargs: JSONResponse(503, {'error': 'unavailable'})
+            self.assertDictEqual(harvester.harvester.run.report_file_stats({'id': 1, 'path': tmp}, stats, stat_cache), {})
+            self.assertListEqual(tasks(), ['file_sizes'])
+
+            # Servers that don't know the file_sizes task are sent a report for each file
+            mock_report.reset_mock()
+            mock_report.side_effect = lambda **kwargs: JSONResponse(400, {'error': 'Unrecognised task'}) \
+                if kwargs['content']['task'] == 'file_sizes' else JSONResponse(200, {'state': 'STABLE'})
+            self.assertDictEqual(
+                harvester.harvester.run.report_file_stats({'id': 1, 'path': tmp}, stats, stat_cache),
+                {data_file: 'STABLE'}
+            )
+            self.assertListEqual(tasks(), ['file_sizes', 'file_size'])
+
+    @unittest.skipIf(harvester.harvester.watch.Observer is None, "watchdog is not installed")
+    def test_watch(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            watcher = harvester.harvester.watch.PathWatcher(full_scan_interval=3600)
+            try:
+                watcher.sync([tmp])
+                self.assertIsNone(watcher.drain(tmp), "First drain should request a full scan")
+                data_file = os.path.join(tmp, 'data.txt')
+                with open(data_file, 'w') as f:
+                    f.write('data')
+                watcher.wait(5)
+                self.assertIn(data_file, watcher.drain(tmp))
+                self.assertSetEqual(watcher.drain(tmp), set())
+                watcher.sync([])
+                self.assertIsNone(watcher.drain(tmp))
+            finally:
+                watcher.stop()
+
+    def test_columnar(self):
+        report = {'status': 'success', 'content': {'task': 'import', 'status': 'in_progress', 'data': [
+            {'column_name': 'a', 'values': [0.5, 1.5]},
+            {'column_id': 2, 'values': np.array([1, 2], dtype=np.int32)},
+            {'column_name': 's', 'values': ['x', 'y']},
+        ]}}
+        body = harvester.harvester.columnar.encode(report)
+        header_length, = struct.unpack_from('<I', body)
+        header = json.loads(body[4:4 + header_length])
+        buffers = body[4 + header_length:]
+        a, b, s = header['content']['data']
+        self.assertDictEqual(a['buffer'], {'dtype': '<f8', 'count': 2, 'offset': 0})
+        self.assertDictEqual(b['buffer'], {'dtype': '<i8', 'count': 2, 'offset': 16})
+        self.assertListEqual(s['values'], ['x', 'y'])
+        self.assertNotIn('values', a)
+        np.testing.assert_array_equal(np.frombuffer(buffers, '<f8', 2, 0), [0.5, 1.5])
+        np.testing.assert_array_equal(np.frombuffer(buffers, '<i8', 2, 16), [1, 2])
+
+        # Unsigned values too large for '<i8' are sent as JSON rather than wrapped round to negative numbers
+        big = np.array([1, 2 ** 63 + 1], dtype=np.uint64)
+        report['content']['data'] = [{'column_id': 3, 'values': big}, {'column_id': 4, 'values': big[:1]}]
+        body = harvester.harvester.columnar.encode(report)
+        header_length, = struct.unpack_from('<I', body)
+        big_column, small_column = json.loads(body[4:4 + header_length])['content']['data']
+        self.assertListEqual(big_column['values'], [1, 2 ** 63 + 1])
+        self.assertEqual(small_column['buffer']['dtype'], '<i8')
+        buffer = ColumnBuffer({'data_type': 'int'})
+        buffer.extend(big)
+        self.assertListEqual(list(buffer.view()), [1, 2 ** 63 + 1])
+
+    @patch('harvester.harvester.pipeline.send_report')
+    @patch('harvester.harvester.pipeline.prepare_report')
+    def test_pipeline(self, mock_prepare, mock_send):
+        sent = []
+
+        def prepare(path, monitored_path_id, content=None):
+            # Later chunks are prepared faster, so they are ready to send first
+            time.sleep(0.01 * (5 - content['n'] % 5))
+            return content['n'], {}
+
+        def send(n, headers):
+            sent.append(n)
+            return JSONResponse(200 if n != 7 else 400, {'error': 'rejected'})
+
+        mock_prepare.side_effect = prepare
+        mock_send.side_effect = send
+        with UploadPipeline('/a/file', 1, threads=3, queue_size=2) as pipeline:
+            for n in range(5):
+                pipeline.submit({'n': n})
+            pipeline.close()
+        self.assertListEqual(sent, [0, 1, 2, 3, 4])
+
+        sent.clear()
+        with self.assertRaises(UploadError):
+            with UploadPipeline('/a/file', 1, threads=2, queue_size=2) as pipeline:
+                for n in range(5, 10):
+                    pipeline.submit({'n': n})
+                pipeline.close()
+        # Chunks after the rejected one are not sent
+        self.assertListEqual(sent[:3], [5, 6, 7])
+        self.assertNotIn(8, sent)
+        self.assertNotIn(9, sent)
+
+    @patch('harvester.harvester.pipeline.RETRY_DELAY', 0)
+    @patch('harvester.harvester.pipeline.send_report')
+    @patch('harvester.harvester.pipeline.prepare_report')
+    def test_pipeline_retries(self, mock_prepare, mock_send):
+        sent = []
+
+        def send(n, headers):
+            sent.append(n)
+            if sent.count(n) == 1:
+                return None if n % 2 else JSONResponse(503, {})
+            return JSONResponse(200, {})
+
+        mock_prepare.side_effect = lambda path, monitored_path_id, content=None: (content['n'], {})
+        mock_send.side_effect = send
+        with UploadPipeline('/a/file', 1, threads=2, queue_size=2, retries=1) as pipeline:
+            for n in range(3):
+                pipeline.submit({'n': n})
+            pipeline.close()
+        # Each chunk is sent again before the next is sent
+        self.assertListEqual(sent, [0, 0, 1, 1, 2, 2])
+
+        # Chunks are not sent again unless retries are allowed
+        sent.clear()
+        with self.assertRaises(UploadError):
+            with UploadPipeline('/a/file', 1, threads=2, queue_size=2) as pipeline:
+                pipeline.submit({'n': 0})
+                pipeline.close()
+        self.assertListEqual(sent, [0])
+
+    def test_session_retries(self):
+        retry = harvester.harvester.api.make_session().get_adapter('https://galv').max_retries
+        self.assertTrue(retry.is_retry('GET', 502))
+        # A report may have been processed before a proxy replied 502, so it is not sent again
+        self.assertFalse(retry.is_retry('POST', 502))
+        self.assertFalse(retry.is_retry('POST', 503))
+        self.assertGreater(retry.connect, 0)
+
+    def test_sniff(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            maccor_file = os.path.join(tmp, 'maccor.txt')
+            with open(maccor_file, 'w') as f:
+                f.write("Today''s Date\t01/02/2020 10:11:12 AM\n")
+                f.write("Date of Test:\t01/01/2020 09:00:00 AM\n")
+                f.write("Rec#\tCyc#\tStep\tTestTime\tAmps\tVolts\n")
+                f.write("1\t0\t1\t0.5\t1.5\t3.5\n")
+            fake_mpr = os.path.join(tmp, 'fake.mpr')
+            with open(fake_mpr, 'w') as f:
+                f.write("Not really a BioLogic file")
+            self.assertIs(harvester.harvester.harvest.get_input_file_class(maccor_file), MaccorInputFile)
+            with self.assertRaises(UnsupportedFileTypeError):
+                harvester.harvester.harvest.get_input_file_class(fake_mpr)
+
+    def test_load_blocks(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            maccor_file = os.path.join(tmp, 'maccor.txt')
+            with open(maccor_file, 'w') as f:
+                f.write("Today''s Date\t01/02/2020 10:11:12 AM\n")
+                f.write("Date of Test:\t01/01/2020 09:00:00 AM\n")
+                f.write("Rec#\tCyc#\tStep\tTestTime\tAmps\tVolts\tState\n")
+                for i in range(5):
+                    f.write(f"{i + 1}\t0\t{i // 2 + 1}\t{i + 0.5}\t{i * 0.1}\t3.5\tC\n")
+            input_file = MaccorInputFile(maccor_file, standard_columns={}, standard_units={})
+            columns = ['Rec#', 'Step', 'TestTime', 'Amps', 'State']
+            blocks = list(input_file.load_blocks(columns, block_rows=2))
+            self.assertListEqual([len(b['Rec#']) for b in blocks], [2, 2, 1])
+            self.assertEqual(blocks[0]['Rec#'].dtype, np.int64)
+            self.assertEqual(blocks[0]['Amps'].dtype, np.float64)
+            self.assertEqual(blocks[0]['State'].dtype, object)
+            rows = list(input_file.load_data(maccor_file, columns))
+            for name in columns:
+                values = np.concatenate([b[name] for b in blocks])
+                expected = [r[name] for r in rows]
+                if values.dtype == object:
+                    self.assertListEqual(values.tolist(), expected)
+                else:
+                    np.testing.assert_array_equal(values, np.array(expected, dtype=values.dtype))
+
+        # Column presence, row counts and labels are found in the same pass as the data
+        with tempfile.TemporaryDirectory() as tmp:
+            maccor_file = os.path.join(tmp, 'maccor.txt')
+            with open(maccor_file, 'w') as f:
+                f.write("Today''s Date\t01/02/2020 10:11:12 AM\n")
+                f.write("Date of Test:\t01/01/2020 09:00:00 AM\n")
+                f.write("Rec#\tCyc#\tStep\tTestTime\tAmps\tVolts\tState\n")
+                for i in range(5):
+                    f.write(f"{i + 1}\t0\t{i // 2 + 1}\t{i + 0.5}\t{0 if i < 3 else 1.5}\t3.5\t{'R' if i < 2 else 'C'}\n")
+            input_file = MaccorInputFile(maccor_file, standard_columns={}, standard_units={})
+            self.assertFalse(input_file.column_info['Amps']['has_data'])
+            self.assertNotIn('num_rows', input_file.metadata)
+            blocks = list(input_file.load_blocks(list(input_file.column_info.keys()), block_rows=2))
+            self.assertTrue(input_file.column_info['Amps']['has_data'])
+            self.assertFalse(input_file.column_info['Cyc#']['has_data'])
+            self.assertEqual(input_file.metadata['num_rows'], 5)
+            self.assertEqual(input_file.metadata['first_sample_no'], 1)
+            self.assertEqual(input_file.metadata['last_sample_no'], 5)
+            expected_labels = [
+                ('Step_1_0', (1, 4)),
+                ('State_R_0', (1, 4)),
+                ('Step_2_0', (3, 6)),
+                ('cycle_0', (1, 6)),
+                ('Step_3_0', (5, 6)),
+                ('State_C_0', (3, 6)),
+            ]
+            self.assertListEqual(list(input_file.get_data_labels()), expected_labels)
+            # Labels can also be generated without loading the data first
+            input_file = MaccorInputFile(maccor_file, standard_columns={}, standard_units={})
+            self.assertListEqual(list(input_file.get_data_labels()), expected_labels)
+
+        # Blocks are split without a Python loop over rows where possible,
+        # with the same results as splitting row by row
+        with tempfile.TemporaryDirectory() as tmp:
+            for name, delimiter in [('maccor.csv', ','), ('maccor.txt', '\t')]:
+                maccor_file = os.path.join(tmp, name)
+                with open(maccor_file, 'w') as f:
+                    f.write(f"Today''s Date{delimiter}01/02/2020 10:11:12 AM\n")
+                    f.write(f"Date of Test:{delimiter}01/01/2020 09:00:00 AM\n")
+                    f.write(delimiter.join(["Rec#", "Cyc#", "Step", "TestTime", "Amps", "Volts", "State"]) + "\n")
+                    for i in range(998, 1006):
+                        volts = "" if i == 1003 else "3.5"
+                        rec = f'"{i:,}"' if i == 1005 else f"{i:,}"
+                        f.write(delimiter.join([rec, "0", "1", f"{i}.5", "0.1", volts, "C"]) + "\r\n")
+                input_file = MaccorInputFile(maccor_file, standard_columns={}, standard_units={})
+                blocks = list(input_file.read_blocks(block_rows=3))
+                with patch.object(MaccorInputFile, 'split_block', return_value=None):
+                    row_blocks = list(input_file.read_blocks(block_rows=3))
+                np.testing.assert_array_equal(np.concatenate([b['Rec#'] for b in blocks]), np.arange(998, 1006))
+                for block, row_block in zip(blocks, row_blocks):
+                    for column in block.keys():
+                        np.testing.assert_array_equal(block[column], row_block[column])
+                        self.assertEqual(block[column].dtype, row_block[column].dtype)
+                self.assertTrue(np.isnan(blocks[1]['Volts'][2]))
+                self.assertEqual(blocks[0]['State'][0], 'C')
+
+        class RowsInputFile(InputFile):
+            def load_metadata(self):
+                return {}, {}
+
+            def load_data(self, file_path, columns):
+                for i in range(3):
+                    yield {'a': i * 0.5, 'b': str(i)}
+
+        class BlocksInputFile(InputFile):
+            def load_metadata(self):
+                return {}, {}
+
+            def load_blocks(self, columns, block_rows=2):
+                yield {'a': np.array([0.0, 0.5]), 'b': np.array(['0', '1'], dtype=object)}
+                yield {'a': np.array([1.0]), 'b': np.array(['2'], dtype=object)}
+
+        blocks = list(RowsInputFile('x', standard_columns={}, standard_units={}).load_blocks(['a', 'b'], 2))
+        np.testing.assert_array_equal(np.concatenate([b['a'] for b in blocks]), [0.0, 0.5, 1.0])
+        self.assertListEqual(np.concatenate([b['b'] for b in blocks]).tolist(), ['0', '1', '2'])
+        rows = list(BlocksInputFile('x', standard_columns={}, standard_units={}).load_data('x', ['a', 'b']))
+        self.assertListEqual(rows, [{'a': 0.0, 'b': '0'}, {'a': 0.5, 'b': '1'}, {'a': 1.0, 'b': '2'}])
+
+        class BareInputFile(InputFile):
+            def load_metadata(self):
+                return {}, {}
+
+        # Neither method is implemented, so neither adapter can be used
+        bare = BareInputFile('x', standard_columns={}, standard_units={})
+        with self.assertRaises(UnsupportedFileTypeError):
+            list(bare.load_blocks(['a']))
+        with self.assertRaises(UnsupportedFileTypeError):
+            list(bare.load_data('x', ['a']))
+
     @patch('harvester.harvester.harvest.report_harvest_result')
     @patch('harvester.harvester.harvest.logger')
     @patch('harvester.harvester.settings.get_settings')
@@ -246,6 +636,374 @@ class TestHarvester(unittest.TestCase):
             if not 'values' in row:
                 raise AssertionError(f"'data' contains no 'values' field")
 
+    def test_parallel_raw(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            raw_file = os.path.join(tmp, 'maccor.001')
+            write_maccor_raw(raw_file, 1, 1000)
+            with open(raw_file, 'a') as f:
+                # A row still being written is left for the next read by both
+                f.write("1001\t10")
+            serial = MaccorRawInputFile(raw_file, standard_columns={}, standard_units={})
+            parallel = MaccorRawInputFile(raw_file, standard_columns={}, standard_units={}, parse_processes=2)
+            columns = list(serial.column_info.keys())
+            serial_blocks = list(serial.load_blocks(columns, block_rows=64))
+            with patch('harvester.harvester.parse.maccor_input_file.PARALLEL_PARSE_BYTES', 0), \
+                    patch('harvester.harvester.parse.maccor_input_file.PARSE_RANGE_BYTES', 4096):
+                parallel_blocks = list(parallel.load_blocks(columns, block_rows=64))
+            self.assertGreater(len(parallel_blocks), len(serial_blocks))
+            for column in columns:
+                np.testing.assert_array_equal(
+                    np.concatenate([b[column] for b in parallel_blocks]),
+                    np.concatenate([b[column] for b in serial_blocks])
+                )
+            np.testing.assert_array_equal(np.concatenate([b['Rec#'] for b in parallel_blocks]), np.arange(1, 1001))
+            self.assertListEqual(list(parallel.get_data_labels()), list(serial.get_data_labels()))
+            self.assertEqual(parallel.metadata['num_rows'], 1000)
+
+    def test_resume(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            raw_file = os.path.join(tmp, 'maccor.001')
+            write_maccor_raw(raw_file, 1, 100)
+            with open(raw_file, 'a') as f:
+                # A row still being written
+                f.write("101\t1\t1")
+            input_file = MaccorRawInputFile(raw_file, standard_columns={}, standard_units={})
+            blocks = list(input_file.load_blocks(['Rec#', 'Cyc#', 'Volts']))
+            # The incomplete row is left to be read next time, so every column has the same rows
+            for name in ['Rec#', 'Cyc#', 'Volts']:
+                self.assertEqual(len(np.concatenate([b[name] for b in blocks])), 100)
+            self.assertEqual(input_file.metadata['last_sample_no'], 100)
+            resume_point = input_file.resume_point
+            self.assertEqual(resume_point['rows'], 100)
+            self.assertEqual(os.path.getsize(raw_file) - resume_point['offset'], len("101\t1\t1"))
+
+            # Appended rows are read from the start of the incomplete row, once it is finished
+            with open(raw_file, 'r+') as f:
+                f.truncate(resume_point['offset'])
+            write_maccor_raw(raw_file, 101, 150, 'a')
+            with open(raw_file, 'a') as f:
+                f.write("151\t1\t2\n")
+            resumed = MaccorRawInputFile(raw_file, standard_columns={}, standard_units={})
+            self.assertTrue(resumed.resume(resume_point))
+            self.assertEqual(resumed.resumed_rows, 100)
+            blocks = list(resumed.load_blocks(['Rec#', 'Volts'], block_rows=32))
+            np.testing.assert_array_equal(np.concatenate([b['Rec#'] for b in blocks]), np.arange(101, 151))
+            np.testing.assert_array_equal(
+                np.concatenate([b['Volts'] for b in blocks]),
+                [3.5 + i % 10 * 0.01 for i in range(101, 151)]
+            )
+            self.assertEqual(resumed.metadata['num_rows'], 150)
+            self.assertEqual(resumed.metadata['first_sample_no'], 1)
+            self.assertEqual(resumed.metadata['last_sample_no'], 150)
+            self.assertEqual(resumed.resume_point['rows'], 150)
+            # A final line missing values is also left to be read once it is complete
+            self.assertEqual(os.path.getsize(raw_file) - resumed.resume_point['offset'], len("151\t1\t2\n"))
+
+            # Lines missing values before the end of the file are errors, rather than misaligning the columns
+            malformed_file = os.path.join(tmp, 'malformed.001')
+            write_maccor_raw(malformed_file, 1, 10)
+            with open(malformed_file, 'a') as f:
+                f.write("11\t1\t1\n")
+            write_maccor_raw(malformed_file, 12, 20, 'a')
+            with self.assertRaises(InvalidDataInFileError):
+                list(MaccorRawInputFile(malformed_file, standard_columns={}, standard_units={}).load_blocks(['Rec#']))
+
+            # Files that were changed rather than appended to are read from the start
+            with open(raw_file, 'r+') as f:
+                f.seek(resume_point['offset'] - 10)
+                f.write('X')
+            self.assertFalse(MaccorRawInputFile(raw_file, standard_columns={}, standard_units={}).resume(resume_point))
+            write_maccor_raw(raw_file, 1, 150)
+            with open(raw_file, 'r+') as f:
+                # Date of test 11/02/2020
+                f.seek(13)
+                f.write('1')
+            self.assertFalse(MaccorRawInputFile(raw_file, standard_columns={}, standard_units={}).resume(resume_point))
+
+    @patch('harvester.harvester.pipeline.send_report')
+    @patch('harvester.harvester.pipeline.prepare_report')
+    @patch('harvester.harvester.harvest.report_harvest_result')
+    @patch('harvester.harvester.settings.get_settings')
+    @patch.dict(os.environ, {'HARVESTER_PARSE_CACHE_BYTES': '0'})
+    def test_resume_import(self, mock_settings, mock_report, mock_prepare, mock_send):
+        mock_settings.return_value = ConfigResponse().json()
+        sent = []
+        mock_prepare.side_effect = lambda path, monitored_path_id, content=None: (content, {})
+        mock_send.side_effect = lambda content, headers: sent.append(content) or JSONResponse(200, {})
+
+        def sent_records():
+            return np.concatenate([
+                c['values'] for content in sent for c in content['data'] if c.get('official_sample_counter')
+            ])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            raw_file = os.path.join(tmp, 'maccor.001')
+            write_maccor_raw(raw_file, 1, 100)
+            stat_cache = StatCache(os.path.join(tmp, 'cache.json'))
+            mock_report.return_value = JSONResponse(200, {'upload_info': {'last_record_number': None, 'columns': []}})
+            self.assertTrue(harvester.harvester.harvest.import_file(raw_file, {'id': 1}, stat_cache))
+            np.testing.assert_array_equal(sent_records(), np.arange(1, 101))
+            self.assertEqual(stat_cache.get(raw_file)['resume']['last_record'], 100)
+            columns = [{'name': 'Sample Number', 'id': 1}, {'name': 'Amps', 'id': 2}, {'name': 'Cyc#', 'id': 3}]
+
+            # Only the appended rows are read, and all the columns already sent are sent again
+            sent.clear()
+            write_maccor_raw(raw_file, 101, 150, 'a')
+            stat_cache.update(raw_file, os.stat(raw_file))
+            mock_report.return_value = JSONResponse(200, {'upload_info': {'last_record_number': 100, 'columns': columns}})
+            with patch.object(
+                    MaccorRawInputFile, 'split_block', autospec=True, side_effect=MaccorRawInputFile.split_block
+            ) as mock_split:
+                self.assertTrue(harvester.harvester.harvest.import_file(raw_file, {'id': 1}, stat_cache))
+            self.assertEqual(sum(len(c.args[1]) for c in mock_split.call_args_list), 50)
+            np.testing.assert_array_equal(sent_records(), np.arange(101, 151))
+            self.assertIn('Cyc#', [c.get('column_name') for c in sent[0]['data']])
+            self.assertEqual(sent[-1]['core_metadata']['num_rows'], 150)
+            self.assertEqual(stat_cache.get(raw_file)['resume']['last_record'], 150)
+
+    @patch('harvester.harvester.pipeline.send_report')
+    @patch('harvester.harvester.pipeline.prepare_report')
+    @patch('harvester.harvester.harvest.report_harvest_result')
+    @patch('harvester.harvester.settings.get_settings')
+    @patch.dict(os.environ, {'HARVESTER_PARSE_CACHE_BYTES': '0'})
+    def test_upload_session(self, mock_settings, mock_report, mock_prepare, mock_send):
+        mock_settings.return_value = ConfigResponse().json()
+        sent = []
+        mock_prepare.side_effect = lambda path, monitored_path_id, content=None: (content, {})
+        mock_send.side_effect = lambda content, headers: sent.append(content) or JSONResponse(200, {})
+        declared = {}
+
+        def report(path, monitored_path_id, content=None, error=None):
+            if content['status'] == 'columns':
+                for column in content['columns']:
+                    declared[column['key']] = column
+                return JSONResponse(200, {'upload_session': {
+                    'token': 'token',
+                    'columns': {c['key']: 100 + len(declared) + i for i, c in enumerate(content['columns'])}
+                }})
+            return JSONResponse(200, {
+                'upload_info': {'last_record_number': None, 'columns': []},
+                'upload_session': {'token': 'token', 'columns': {}}
+            })
+        mock_report.side_effect = report
+
+        with tempfile.TemporaryDirectory() as tmp:
+            raw_file = os.path.join(tmp, 'maccor.001')
+            write_maccor_raw(raw_file, 1, 100)
+            self.assertTrue(harvester.harvester.harvest.import_file(raw_file, {'id': 1}))
+        # Columns are described once, and chunks only name them by id
+        self.assertEqual(len([c for c in mock_report.call_args_list if c.kwargs['content']['status'] == 'columns']), 1)
+        self.assertIn('Volts', declared)
+        for content in sent:
+            self.assertEqual(content['upload_session'], 'token')
+            self.assertNotIn('test_date', content)
+            for column in content['data']:
+                self.assertNotIn('column_name', column)
+                self.assertIsInstance(column['column'], int)
+        # Chunks are numbered in order, and each column's samples follow on from those already sent
+        self.assertListEqual([c['sequence'] for c in sent], list(range(len(sent))))
+        samples = {}
+        for content in sent:
+            start, stop = content['samples']
+            for column in content['data']:
+                self.assertEqual(samples.get(column['column'], 0), start)
+                self.assertEqual(len(column['values']), stop - start)
+                samples[column['column']] = stop
+        self.assertSetEqual(set(samples.values()), {100})
+
+    def test_parse_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            raw_file = os.path.join(tmp, 'maccor.001')
+            write_maccor_raw(raw_file, 1, 100)
+            cache = ParseCache(os.path.join(tmp, 'parse_cache'), max_bytes=1_000_000)
+            input_file = MaccorRawInputFile(raw_file, standard_columns={}, standard_units={}, parse_cache=cache)
+            self.assertIsNone(input_file.cached_labels)
+            blocks = list(input_file.load_blocks(['Rec#', 'Volts']))
+            labels = tuple(input_file.get_data_labels())
+            input_file.save_to_parse_cache(labels)
+
+            # Metadata, the attributes load_metadata sets, and labels are restored without reading the file
+            with patch.object(MaccorRawInputFile, 'load_metadata') as mock_load:
+                cached = MaccorRawInputFile(raw_file, standard_columns={}, standard_units={}, parse_cache=cache)
+            mock_load.assert_not_called()
+            self.assertEqual(cached.metadata, input_file.metadata)
+            self.assertEqual(cached.column_info, input_file.column_info)
+            self.assertEqual(cached.num_header_rows, 1)
+            self.assertEqual(cached.cached_labels, labels)
+            cached_blocks = list(cached.load_blocks(['Rec#', 'Volts']))
+            np.testing.assert_array_equal(cached_blocks[0]['Volts'], blocks[0]['Volts'])
+
+            # Changed files are parsed again
+            write_maccor_raw(raw_file, 101, 150, 'a')
+            changed = MaccorRawInputFile(raw_file, standard_columns={}, standard_units={}, parse_cache=cache)
+            self.assertIsNone(changed.cached_labels)
+
+            # The least recently used entries are evicted once the cache is full
+            cache = ParseCache(os.path.join(tmp, 'lru'), max_bytes=2500)
+            cache.put('a', {'value': 'a' * 1000})
+            cache.put('b', {'value': 'b' * 1000})
+            os.utime(cache.entry_file('a'), ns=(1_000_000_000, 1_000_000_000))
+            os.utime(cache.entry_file('b'), ns=(2_000_000_000, 2_000_000_000))
+            self.assertEqual(cache.get('a'), {'value': 'a' * 1000})
+            cache.put('c', {'value': 'c' * 1000})
+            self.assertIsNone(cache.get('b'))
+            self.assertIsNotNone(cache.get('a'))
+            self.assertIsNotNone(cache.get('c'))
+
+    @unittest.skipIf(openpyxl is None, "openpyxl is not installed")
+    def test_excel_sheets(self):
+        headers = ["Cyc#", "Step", "TestTime", "StepTime", "Amp-hr", "Watt-hr", "Amps", "Volts", "State", "ES", "Rec#"]
+        with tempfile.TemporaryDirectory() as tmp:
+            xlsx_file = os.path.join(tmp, 'maccor.xlsx')
+            book = openpyxl.Workbook()
+            book.remove(book.active)
+            for s in range(3):
+                sheet = book.create_sheet(f"Sheet{s}")
+                sheet.append(["Today's Date", 43832.5, "Date of Test:", 43831.25, "Filename:", "C:\\data\\maccor.xlsx"])
+                sheet.append(headers)
+                for i in range(s * 500, (s + 1) * 500):
+                    sheet.append([
+                        i // 100, i // 10 % 3 + 1, i * 0.5, i % 10 * 0.5, 0 if i < 700 else i * 1e-3, i * 2e-3,
+                        (i % 7 - 3) * 0.25, 3.5 + i % 10 * 0.01, "C", i % 2, f"{i + 1:,}"
+                    ])
+            book.save(xlsx_file)
+            serial = MaccorExcelInputFile(xlsx_file, standard_columns={}, standard_units={})
+            parallel = MaccorExcelInputFile(xlsx_file, standard_columns={}, standard_units={}, parse_processes=2)
+            self.assertListEqual(list(serial.column_info.keys()), headers)
+            self.assertEqual(str(serial.metadata['Date of Test']), '2020-01-01 06:00:00')
+            # Column presence is only known once the sheets are read
+            self.assertFalse(serial.column_info['Amp-hr']['has_data'])
+            serial_blocks = list(serial.load_blocks(headers, block_rows=200))
+            parallel_blocks = list(parallel.load_blocks(headers, block_rows=200))
+            self.assertTrue(serial.column_info['Amp-hr']['has_data'])
+            self.assertEqual(len(serial_blocks), 9)
+            for column in headers:
+                np.testing.assert_array_equal(
+                    np.concatenate([b[column] for b in parallel_blocks]),
+                    np.concatenate([b[column] for b in serial_blocks])
+                )
+            self.assertEqual(serial_blocks[0]['Volts'].dtype, np.float64)
+            np.testing.assert_array_equal(np.concatenate([b['Rec#'] for b in serial_blocks]), np.arange(1, 1501))
+            self.assertListEqual(list(parallel.get_data_labels()), list(serial.get_data_labels()))
+            self.assertEqual(serial.metadata['num_rows'], 1500)
+            self.assertEqual(serial.metadata['last_sample_no'], 1500)
+
+    @patch('harvester.harvester.parse.biologic_input_file.BioLogic.MPRfile')
+    def test_biologic_blocks(self, mock_mpr):
+        data = np.zeros(10, dtype=[('time/s', '<f8'), ('I/mA', '<f4'), ('control/mA', '<f4'), ('Ns', '<u2')])
+        data['time/s'] = np.arange(10)
+        data['I/mA'] = 250
+        data['control/mA'] = 250
+        mock_mpr.return_value.data = data
+        standard_columns = {
+            k: i for i, k in enumerate([
+                'Amps', 'Volts', 'Time', 'Energy Capacity', 'Charge Capacity',
+                'Temperature', 'Impedence Magnitude', 'Impedence Phase', 'Frequency'
+            ])
+        }
+        input_file = BiologicMprInputFile('test.mpr', standard_columns=standard_columns, standard_units={})
+        blocks = list(input_file.load_blocks(['time/s', 'I/mA', 'control/mA'], block_rows=4))
+        self.assertEqual(len(blocks), 3)
+        self.assertListEqual(list(blocks[0].keys()), ['time/s', 'I/mA', 'control/mA'])
+        # Fields are passed on without copying
+        self.assertTrue(np.shares_memory(blocks[0]['time/s'], data))
+        np.testing.assert_array_equal(np.concatenate([b['time/s'] for b in blocks]), np.arange(10))
+        # Columns mapped to standard columns are converted to their units
+        np.testing.assert_allclose(np.concatenate([b['I/mA'] for b in blocks]), 0.25)
+        np.testing.assert_array_equal(np.concatenate([b['control/mA'] for b in blocks]), 250)
+
+    @patch('harvester.harvester.parse.biologic_input_file.BioLogic.MPRfile')
+    def test_biologic_labels(self, mock_mpr):
+        data = np.zeros(6, dtype=[('Ns', '<u2'), ('time/s', '<f8'), ('control/V/mA', '<f4')])
+        data['Ns'] = [0, 0, 1, 1, 1, 2]
+        data['time/s'] = np.arange(6) * 10
+        data['control/V/mA'] = [-1, -1, 0, 0, 0, 2]
+        flags = {'mode': np.array([1, 1, 3, 3, 3, 2]), 'Ns changes': np.array([0, 0, 1, 0, 0, 1], dtype=bool)}
+        mock_mpr.return_value.data = data
+        mock_mpr.return_value.get_flag.side_effect = flags.get
+        input_file = BiologicMprInputFile('test.mpr', standard_columns={}, standard_units={})
+        self.assertListEqual(list(input_file.get_data_labels()), [
+            ('Ns_0_CC', (1, 1), 'Discharge at -1.0 mA for 20.0 seconds'),
+            ('Ns_1_Rest', (2, 4), 'Rest for 30.0 seconds'),
+        ])
+
+    def test_labeller(self):
+        column_info = {
+            'Amps': {'is_numeric': True, 'has_data': True},
+            'Step': {'is_numeric': True, 'has_data': True},
+            'State': {'is_numeric': False, 'has_data': True},
+        }
+        block = {
+            'Amps': np.array([0.0, 1.0, 1.0, -1.0, -1.0, 0.0, 0.0, 2.0, np.nan, -2.0, 1.0]),
+            'Step': np.array([1, 1, 2, 2, 2, 3, 3, 1, 1, 1, 1]),
+            'State': np.array(list('RCCDDRRCCDC'), dtype=object),
+        }
+        expected = [
+            ('State_R_0', (1, 3)),
+            ('Step_1_0', (1, 4)),
+            ('State_C_0', (2, 5)),
+            ('cycle_0', (2, 7)),
+            ('Step_2_0', (3, 7)),
+            ('State_D_0', (4, 7)),
+            ('Step_3_0', (6, 9)),
+            ('State_R_1', (6, 9)),
+            ('State_C_1', (8, 11)),
+            ('cycle_1', (8, 12)),
+            ('State_D_1', (10, 12)),
+            ('cycle_2', (11, 12)),
+            ('Step_1_1', (8, 12)),
+            ('State_C_2', (11, 12)),
+        ]
+        # Labels do not depend on how the rows are split into blocks
+        for block_rows in [1, 4, 11]:
+            labeller = MaccorLabeller(column_info)
+            for start in range(0, 11, block_rows):
+                labeller.feed({k: v[start:start + block_rows] for k, v in block.items()}, start)
+            self.assertListEqual(labeller.finish(), expected)
+
+    def test_ivium_samples(self):
+        metadata = [
+            "Mconfig=", "starttime=01/02/2020 10:00:00", "Tasks=2",
+            "Tasks.Mode[1]=CC", "Tasks.End1[1]=Duration", "Tasks.End2[1]=select",
+            "Tasks.End3[1]=select", "Tasks.End4[1]=select", "Tasks.Duration[1]=9.5",
+            "Tasks.Mode[2]=OCP", "Tasks.End1[2]=E<", "Tasks.End2[2]=select",
+            "Tasks.End3[2]=select", "Tasks.End4[2]=select", "Tasks.E<[2]=3.2",
+            "primary_data", "3", "100", "0",
+        ]
+        with tempfile.TemporaryDirectory() as tmp:
+            def write(name, irregular_line):
+                path = os.path.join(tmp, name)
+                with open(path, 'wb') as f:
+                    f.write(IDF_HEADER + b"\r\n")
+                    f.write("".join(f"{line}\r\n" for line in metadata).encode())
+                    for i in range(100):
+                        t = i * 0.5
+                        f.write(f"{t:12.5E} {0.1 if t < 10 else 0.0:12.5E} {3.5 - max(t - 10, 0) * 0.05:12.5E}\r\n".encode())
+                        if i == 50:
+                            f.write(irregular_line)
+                return path
+
+            input_file = IviumInputFile(
+                write('ivium.idf', b"not a sample\r\n"), standard_columns={}, standard_units={}
+            )
+            self.assertEqual(input_file.metadata['num_rows'], 100)
+            blocks = list(input_file.load_blocks(['test_time', 'volts'], block_rows=32))
+            self.assertEqual(len(blocks), 4)
+            self.assertListEqual(list(blocks[0].keys()), ['test_time', 'volts'])
+            np.testing.assert_array_equal(np.concatenate([b['test_time'] for b in blocks]), np.arange(100) * 0.5)
+            self.assertListEqual(list(input_file.get_data_labels()), [
+                ('task_0_CC', (0, 21), 'Discharge at 0.0 A for 10.0 seconds'),
+                ('task_1_OCP', (21, 34), 'Rest for 6.5 seconds'),
+            ])
+
+            # Samples that are not fixed width are found, but cannot be read
+            input_file = IviumInputFile(
+                write('invalid.idf', b"1.0 2.0 3.0\r\n"), standard_columns={}, standard_units={}
+            )
+            self.assertEqual(input_file.metadata['num_rows'], 101)
+            with self.assertRaises(InvalidDataInFileError):
+                list(input_file.load_blocks(['test_time'], block_rows=32))
+
     def test_import_mpr(self):
         self.import_file('adam_3_C05.mpr')
 